@@ -1,6 +1,11 @@
+import base64
+import hashlib
+import json
 import os
+import threading
+import time
 import uuid
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta
 from pathlib import Path
 
 import yaml
@@ -10,14 +15,30 @@ from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
 import config
+from metrics import AUTH_SECONDS
+from model.context import SESSION_CONTEXTS, SessionContext
+from model.kvpool import KV_POOL
+from model.scheduler import SCHEDULER
+from session_store import open_session_store
 
 # Constants
 ALGORITHM = "EdDSA"
 SESSION_TIMEOUT = timedelta(seconds=(config.SERVER_TIMEOUT_MINUTES * 60))
 auth_scheme = HTTPBearer()
+# Older servers kept the blob store at users/blobs, where it would be this user's folder
+RESERVED_USERNAMES = {"blobs"}
 
-# In-memory session map: session_id -> {username, last_seen}
-ACTIVE_SESSIONS = {}
+# Session store: session_id -> {session_id, username, session_dir, saveInteractions}
+ACTIVE_SESSIONS = open_session_store(SESSION_TIMEOUT.total_seconds())
+
+
+def release_session(session_id):
+    """Drop an expired session's context and unpin its KV pages."""
+    SESSION_CONTEXTS.pop(session_id, None)
+    SCHEDULER.call(KV_POOL.release, session_id)
+
+
+ACTIVE_SESSIONS.on_expire.append(release_session)
 
 
 def get_config_dir():
@@ -33,7 +54,7 @@ def load_public_keys():
         RuntimeError if any file is missing or PEM formatting is invalid.
 
     Returns:
-        dict[str, str]: username -> PEM public key
+        dict[str, tuple[str, str]]: username -> (key file name, PEM public key)
     """
     config_dir = get_config_dir()
     conf_path = config_dir / "server.conf"
@@ -49,6 +70,8 @@ def load_public_keys():
 
     keys = {}
     for username, key_filename in config.get("clients", []):
+        if username in RESERVED_USERNAMES:
+            raise RuntimeError(f"Username '{username}' is reserved")
         key_path = keys_dir / key_filename
         if not key_path.exists():
             raise RuntimeError(f"Missing key file for user '{username}': {key_path}")
@@ -57,13 +80,127 @@ def load_public_keys():
             raise RuntimeError(
                 f"Key for user '{username}' is not PEM format: {key_path}"
             )
-        keys[username] = pem
+        keys[username] = (key_filename, pem)
 
     return keys
 
 
-# Load trusted PEM-formatted public keys from disk once at startup
-PUBLIC_KEYS = load_public_keys()
+def key_files_stamp():
+    """Modification times of server.conf and every key file, to detect edits."""
+    config_dir = get_config_dir()
+    try:
+        stamp = [(config_dir / "server.conf").stat().st_mtime_ns]
+        stamp += sorted(
+            (p.name, p.stat().st_mtime_ns) for p in (config_dir / "keys").iterdir()
+        )
+    except OSError:
+        return None
+    return tuple(stamp)
+
+
+def peek_token(token: str):
+    """
+    Header and claims of a compact JWT, NOT verified.
+    Only used to pick which key to verify the token with.
+    """
+    try:
+        parts = [
+            json.loads(base64.urlsafe_b64decode(seg + "=" * (-len(seg) % 4)))
+            for seg in token.split(".")[:2]
+        ]
+    except (ValueError, IndexError, TypeError):
+        return {}, {}
+    if len(parts) < 2 or not all(isinstance(part, dict) for part in parts):
+        return {}, {}
+    return parts[0], parts[1]
+
+
+class KeyRing:
+    """
+    Trusted client keys, parsed once and indexed by username and key file name.
+
+    A token names its key through the `kid` header (username or key file, with or
+    without extension) or its `sub`/`username` claim, so verification tries one
+    key instead of all of them. Tokens that name no key fall back to trying each.
+    Verified tokens are remembered by digest for AUTH_TOKEN_CACHE_SECONDS (never
+    past their `exp`). Keys are loaded by the startup "keys" stage, or on first
+    use, and reloaded when server.conf or keys/ change.
+    """
+
+    def __init__(self):
+        self.keys = {}  # username -> parsed JsonWebKey
+        self.kids = {}  # kid -> username
+        self.verified = {}  # sha256(token) -> (username, expires_at)
+        self.stamp = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def load(self):
+        stamp = key_files_stamp()
+        keys, kids = {}, {}
+        for username, (key_filename, pem) in load_public_keys().items():
+            keys[username] = JsonWebKey.import_key(pem, {"kty": "OKP"})
+            kids[username] = username
+            kids[key_filename] = username
+            kids[Path(key_filename).stem] = username
+        with self.lock:
+            self.keys, self.kids, self.stamp = keys, kids, stamp
+            self.verified.clear()
+        print(f"🔑 Loaded {len(keys)} client keys")
+
+    def refresh(self):
+        """Reload keys if server.conf or keys/ changed; keeps the old set on error."""
+        now = time.monotonic()
+        if now - self.checked < config.AUTH_KEY_RELOAD_SECONDS:
+            return
+        self.checked = now
+        if key_files_stamp() == self.stamp:
+            return
+        try:
+            self.load()
+        except (RuntimeError, OSError, ValueError) as e:
+            print(f"⚠️ Keeping previous client keys, reload failed: {e}")
+
+    def candidates(self, token: str) -> list:
+        header, claims = peek_token(token)
+        if header.get("alg") != ALGORITHM:
+            return []  # Only Ed25519 client keys are trusted
+        for hint in (header.get("kid"), claims.get("sub"), claims.get("username")):
+            username = self.kids.get(hint) if isinstance(hint, str) else None
+            if username is not None:
+                return [(username, self.keys[username])]
+        return list(self.keys.items())
+
+    def verify(self, token: str) -> str | None:
+        """Username whose key signed `token`, or None if no trusted key did."""
+        self.refresh()  # A reload also drops tokens verified by removed keys
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        cached = self.verified.get(digest)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        for username, jwk in self.candidates(token):
+            try:
+                claims = jwt.decode(token, key=jwk)
+                claims.validate()
+            except Exception:
+                continue  # authlib raises assorted errors for malformed tokens
+            expires_at = now + config.AUTH_TOKEN_CACHE_SECONDS
+            if isinstance(claims.get("exp"), (int, float)):
+                expires_at = min(expires_at, claims["exp"])
+            with self.lock:
+                if len(self.verified) >= 1024:
+                    self.verified = {
+                        k: v for k, v in self.verified.items() if v[1] > now
+                    }
+                self.verified[digest] = (username, expires_at)
+            return username
+        return None
+
+
+# Trusted public keys, parsed once during startup
+KEYRING = KeyRing()
 
 from fastapi.responses import JSONResponse  # Add at the top if not already
 
@@ -71,36 +208,25 @@ from fastapi.responses import JSONResponse  # Add at the top if not already
 def verify_jwt_and_create_session(
     credentials: HTTPAuthorizationCredentials = Depends(auth_scheme),
 ):
-    token = credentials.credentials
-
-    for username, pem in PUBLIC_KEYS.items():
-        try:
-            print(f"🔍 Trying key for {username}")
-            jwk = JsonWebKey.import_key(pem, {"kty": "OKP"})
-            claims = jwt.decode(token, key=jwk)
-            claims.validate()
+    start = time.perf_counter()
+    username = KEYRING.verify(credentials.credentials)
+    AUTH_SECONDS.observe(time.perf_counter() - start)
+    if username is None:
+        print("❌ No matching key could validate the token.")
+        raise HTTPException(status_code=401, detail="No matching key for token")
 
-            session_id = str(uuid.uuid4())
-            ACTIVE_SESSIONS[session_id] = {
-                "username": username,
-                "last_seen": datetime.now(timezone.utc),
-            }
-            print(f"✅ JWT validated for {username}")
-            return {"session_id": session_id, "username": username}
-
-        except Exception as e:
-            print(f"❌ Key for {username} failed: {e}")
-            continue
-
-    print("❌ No matching key could validate the token.")
-    raise HTTPException(status_code=401, detail="No matching key for token")
+    session_id = str(uuid.uuid4())
+    ACTIVE_SESSIONS.create(session_id, username=username)
+    print(f"✅ JWT validated for {username}")
+    return {"session_id": session_id, "username": username}
 
 
 def require_session(request: Request):
     """
     Validate presence of a session token in the request headers.
 
-    Checks for expiration and removes inactive sessions.
+    Expired sessions are rejected. A session restored from a persistent store
+    after a restart gets a fresh context bound to its session directory.
 
     Raises:
         HTTPException 401 for missing, invalid, or expired session.
@@ -114,15 +240,14 @@ def require_session(request: Request):
 
     session = ACTIVE_SESSIONS.get(session_id)
     if not session:
-        raise HTTPException(status_code=401, detail="Invalid session token")
-
-    now = datetime.now(timezone.utc)
-    last_seen = session["last_seen"]
-    if last_seen.tzinfo is None:
-        last_seen = last_seen.replace(tzinfo=timezone.utc)
-
-    if now - last_seen > SESSION_TIMEOUT:
-        del ACTIVE_SESSIONS[session_id]
-        raise HTTPException(status_code=401, detail="Session expired")
+        raise HTTPException(status_code=401, detail="Invalid or expired session token")
+
+    if session_id not in SESSION_CONTEXTS and session.get("session_dir"):
+        SESSION_CONTEXTS[session_id] = SessionContext(
+            session_id,
+            Path(session["session_dir"]),
+            session.get("saveInteractions", False),
+            session["username"],
+        )
 
     return session
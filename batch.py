@@ -0,0 +1,47 @@
+"""
+Offline batch completion, without the HTTP server:
+
+    python batch.py prompts.jsonl results.jsonl
+
+Each input line is a /stream request body ({"prompt": ..., "max_tokens": ...})
+with an optional "id". Results are appended to the output as items finish, so
+running the same command again after a crash picks up where it stopped.
+Loads the active model (or the stub backend with KARLLM_BACKEND=stub).
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+from model.batch import run_batch
+from model.init import load_model
+from model.scheduler import SCHEDULER
+
+
+def report(summary):
+    print(
+        f"\r📦 {summary['completed']}/{summary['total']} items, "
+        f"{summary['errors']} errors, {summary['tokens_per_second']:.1f} tokens/s",
+        end="",
+        file=sys.stderr,
+    )
+
+
+async def main(input_path: Path, output_path: Path):
+    await asyncio.to_thread(load_model)
+    SCHEDULER.start()
+    summary = await run_batch(input_path, output_path, report)
+    print(file=sys.stderr)
+    print(
+        f"✅ {summary['completed']} items, {summary['new_tokens']} tokens "
+        f"in {summary['seconds']:.1f}s ({summary['tokens_per_second']:.1f} tokens/s)"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline batch completion")
+    parser.add_argument("input", type=Path, help="JSONL file of prompts")
+    parser.add_argument("output", type=Path, help="JSONL results, appended to")
+    args = parser.parse_args()
+    asyncio.run(main(args.input, args.output))
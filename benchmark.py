@@ -0,0 +1,369 @@
+"""
+HTTP load generator for the server.
+
+    # Test keys: a server config dir (point XDG_CONFIG_HOME at it) and a private key
+    python benchmark.py keys /tmp/karllm-bench
+
+    # Server on a CPU-only box, with the stub model backend
+    cd /tmp/karllm-bench && XDG_CONFIG_HOME=/tmp/karllm-bench KARLLM_BACKEND=stub \\
+        KARLLM_WORKING_DIR=/tmp/karllm-bench/ \\
+        uvicorn server:app --app-dir /path/to/karllm-server --port 34199
+
+    python benchmark.py run --url http://127.0.0.1:34199 \\
+        --key /tmp/karllm-bench/bench.pem --concurrency 8 --duration 60 \\
+        --mix stream=8,read=1,switch=1 --out run.json
+
+Each virtual user connects with its own session, then drives /stream, /read
+and /convo/switch in the given proportions. The JSON report has TTFT,
+throughput and p50/p90/p99 latency per endpoint, so runs can be diffed.
+Answer lengths are capped with max_tokens; prompts also carry a [stub:N]
+marker that the stub backend answers with exactly N tokens.
+"""
+
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+WORDS = (
+    "function value return list index buffer cache token model server request "
+    "session context file write read parse error result class method test"
+).split()
+
+
+def make_keys(directory: Path, username: str):
+    """Write an Ed25519 key pair: config for the server, private key for the client."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+    key = Ed25519PrivateKey.generate()
+    config_dir = directory / "karllm"
+    (config_dir / "keys").mkdir(parents=True, exist_ok=True)
+    (config_dir / "keys" / f"{username}.pem").write_bytes(
+        key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+    )
+    (config_dir / "server.conf").write_text(
+        f"clients:\n  - [{username}, {username}.pem]\n"
+    )
+    private_path = directory / f"{username}.pem"
+    private_path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    print(f"🔑 Server config in {config_dir}, private key {private_path}")
+
+
+def sign_token(private_pem: bytes, username: str) -> str:
+    from authlib.jose import jwt
+
+    now = int(time.time())
+    claims = {"sub": username, "iat": now, "exp": now + 24 * 3600}
+    return jwt.encode({"alg": "EdDSA", "kid": username}, claims, private_pem).decode()
+
+
+def parse_range(spec: str) -> tuple:
+    """Bounds of a length spec: "N", or "A:B" for uniform between A and B."""
+    low, _, high = spec.partition(":")
+    return int(low), int(high or low)
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("stream", "read", "switch"):
+            raise ValueError(f"Unknown operation in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def rank(p):
+        return values[min(len(values) - 1, max(0, round(p * len(values)) - 1))]
+
+    return {
+        "p50": round(rank(0.50), 4),
+        "p90": round(rank(0.90), 4),
+        "p99": round(rank(0.99), 4),
+        "mean": round(sum(values) / len(values), 4),
+        "max": round(values[-1], 4),
+    }
+
+
+class Client:
+    """One keep-alive HTTP connection with the session token of a virtual user."""
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        connection = (
+            http.client.HTTPSConnection
+            if parts.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.conn = connection(parts.hostname, parts.port, timeout=600)
+        self.headers = {}
+
+    def request(self, method, path, body=None, headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers = {"Content-Type": "application/json", **(headers or {})}
+        self.conn.request(
+            method, path, body=body, headers={**self.headers, **(headers or {})}
+        )
+        return self.conn.getresponse()
+
+    def json(self, method, path, body=None, headers=None):
+        response = self.request(method, path, body, headers)
+        data = response.read()
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path}: {response.status} {data[:200]!r}")
+        return json.loads(data) if data else {}
+
+    def events(self, response):
+        """Decoded `data:` payloads of a server-sent event stream."""
+        for line in response:
+            line = line.strip()
+            if line.startswith(b"data:"):
+                yield json.loads(line[5:])
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, index, args, token, stop_at, budget, records):
+        super().__init__(name=f"user-{index}", daemon=True)
+        self.index = index
+        self.args = args
+        self.token = token
+        self.stop_at = stop_at
+        self.budget = budget
+        self.records = records
+        self.rng = random.Random(args.seed * 1000 + index)
+        self.mix = parse_mix(args.mix)
+        self.conversation = None
+        self.files = []
+
+    def run(self):
+        client = Client(self.args.url)
+        try:
+            self.setup(client)
+        except Exception as e:
+            print(f"❌ {self.name} could not connect: {e}", file=sys.stderr)
+            return
+        while time.time() < self.stop_at and self.budget.take():
+            op = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+            start = time.perf_counter()
+            record = {"op": op, "ok": False}
+            try:
+                record.update(getattr(self, op)(client, start))
+                record["ok"] = True
+            except Exception as e:
+                record["error"] = str(e)
+                client = Client(self.args.url)
+                client.headers = {"X-Session-Token": self.session_id}
+            record["latency"] = time.perf_counter() - start
+            self.records.append(record)
+
+    def setup(self, client):
+        session = client.json(
+            "POST",
+            "/connect",
+            {"saveInteractions": True},
+            {"Authorization": f"Bearer {self.token}"},
+        )
+        self.session_id = session["session_id"]
+        self.conversation = Path(session["session_directory"]).name
+        client.headers = {"X-Session-Token": self.session_id}
+        for i in range(self.args.files if "read" in self.mix else 0):
+            name = f"bench-{self.index}-{i}.txt"
+            body = self.text(self.args.file_bytes // 6).encode()[: self.args.file_bytes]
+            client.json("PUT", f"/upload/{name}", body)
+            self.files.append(name)
+
+    def text(self, words: int) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(words))
+
+    def stream(self, client, start) -> dict:
+        prompt_words = self.rng.randint(*parse_range(self.args.prompt_words))
+        answer = self.rng.randint(*parse_range(self.args.response_tokens))
+        prompt = f"{self.text(prompt_words)}\nReply with about {answer} words. [stub:{answer}]"
+        response = client.request(
+            "POST", "/stream", {"prompt": prompt, "max_tokens": answer}
+        )
+        if response.status >= 400:
+            raise RuntimeError(f"/stream: {response.status} {response.read()[:200]!r}")
+        ttft = None
+        stats = {}
+        for event in client.events(response):
+            if "error" in event:
+                raise RuntimeError(event["error"])
+            if event.get("text") == "[DONE]":
+                stats = event.get("stats", {})
+            elif event.get("text") and ttft is None:
+                ttft = time.perf_counter() - start
+        return {
+            "ttft": ttft,
+            "tokens": stats.get("new_tokens", 0),
+            "tokens_per_second": stats.get("tokens_per_second"),
+        }
+
+    def read(self, client, start) -> dict:
+        name = self.rng.choice(self.files)
+        client.json("POST", "/read", {"filename": name, "force": self.args.read_force})
+        return {}
+
+    def switch(self, client, start) -> dict:
+        client.json("POST", f"/convo/switch/{self.conversation}")
+        return {}
+
+
+class Budget:
+    """Shared cap on the number of requests, if --requests is given."""
+
+    def __init__(self, total):
+        self.remaining = total
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self.lock:
+            if self.remaining is None:
+                return True
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def wait_ready(url: str, timeout: float):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            response = Client(url).request("GET", "/health/ready")
+            response.read()
+            if response.status == 200:
+                return
+        except OSError:
+            pass
+        if time.time() > deadline:
+            raise RuntimeError(f"Server at {url} not ready after {timeout:.0f}s")
+        time.sleep(1)
+
+
+def report(args, records: list, wall: float) -> dict:
+    result = {
+        "config": {
+            k: v for k, v in vars(args).items() if k not in ("key", "command", "out")
+        },
+        "wall_seconds": round(wall, 3),
+        "requests": len(records),
+        "requests_per_second": round(len(records) / wall, 3) if wall else 0.0,
+        "operations": {},
+    }
+    for op in ("stream", "read", "switch"):
+        done = [r for r in records if r["op"] == op]
+        if not done:
+            continue
+        ok = [r for r in done if r["ok"]]
+        entry = {
+            "count": len(done),
+            "errors": len(done) - len(ok),
+            "rejected": sum(": 429 " in r.get("error", "") for r in done),
+            "latency": percentiles([r["latency"] for r in ok]),
+        }
+        if op == "stream":
+            tokens = sum(r["tokens"] for r in ok)
+            entry["ttft"] = percentiles(
+                [r["ttft"] for r in ok if r["ttft"] is not None]
+            )
+            entry["tokens"] = tokens
+            entry["throughput_tokens_per_second"] = (
+                round(tokens / wall, 2) if wall else 0.0
+            )
+            entry["per_request_tokens_per_second"] = percentiles(
+                [r["tokens_per_second"] for r in ok if r["tokens_per_second"]]
+            )
+        errors = sorted({r["error"] for r in done if not r["ok"]})
+        if errors:
+            entry["error_samples"] = errors[:5]
+        result["operations"][op] = entry
+    return result
+
+
+def run(args):
+    token = sign_token(Path(args.key).read_bytes(), args.user)
+    wait_ready(args.url, args.ready_timeout)
+    records = []
+    budget = Budget(args.requests)
+    start = time.perf_counter()
+    stop_at = time.time() + (args.duration if args.duration else float("inf"))
+    users = [
+        VirtualUser(i, args, token, stop_at, budget, records)
+        for i in range(args.concurrency)
+    ]
+    print(f"🚀 {args.concurrency} users against {args.url}", file=sys.stderr)
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    result = report(args, records, time.perf_counter() - start)
+    output = json.dumps(result, indent=2)
+    if args.out:
+        Path(args.out).write_text(output + "\n")
+        print(f"✅ Report written to {args.out}", file=sys.stderr)
+    else:
+        print(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    keys = commands.add_parser("keys", help="Write test keys for the server and client")
+    keys.add_argument("directory", type=Path)
+    keys.add_argument("--user", default="bench")
+
+    bench = commands.add_parser("run", help="Drive the server and report as JSON")
+    bench.add_argument("--url", default="http://10.224.174.3:34199")
+    bench.add_argument("--key", required=True, help="Client private key (PEM)")
+    bench.add_argument("--user", default="bench")
+    bench.add_argument("--concurrency", type=int, default=4)
+    bench.add_argument(
+        "--duration", type=float, default=60, help="Seconds; 0 for no limit"
+    )
+    bench.add_argument("--requests", type=int, default=None, help="Total request cap")
+    bench.add_argument("--mix", default="stream=8,read=1,switch=1")
+    bench.add_argument("--prompt-words", default="32:128", help="N or A:B")
+    bench.add_argument("--response-tokens", default="64:256", help="N or A:B")
+    bench.add_argument("--files", type=int, default=4, help="Files per user for /read")
+    bench.add_argument("--file-bytes", type=int, default=4096)
+    bench.add_argument(
+        "--read-force", action="store_true", help="Re-inject on every /read"
+    )
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--ready-timeout", type=float, default=600)
+    bench.add_argument("--out", help="Write the JSON report here instead of stdout")
+
+    args = parser.parse_args()
+    if args.command == "keys":
+        make_keys(args.directory, args.user)
+    else:
+        if not args.duration and args.requests is None:
+            parser.error("give --duration or --requests")
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
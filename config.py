@@ -1,4 +1,4 @@
-from exllamav2 import ExLlamaV2Cache, ExLlamaV2Cache_Q4, ExLlamaV2Cache_Q8
+import os
 
 MODEL_MAX_SEQ_LEN = 1 * 32768
 # Configuration constants for LLM model behavior and server operation
@@ -6,28 +6,88 @@ INSTRUCTION_LIMIT = 2048
 CHAT_CONTEXT_LIMIT = MODEL_MAX_SEQ_LEN - INSTRUCTION_LIMIT
 PROMPT_LIMIT = 1024
 RESPONSE_LIMIT = 1024
+CONTEXT_POLICY = (
+    "sliding"  # When the window is full: "sliding" evicts old turns, "error" refuses
+)
+CONTEXT_EVICT_HEADROOM = 0.25  # Extra fraction of the budget freed per eviction
+CONTEXT_PIN_INSTRUCTIONS = (
+    False  # Also pin every conversation's opening prompt (<= INSTRUCTION_LIMIT)
+)
+CONTEXT_PIN_FILES = True  # Never evict files injected with /read
 
-WORKING_DIR = "/home/ksolomon/git/karllm/karllm-server/"
+WORKING_DIR = os.environ.get(
+    "KARLLM_WORKING_DIR", "/home/ksolomon/git/karllm/karllm-server/"
+)
 
 MODEL_DIR = "/home/ksolomon/git/models/"  # Path to quantized model directory
 ACTIVE_MODEL_FILE = WORKING_DIR + "active_model.json"
 SAFETENSORS_FILE = MODEL_DIR + "/model.safetensors"  # Path to main model weights
 SESSION_CACHE_FILE = "session_cache.pt"  # Path for saving/restoring KV cache
 SESSION_DIR = WORKING_DIR + "users/"  # Path for saving interaction traces
+BLOB_DIR = WORKING_DIR + "blobs/"  # Uploads stored by SHA-256, shared by all users
+STARTUP_CACHE_DIR = (
+    WORKING_DIR + ".cache/"
+)  # Tokenizer vocab tables (JSON) reused at startup
+WARMUP = True  # Run a short generation before reporting ready
 
-CHUNK_SIZE = 4  # Streaming chunk size (tokens per SSE flush)
+STREAM_FLUSH_MS = 50  # Max time streamed text is held before an SSE flush
+STREAM_FLUSH_BYTES = 256  # Flush early once this much text is pending
+STREAM_QUEUE_SIZE = 64  # Results buffered per request before coalescing
+INGEST_CHUNK_BYTES = 64 * 1024  # File bytes tokenized and prefilled per /read step
+UPLOAD_MAX_BYTES = 2 * 1024**3  # Largest accepted upload
+UPLOAD_CHUNK_BYTES = 1024 * 1024  # Upload bytes buffered in memory between disk writes
+MAX_BATCH_SIZE = 4  # Concurrent sequences in the shared decode batch
+BATCH_STATE_SECONDS = 1.0  # Min interval between a /batch job's state.json updates
+QUEUE_QUANTUM_TOKENS = 2048  # Estimated tokens a user may start per round-robin turn
+QUEUE_USER_WEIGHTS = {}  # username -> multiple of the quantum (default 1)
+USER_TOKENS_PER_SECOND = 0  # Per-user token-bucket refill rate; 0 for no limit
+USER_TOKEN_BURST = 65536  # Token-bucket size: estimated tokens a user may start at once
+USER_RATE_LIMITS = {}  # username -> (tokens_per_second, burst), overriding the above
+ADMISSION_MAX_WAIT_SECONDS = (
+    30  # Refuse /stream (429) past this estimated queue wait; None to never refuse
+)
+ADMISSION_KV_CHECK = True  # Refuse /stream when the KV cache can't hold the request
+SPECULATIVE_DECODING = False  # Load a model's declared draft model, if any
+NGRAM_DRAFT = (
+    False  # Prompt-lookup drafting for models without a draft model; per-request default
+)
+NGRAM_DRAFT_TOKENS = 4  # Tokens proposed per step by n-gram lookup (at most 8)
+NGRAM_MAX = 4  # Longest n-gram matched against the session's token history
+MODEL_SWAP_DRAIN_SECONDS = 30  # Time in-flight answers get to finish before a swap
+KV_SWAP_IDLE_SECONDS = 30  # Idle time before a session's KV pages are copied to host
+KV_HOST_POOL_BYTES = 16 * 1024**3  # Pinned host memory reserved for swapped KV pages
+KV_SNAPSHOT_ON_SWITCH = False  # Dump the current KV cache to disk before /convo/switch
+KV_SNAPSHOT_CHUNK_PAGES = 16  # Pages copied per scheduler call to save or restore
 
 TENSOR_PARALLEL = True  # Enable multi-GPU model sharding
 NO_GRAPHS = False
 NO_FLASH_ATTN = False
 GPU_SPLIT = "auto"  # Auto-assign memory split across devices
 
+# "exllamav2", or "stub" to fake the model on CPU for benchmarks (model/stub.py)
+BACKEND = os.environ.get("KARLLM_BACKEND", "exllamav2")
+STUB_MAX_SEQ_LEN = 32768
+STUB_PREFILL_SECONDS_PER_TOKEN = 0.00005
+STUB_DECODE_SECONDS_PER_STEP = 0.02  # Fixed cost of one batched decode iteration
+STUB_DECODE_SECONDS_PER_SEQUENCE = 0.002  # Added per sequence in the batch
+STUB_RESPONSE_TOKENS = 128  # Answer length unless the prompt contains [stub:N]
+
 SAVE_INTERACTION = False
+SESSION_LOG_COMPRESSION = (
+    None  # "zstd" to compress session log records (needs zstandard)
+)
+SESSION_LOG_FSYNC = "interval"  # "always", "interval" or "never"
+SESSION_LOG_FSYNC_INTERVAL = 1.0  # Seconds between fsyncs in "interval" mode
 
 SERVER_TIMEOUT_MINUTES = 300
+SESSION_STORE = "memory"  # "memory", or "sqlite" to keep sessions across restarts
+SESSION_STORE_PATH = WORKING_DIR + "sessions.db"  # SQLite file shared by workers
+SESSION_SWEEP_SECONDS = 60  # Interval between sweeps of expired sessions
+AUTH_TOKEN_CACHE_SECONDS = 60  # How long a verified JWT skips signature checks
+AUTH_KEY_RELOAD_SECONDS = 5  # Min interval between checks of server.conf and keys/
 
 # Model Parameters
-CACHE_QUANTIZATION = ExLlamaV2Cache_Q8
+CACHE_QUANTIZATION = "Q8"  # KV cache type: "FP16", "Q4", "Q6" or "Q8"
 TEMPERATURE = 0.8
 TOP_K = 50
 TOP_P = 0.95
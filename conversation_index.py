@@ -0,0 +1,279 @@
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import config
+
+from model.session_log import LOG_FILE, RECORD, SESSION_LOG, record_offsets
+from model.snapshot import snapshot_path
+
+
+def sessions_dir(username: str) -> Path:
+    return Path(config.SESSION_DIR) / username / "sessions"
+
+
+def check_name(name: str):
+    """Conversation names are single, visible directory names."""
+    if not name or name != Path(name).name or name.startswith("."):
+        raise ValueError(f"Invalid conversation name: {name!r}")
+
+
+def _scan_conversation(directory: Path) -> tuple:
+    """(tokens, bytes) of a conversation directory, from its log index and file sizes."""
+    tokens = 0
+    offsets = record_offsets(directory)
+    if offsets:
+        with open(directory / LOG_FILE, "rb") as f:
+            f.seek(offsets[-1])
+            header = f.read(RECORD.size)
+        if len(header) == RECORD.size:
+            tokens = RECORD.unpack(header)[3]  # end_offset of the last turn
+    size = sum(e.stat().st_size for e in os.scandir(directory) if e.is_file())
+    return tokens, size
+
+
+class ConversationIndex:
+    """
+    One user's saved conversations in a SQLite file next to their sessions
+    folder: directory name, allocated id, token count, size on disk and
+    created/last-used times. Listing and id allocation never touch the
+    directories; the folder is scanned once, when the index is first created.
+    """
+
+    def __init__(self, username: str):
+        self.username = username
+        self.directory = sessions_dir(username)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory.parent / "conversations.db"
+        self.db = sqlite3.connect(str(path), timeout=5.0, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "name TEXT PRIMARY KEY, number INTEGER, tokens INTEGER NOT NULL, "
+                "bytes INTEGER NOT NULL, created REAL NOT NULL, "
+                "last_used REAL NOT NULL, deleting INTEGER NOT NULL DEFAULT 0)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS conversations_last_used "
+                "ON conversations (last_used)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS conversations_number "
+                "ON conversations (number, name)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+            )
+            built = self.db.execute(
+                "SELECT value FROM meta WHERE key = 'next_id'"
+            ).fetchone()
+            if built is None:
+                self._build()
+
+    def _build(self):
+        """Index the conversations already on disk. Caller holds the transaction."""
+        rows = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            tokens, size = _scan_conversation(Path(entry.path))
+            mtime = entry.stat().st_mtime
+            number = int(entry.name) if entry.name.isdigit() else None
+            rows.append((entry.name, number, tokens, size, mtime, mtime))
+        self.db.executemany(
+            "INSERT OR IGNORE INTO conversations "
+            "(name, number, tokens, bytes, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        next_id = max((r[1] for r in rows if r[1] is not None), default=-1) + 1
+        self.db.execute("INSERT INTO meta VALUES ('next_id', ?)", (next_id,))
+        if rows:
+            print(f"🗂️ Indexed {len(rows)} conversations for {self.username}")
+
+    def allocate(self) -> Path:
+        """Create the directory for a new conversation under the next free id."""
+        while True:
+            with self.lock, self.db:
+                # The UPDATE takes the write lock, so concurrent workers get distinct ids
+                self.db.execute(
+                    "UPDATE meta SET value = value + 1 WHERE key = 'next_id'"
+                )
+                number = (
+                    self.db.execute(
+                        "SELECT value FROM meta WHERE key = 'next_id'"
+                    ).fetchone()[0]
+                    - 1
+                )
+                directory = self.directory / str(number)
+                try:
+                    directory.mkdir()
+                except FileExistsError:
+                    continue  # Created outside the index; take the next id
+                now = time.time()
+                self.db.execute(
+                    "INSERT OR REPLACE INTO conversations "
+                    "(name, number, tokens, bytes, created, last_used) "
+                    "VALUES (?, ?, 0, 0, ?, ?)",
+                    (directory.name, number, now, now),
+                )
+            return directory
+
+    def exists(self, name: str) -> bool:
+        with self.lock:
+            return (
+                self.db.execute(
+                    "SELECT 1 FROM conversations WHERE name = ?", (name,)
+                ).fetchone()
+                is not None
+            )
+
+    def touch(self, name: str, tokens=None, size=None):
+        """Mark a conversation used now, updating its counts if given."""
+        now = time.time()
+        number = int(name) if name.isdigit() else None
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT INTO conversations "
+                "(name, number, tokens, bytes, created, last_used) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET last_used = excluded.last_used, "
+                "tokens = COALESCE(?, tokens), bytes = COALESCE(?, bytes)",
+                (name, number, tokens or 0, size or 0, now, now, tokens, size),
+            )
+
+    def list(self, limit=None, offset=0, order="name") -> tuple:
+        """(page of conversation dicts, total count), by id/name or most recent first."""
+        sort = "last_used DESC" if order == "recent" else "number IS NULL, number, name"
+        with self.lock:
+            total = self.db.execute(
+                "SELECT COUNT(*) FROM conversations WHERE deleting = 0"
+            ).fetchone()[0]
+            rows = self.db.execute(
+                "SELECT name, tokens, bytes, created, last_used FROM conversations "
+                f"WHERE deleting = 0 ORDER BY {sort} LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            ).fetchall()
+        keys = ("name", "tokens", "bytes", "created", "last_used")
+        return [dict(zip(keys, row)) for row in rows], total
+
+    def names(self) -> list:
+        with self.lock:
+            return [
+                name
+                for (name,) in self.db.execute(
+                    "SELECT name FROM conversations WHERE deleting = 0"
+                )
+            ]
+
+    def rename(self, old: str, new: str):
+        number = int(new) if new.isdigit() else None
+        with self.lock, self.db:
+            renamed = self.db.execute(
+                "UPDATE conversations SET name = ?, number = ? WHERE name = ?",
+                (new, number, old),
+            ).rowcount
+        if not renamed:
+            self.touch(new)  # A folder the index had not seen
+
+    def mark_deleting(self, names) -> list:
+        """Hide conversations from listings; returns those not already being deleted."""
+        marked = []
+        now = time.time()
+        with self.lock, self.db:
+            for name in names:
+                cursor = self.db.execute(
+                    "INSERT INTO conversations "
+                    "(name, number, tokens, bytes, created, last_used, deleting) "
+                    "VALUES (?, NULL, 0, 0, ?, ?, 1) "
+                    "ON CONFLICT (name) DO UPDATE SET deleting = 1 WHERE deleting = 0",
+                    (name, now, now),
+                )
+                if cursor.rowcount:
+                    marked.append(name)
+        return marked
+
+    def pending_deletes(self) -> list:
+        with self.lock:
+            return [
+                name
+                for (name,) in self.db.execute(
+                    "SELECT name FROM conversations WHERE deleting = 1"
+                )
+            ]
+
+    def remove(self, name: str):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM conversations WHERE name = ?", (name,))
+
+
+class ConversationIndexes:
+    """
+    Every user's ConversationIndex, opened on first use, plus a background
+    thread that deletes conversation folders so large ones never block a
+    request. Deletions interrupted by a restart resume when the user's index
+    is next opened.
+    """
+
+    def __init__(self):
+        self.indexes = {}  # username -> ConversationIndex
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+
+    def index(self, username: str) -> ConversationIndex:
+        with self.lock:
+            index = self.indexes.get(username)
+            if index is None:
+                index = self.indexes[username] = ConversationIndex(username)
+                for name in index.pending_deletes():
+                    self._queue_delete(username, name)
+        return index
+
+    def allocate(self, username: str) -> Path:
+        return self.index(username).allocate()
+
+    def delete(self, username: str, names) -> int:
+        """Hide the conversations at once and delete their folders in the background."""
+        marked = self.index(username).mark_deleting(names)
+        for name in marked:
+            self._queue_delete(username, name)
+        return len(marked)
+
+    def record_turn(self, session_dir, tokens, size):
+        """SESSION_LOG callback: a turn was appended to a conversation's log."""
+        session_dir = Path(session_dir)
+        username = session_dir.parent.parent.name
+        self.index(username).touch(session_dir.name, tokens, size)
+
+    def _queue_delete(self, username, name):
+        with self.thread_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="conversation-delete", daemon=True
+                )
+                self.thread.start()
+        self.queue.put((username, name))
+
+    def _run(self):
+        while True:
+            username, name = self.queue.get()
+            directory = sessions_dir(username) / name
+            try:
+                # Only a log with open handles needs closing; nothing else may block
+                if SESSION_LOG.is_open(directory):
+                    SESSION_LOG.close(directory)
+                shutil.rmtree(directory, ignore_errors=True)
+                snapshot_path(directory).unlink(missing_ok=True)
+                self.index(username).remove(name)
+            except Exception as e:
+                print(f"❌ Failed to delete conversation {directory}: {e}")
+
+
+CONVERSATIONS = ConversationIndexes()
+SESSION_LOG.on_append.append(CONVERSATIONS.record_turn)
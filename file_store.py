@@ -0,0 +1,124 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from pathlib import Path
+
+import config
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def user_files_dir(username: str) -> Path:
+    return Path(config.SESSION_DIR) / username / "files"
+
+
+def user_file(username: str, name: str) -> Path:
+    """Path of a user's named file. Raises ValueError for names that aren't plain file names."""
+    if not name or name != Path(name).name or name.startswith("."):
+        raise ValueError(f"Invalid file name: {name!r}")
+    return user_files_dir(username) / name
+
+
+def blob_path(digest: str) -> Path:
+    return Path(config.BLOB_DIR) / digest[:2] / digest
+
+
+def _linked_blob(path: Path) -> str | None:
+    """Digest of the blob a user file links to, or None if it is not such a link."""
+    if not path.is_symlink():
+        return None
+    target = Path(os.readlink(path))
+    if target.parent.parent == Path(config.BLOB_DIR) and len(target.name) == 64:
+        return target.name
+    return None
+
+
+def owns_blob(username: str, digest: str) -> bool:
+    """
+    Whether one of the user's files already links to this content. Only then may
+    an upload skip its body: knowing a hash must not grant another user's file.
+    """
+    digest = digest.lower()
+    directory = user_files_dir(username)
+    if not directory.is_dir():
+        return False
+    return (
+        any(
+            _linked_blob(Path(entry.path)) == digest
+            for entry in os.scandir(directory)
+            if entry.is_symlink()
+        )
+        and blob_path(digest).exists()
+    )
+
+
+def file_digest(path: Path) -> str:
+    """SHA-256 of a user file: the blob name it links to, or hashed from its content."""
+    path = Path(path)
+    digest = _linked_blob(path)
+    if digest is not None:
+        return digest
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while data := f.read(config.UPLOAD_CHUNK_BYTES):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def link_file(username: str, name: str, digest: str) -> Path:
+    """Point a user's file name at a stored blob, replacing any previous target."""
+    target = user_file(username, name)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_link = target.with_name(f".{name}.{uuid.uuid4().hex}")
+    os.symlink(blob_path(digest.lower()), tmp_link)
+    tmp_link.replace(target)
+    return target
+
+
+async def store_upload(username: str, name: str, chunks, size_hint=None) -> dict:
+    """
+    Stream an upload to disk, hashing it as it arrives, and store it by SHA-256.
+
+    `chunks` is an async iterator of bytes. At most UPLOAD_CHUNK_BYTES are held in
+    memory; UploadTooLarge is raised as soon as UPLOAD_MAX_BYTES is exceeded.
+    Content already stored is not written twice; only the user's name link changes.
+    """
+    user_file(username, name)  # Validate the name before reading anything
+    if size_hint is not None and int(size_hint) > config.UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(f"Upload exceeds {config.UPLOAD_MAX_BYTES} bytes")
+
+    tmp_dir = Path(config.BLOB_DIR) / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = tmp_dir / uuid.uuid4().hex
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            buffer = bytearray()
+            async for data in chunks:
+                size += len(data)
+                if size > config.UPLOAD_MAX_BYTES:
+                    raise UploadTooLarge(
+                        f"Upload exceeds {config.UPLOAD_MAX_BYTES} bytes"
+                    )
+                hasher.update(data)
+                buffer += data
+                if len(buffer) >= config.UPLOAD_CHUNK_BYTES:
+                    await asyncio.to_thread(f.write, bytes(buffer))
+                    buffer.clear()
+            await asyncio.to_thread(f.write, bytes(buffer))
+
+        digest = hasher.hexdigest()
+        blob = blob_path(digest)
+        deduplicated = blob.exists()
+        if not deduplicated:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.replace(blob)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    link_file(username, name, digest)
+    return {"sha256": digest, "bytes": size, "deduplicated": deduplicated}
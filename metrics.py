@@ -0,0 +1,149 @@
+import bisect
+import threading
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus text format.
+
+    An observation is one bisect and a few additions under a lock, cheap
+    enough to record on every token of a stream.
+    """
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        self.series = {}  # label values -> [bucket counts..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {key: list(values) for key, values in self.series.items()}
+        for label_values, values in series.items():
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                le = _labels(self.labels + ("le",), label_values + (f"{bound:g}",))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _labels(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{le} {values[-2]}")
+            lines.append(f"{self.name}_count{labels} {values[-2]}")
+            lines.append(f"{self.name}_sum{labels} {values[-1]:g}")
+        return lines
+
+
+class Gauge:
+    """
+    Gauge read at scrape time: `collect` returns a value, or a list of
+    (label values, value) pairs, so nothing is updated on the request path.
+    """
+
+    def __init__(self, name, help_text, collect, labels=()):
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+        self.labels = tuple(labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.collect()
+        except Exception as e:
+            print(f"⚠️ Metric {self.name} could not be collected: {e}")
+            return lines
+        if not isinstance(samples, list):
+            samples = [((), samples)]
+        for label_values, value in samples:
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value:g}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name, help_text, buckets, labels=()) -> Histogram:
+        metric = Histogram(name, help_text, buckets, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, collect, labels=()) -> Gauge:
+        metric = Gauge(name, help_text, collect, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TOKEN_LATENCY_BUCKETS = (0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.2, 0.5, 1)
+THROUGHPUT_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+INGEST_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+AUTH_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+REGISTRY = Registry()
+
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "karllm_time_to_first_token_seconds",
+    "Time from submitting a prompt to its first streamed token.",
+    LATENCY_BUCKETS,
+    labels=("model",),
+)
+INTER_TOKEN_LATENCY = REGISTRY.histogram(
+    "karllm_inter_token_latency_seconds",
+    "Time between streamed tokens, per token.",
+    TOKEN_LATENCY_BUCKETS,
+    labels=("model",),
+)
+PREFILL_THROUGHPUT = REGISTRY.histogram(
+    "karllm_prefill_tokens_per_second",
+    "Uncached prompt tokens prefilled per second, per job.",
+    THROUGHPUT_BUCKETS,
+    labels=("model",),
+)
+DECODE_THROUGHPUT = REGISTRY.histogram(
+    "karllm_decode_tokens_per_second",
+    "Tokens generated per second after the first, per job.",
+    THROUGHPUT_BUCKETS,
+    labels=("model",),
+)
+INGEST_SECONDS = REGISTRY.histogram(
+    "karllm_read_ingest_seconds",
+    "Time to inject a file into a session's context with /read.",
+    INGEST_BUCKETS,
+    labels=("model",),
+)
+AUTH_SECONDS = REGISTRY.histogram(
+    "karllm_auth_seconds",
+    "Time to verify a login token.",
+    AUTH_BUCKETS,
+)
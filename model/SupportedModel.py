@@ -3,13 +3,6 @@ import os
 from pathlib import Path
 from typing import Union
 
-from exllamav2 import (
-    ExLlamaV2Cache,
-    ExLlamaV2Cache_Q4,
-    ExLlamaV2Cache_Q6,
-    ExLlamaV2Cache_Q8,
-)
-
 import config
 
 KB = 1024
@@ -27,6 +20,8 @@ class SupportedModel:
         max_context_theory: int = (
             128 * KB
         ),  # Debugging purposes: max_seq_len < max_context_theory
+        draft_path: str | None = None,  # Smaller same-vocab model for speculation
+        num_draft_tokens: int = 4,  # Tokens proposed by the draft per target forward
     ):
         self.name = name
         self.path = path
@@ -35,6 +30,8 @@ class SupportedModel:
         self.prompt_limit = prompt_limit
         self.response_limit = response_limit
         self.max_context_theory = max_context_theory
+        self.draft_path = draft_path
+        self.num_draft_tokens = num_draft_tokens
         if self.max_seq_len > max_context_theory:
             raise ValueError(f"max_seq_len > max_context_theory ({max_context_theory})")
         if (self.prompt_limit + self.response_limit) > max_seq_len:
@@ -50,9 +47,18 @@ class SupportedModel:
             "max_seq_len": self.max_seq_len,
             "prompt_limit": self.prompt_limit,
             "response_limit": self.response_limit,
+            "draft_path": str(self.draft_path) if self.draft_path else None,
+            "num_draft_tokens": self.num_draft_tokens,
         }
 
     def get_cache(self):
+        from exllamav2 import (
+            ExLlamaV2Cache,
+            ExLlamaV2Cache_Q4,
+            ExLlamaV2Cache_Q6,
+            ExLlamaV2Cache_Q8,
+        )
+
         if self.quant == 4:
             return ExLlamaV2Cache_Q4
         elif self.quant == 6:
@@ -99,6 +105,8 @@ SUPPORTED_MODELS = [
         20 * KB,
         4 * KB,
         4 * KB,
+        draft_path=config.MODEL_DIR + "/Qwen2.5-0.5B-Instruct",
+        num_draft_tokens=5,
     ),
     SupportedModel(
         "Qwen-Coder-32B-Q4",  # APPROVED
@@ -107,6 +115,8 @@ SUPPORTED_MODELS = [
         100 * KB,
         8 * KB,
         8 * KB,
+        draft_path=config.MODEL_DIR + "/Qwen2.5-Coder-14B-Instruct-Q8",
+        num_draft_tokens=4,
     ),
     # SupportedModel(
     #     "Qwen-Coder-32B-Q8",  # TODO: quantize and test
@@ -0,0 +1,133 @@
+import heapq
+import math
+
+import config
+
+
+class Admission:
+    """
+    Load shedding for interactive requests.
+
+    The scheduler feeds in the prefill and decode rates of finished requests
+    and, every iteration, a snapshot of the interactive work still ahead: prompt
+    tokens to prefill, answer tokens to decode and KV tokens held. A new request
+    is refused if that work would keep it waiting longer than
+    ADMISSION_MAX_WAIT_SECONDS, or if its context, prompt and max_tokens do not
+    fit in what is left of the cache. Until the first request finishes there are
+    no rates, and only the cache check applies.
+    """
+
+    def __init__(self):
+        # Moving averages over finished requests
+        self.prefill_rate = None  # Tokens per second
+        self.decode_rate = None  # Tokens per second for one sequence in the batch
+        self.answer_tokens = None  # Tokens per answer
+        # Outstanding interactive work, replaced as a whole by the scheduler
+        self.work = (0, 0, 0)  # (prefill tokens, decode tokens, KV tokens)
+
+    def observe(self, result: dict):
+        """Fold a finished request's rates into the averages. Scheduler thread."""
+        prefilled = result.get("prompt_tokens", 0) - result.get("cached_tokens", 0)
+        if prefilled > 0 and result.get("time_prefill", 0) > 0:
+            self.prefill_rate = _average(
+                self.prefill_rate, prefilled / result["time_prefill"]
+            )
+        decoded = result.get("new_tokens", 0) - 1
+        if decoded > 0 and result.get("time_generate", 0) > 0:
+            self.decode_rate = _average(
+                self.decode_rate, decoded / result["time_generate"]
+            )
+        if "new_tokens" in result and result["identifier"].priority == "interactive":
+            self.answer_tokens = _average(self.answer_tokens, result["new_tokens"])
+
+    def update(self, active, queued):
+        """Snapshot the work of running and queued interactive requests. Scheduler thread."""
+        prefill = decode = kv = 0
+        for request in active:
+            kv += request.input_ids.shape[-1] + request.max_new_tokens
+            decode += max(0, self.expected_answer(request) - len(request.generated))
+        for request in queued:
+            if request.priority != "interactive":
+                continue
+            kv += request.input_ids.shape[-1] + request.max_new_tokens
+            prefill += max(0, request.cost - request.max_new_tokens)
+            decode += self.expected_answer(request)
+        self.work = (prefill, decode, kv)
+
+    def expected_answer(self, request) -> int:
+        if self.answer_tokens is None:
+            return request.max_new_tokens
+        return min(request.max_new_tokens, math.ceil(self.answer_tokens))
+
+    def slot_waits(self, active, waiting) -> dict:
+        """
+        Seconds until each waiting request, given in start order, gets a batch
+        slot. Running answers free their slots after their expected remaining
+        tokens at the observed decode rate; each request ahead then holds a slot
+        for its prefill and expected answer. Empty until rates are known.
+        """
+        if not self.prefill_rate or not self.decode_rate:
+            return {}
+        free = [
+            max(0, self.expected_answer(r) - len(r.generated)) / self.decode_rate
+            for r in active
+        ]
+        free += [0.0] * (config.MAX_BATCH_SIZE - len(free))
+        heapq.heapify(free)
+        waits = {}
+        for request in waiting:
+            start = heapq.heappop(free)
+            waits[request] = start
+            prefill = max(0, request.cost - request.max_new_tokens) / self.prefill_rate
+            decode = self.expected_answer(request) / self.decode_rate
+            heapq.heappush(free, start + prefill + decode)
+        return waits
+
+    def estimated_wait(self) -> float | None:
+        """Seconds until outstanding interactive work is done, or None without rates."""
+        if not self.prefill_rate or not self.decode_rate:
+            return None
+        prefill, decode, _ = self.work
+        return prefill / self.prefill_rate + decode / (
+            self.decode_rate * config.MAX_BATCH_SIZE
+        )
+
+    def check(
+        self,
+        capacity: int,
+        context_tokens: int,
+        prompt_tokens: int,
+        max_new_tokens: int,
+    ) -> tuple | None:
+        """
+        (reason, retry after seconds) if a new request should be refused, else None.
+        Retry after is None for a request the cache could not hold even empty.
+        """
+        wait = self.estimated_wait()
+        limit = config.ADMISSION_MAX_WAIT_SECONDS
+        if wait is not None and limit is not None and wait > limit:
+            return (
+                f"Server is overloaded: estimated wait {wait:.0f}s exceeds {limit}s.",
+                max(1, math.ceil(wait - limit)),
+            )
+        held = self.work[2]
+        needed = context_tokens + prompt_tokens + max_new_tokens
+        if config.ADMISSION_KV_CHECK and needed > capacity:
+            return (
+                f"Request needs {needed} tokens; the KV cache holds {capacity}.",
+                None,
+            )
+        if config.ADMISSION_KV_CHECK and held + needed > capacity:
+            return (
+                f"Not enough KV cache: {needed} tokens needed, "
+                f"{max(0, capacity - held)} of {capacity} free.",
+                max(1, math.ceil(wait or 1)),
+            )
+        return None
+
+
+def _average(current, value):
+    return value if current is None else current + 0.1 * (value - current)
+
+
+ADMISSION = Admission()
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import time
+import uuid
+from pathlib import Path
+
+import config
+import torch
+from pydantic import ValidationError
+
+from model.budget import prompt_limit
+from model.detokenizer import StopStrings
+from model.generation import (
+    response_limit,
+    sampler_settings,
+    stop_conditions,
+    tokens_for_text,
+)
+from model.init import ModelState
+from model.scheduler import SCHEDULER, GenerationRequest
+from schema import ChatRequest
+
+SWAP_ERROR = "Model is being swapped"
+
+
+class BatchItem:
+    __slots__ = ("index", "id", "chat", "input_ids")
+
+    def __init__(self, index, item_id, chat, input_ids):
+        self.index = index
+        self.id = item_id
+        self.chat = chat
+        self.input_ids = input_ids
+
+
+def completed_items(output_path: Path) -> set:
+    """
+    Indexes already written to a batch's output. A line torn by a crash is cut
+    off, so appending resumes on a clean line boundary.
+    """
+    done = set()
+    if not output_path.exists():
+        return done
+    good = 0
+    with open(output_path, "rb+") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)["index"])
+            except (ValueError, KeyError):
+                break
+            good += len(line)
+        f.truncate(good)
+    return done
+
+
+def read_items(input_path: Path, skip: set) -> tuple:
+    """Parse the input JSONL into items still to run, plus error records for bad lines."""
+    items, errors = [], []
+    with open(input_path, "r", encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if index in skip or not line.strip():
+                continue
+            data = None
+            try:
+                data = json.loads(line)
+                chat = ChatRequest.model_validate(data)
+            except (ValueError, ValidationError) as e:
+                item_id = data.get("id") if isinstance(data, dict) else None
+                errors.append(
+                    {"index": index, "id": item_id, "error": f"Invalid item: {e}"}
+                )
+                continue
+            items.append(BatchItem(index, data.get("id"), chat, encode(chat)))
+    return items, errors
+
+
+def encode(chat: ChatRequest) -> torch.Tensor:
+    return ModelState.tokenizer.encode(chat.prompt, add_bos=True, add_eos=True)
+
+
+async def wait_for_model():
+    while not ModelState.model_ready:
+        await asyncio.sleep(1)
+
+
+async def run_item(item: BatchItem, username=None) -> dict:
+    """
+    Generate one item's answer without a session, queued as batch work of
+    `username`; retried across model swaps.
+    """
+    record = {"index": item.index, "id": item.id}
+    if item.input_ids.shape[-1] > prompt_limit():
+        record["error"] = (
+            f"Prompt is {item.input_ids.shape[-1]} tokens; the limit is {prompt_limit()}."
+        )
+        return record
+
+    tokenizer_id = ModelState.tokenizer_id
+    while True:
+        await wait_for_model()
+        if ModelState.tokenizer_id != tokenizer_id:
+            tokenizer_id = ModelState.tokenizer_id
+            item.input_ids = await asyncio.to_thread(encode, item.chat)
+        start = time.perf_counter()
+        request = SCHEDULER.submit(
+            GenerationRequest(
+                item.input_ids,
+                response_limit(item.chat.max_tokens),
+                stop_conditions=stop_conditions(
+                    item.chat.stop_token_ids, item.chat.stop
+                ),
+                ngram=item.chat.ngram,
+                settings=sampler_settings(item.chat),
+                username=username,
+                priority="batch",
+            )
+        )
+        token_ids = []
+        try:
+            while True:
+                result = await request.get()
+                if result.get("token_ids") is not None:
+                    token_ids.extend(result["token_ids"].flatten().tolist())
+                if "error" in result or result.get("eos"):
+                    break
+        except asyncio.CancelledError:
+            SCHEDULER.cancel(request)
+            raise
+        if SWAP_ERROR in result.get("error", "") or (
+            result.get("eos_reason") == "model_swap"
+        ):
+            continue  # Run it again on the new model
+        break
+
+    if "error" in result:
+        record["error"] = result["error"]
+        return record
+    stopper = StopStrings(item.chat.stop)
+    text = stopper.add(ModelState.tokenizer.decode_(token_ids, False))
+    text += stopper.finish()
+    if stopper.hit:
+        token_ids = tokens_for_text(token_ids, text)
+    seconds = time.perf_counter() - start
+    record.update(
+        {
+            "text": text,
+            "prompt_tokens": item.input_ids.shape[-1],
+            "new_tokens": len(token_ids),
+            "cached_tokens": result.get("cached_tokens", 0),
+            "eos_reason": "stop_string" if stopper.hit else result.get("eos_reason"),
+            "time_enqueued": round(result.get("time_enqueued", 0.0), 4),
+            "time_prefill": round(result.get("time_prefill", 0.0), 4),
+            "time_generate": round(result.get("time_generate", 0.0), 4),
+            "seconds": round(seconds, 4),
+        }
+    )
+    return record
+
+
+async def run_batch(
+    input_path: Path, output_path: Path, progress=None, username=None
+) -> dict:
+    """
+    Run every prompt in a JSONL file and append one JSON result per line to
+    `output_path`, in completion order, keyed by input line `index` and `id`.
+
+    Items are sorted longest prompt first and kept 2 x MAX_BATCH_SIZE deep in the
+    scheduler, so the decode batch stays full and similar lengths run together.
+    Items already in the output are skipped, so a crashed run resumes where it
+    stopped. `progress(summary)` is called after each item. Items queue behind
+    interactive work and take turns with other users' as `username`.
+    """
+    await wait_for_model()
+    done = await asyncio.to_thread(completed_items, output_path)
+    items, errors = await asyncio.to_thread(read_items, input_path, done)
+    items.sort(key=lambda item: item.input_ids.shape[-1], reverse=True)
+    summary = {
+        "total": len(done) + len(items) + len(errors),
+        "completed": len(done),
+        "errors": 0,
+        "new_tokens": 0,
+        "seconds": 0.0,
+        "tokens_per_second": 0.0,
+    }
+    start = time.perf_counter()
+    slots = asyncio.Semaphore(2 * config.MAX_BATCH_SIZE)
+
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        def write(record):
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            summary["completed"] += 1
+            summary["errors"] += "error" in record
+            summary["new_tokens"] += record.get("new_tokens", 0)
+            summary["seconds"] = round(time.perf_counter() - start, 3)
+            if summary["seconds"]:
+                summary["tokens_per_second"] = round(
+                    summary["new_tokens"] / summary["seconds"], 2
+                )
+            if progress is not None:
+                progress(summary)
+
+        for record in errors:
+            write(record)
+
+        async def run(item):
+            try:
+                record = await run_item(item, username)
+            except Exception as e:
+                record = {"index": item.index, "id": item.id, "error": str(e)}
+            finally:
+                slots.release()
+            write(record)
+
+        tasks = []
+        try:
+            for item in items:
+                await slots.acquire()
+                tasks.append(asyncio.create_task(run(item)))
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+    return summary
+
+
+class BatchManager:
+    """
+    Batches submitted through /batch. Each lives in its own directory under the
+    user's folder (input.jsonl, output.jsonl, state.json) and runs as a
+    background task; batches still marked running are resumed at startup.
+    """
+
+    def __init__(self):
+        self.tasks = {}  # batch directory -> asyncio.Task
+
+    def batch_dir(self, username: str, batch_id: str) -> Path:
+        return Path(config.SESSION_DIR) / username / "batches" / batch_id
+
+    def new_batch(self, username: str) -> tuple:
+        batch_id = uuid.uuid4().hex[:12]
+        directory = self.batch_dir(username, batch_id)
+        directory.mkdir(parents=True)
+        return batch_id, directory
+
+    def start(self, directory: Path):
+        state = {"state": "running", "submitted": time.time()}
+        self._write_state(directory, state)
+        self.tasks[directory] = asyncio.create_task(self._run(directory, state))
+
+    def status(self, directory: Path) -> dict | None:
+        try:
+            return json.loads((directory / "state.json").read_text())
+        except (OSError, ValueError):
+            return None
+
+    def resume(self):
+        """Restart batches interrupted by a crash or restart."""
+        for state_path in Path(config.SESSION_DIR).glob("*/batches/*/state.json"):
+            directory = state_path.parent
+            state = self.status(directory)
+            if state and state["state"] == "running" and directory not in self.tasks:
+                print(f"🔁 Resuming batch {directory.name}")
+                self.tasks[directory] = asyncio.create_task(self._run(directory, state))
+
+    async def _run(self, directory: Path, state: dict):
+        written = time.monotonic()
+
+        def progress(summary):
+            # Runs on the event loop after every item; the final state is always written
+            nonlocal written
+            state.update(summary)
+            if time.monotonic() - written >= config.BATCH_STATE_SECONDS:
+                written = time.monotonic()
+                self._write_state(directory, state)
+
+        try:
+            summary = await run_batch(
+                directory / "input.jsonl",
+                directory / "output.jsonl",
+                progress,
+                username=directory.parent.parent.name,
+            )
+            state.update(summary, state="done")
+            print(
+                f"✅ Batch {directory.name}: {summary['completed']} items, "
+                f"{summary['new_tokens']} tokens in {summary['seconds']:.1f}s"
+            )
+        except asyncio.CancelledError:
+            raise  # Shutdown: stays "running" and resumes on the next start
+        except Exception as e:
+            state.update(state="failed", error=str(e))
+            print(f"❌ Batch {directory.name} failed: {e}")
+        finally:
+            self.tasks.pop(directory, None)
+        self._write_state(directory, state)
+
+    def _write_state(self, directory: Path, state: dict):
+        tmp_path = directory / "state.json.tmp"
+        tmp_path.write_text(json.dumps(state))
+        tmp_path.replace(directory / "state.json")
+
+
+BATCHES = BatchManager()
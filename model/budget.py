@@ -0,0 +1,99 @@
+import config
+import torch
+
+from model.context import SessionContext
+from model.init import ModelState
+
+
+def context_budget(reserve=None) -> int:
+    """
+    Most tokens a session's context may hold, leaving `reserve` tokens of the
+    model's window for the response (default: the configured response length).
+    """
+    if reserve is None:
+        reserve = ModelState.settings.length
+    return ModelState.active_model.max_seq_len - reserve
+
+
+def prompt_limit() -> int:
+    return ModelState.active_model.prompt_limit or config.PROMPT_LIMIT
+
+
+def pin_instructions(ctx: SessionContext, length: int, requested=False) -> bool:
+    """
+    Whether a prompt is kept as pinned instructions: when the client marks it so,
+    or, with CONTEXT_PIN_INSTRUCTIONS, when it opens the conversation. Either way
+    it must fit in INSTRUCTION_LIMIT tokens.
+    """
+    if length > config.INSTRUCTION_LIMIT:
+        return False
+    return requested or (config.CONTEXT_PIN_INSTRUCTIONS and not ctx.spans)
+
+
+def record_turn(
+    ctx: SessionContext, prompt_len: int, response_len: int, instructions=False
+) -> bool:
+    """
+    Add the spans of a prompt/response pair just appended to the context.
+    Returns whether the prompt was pinned as instructions.
+    """
+    if pin_instructions(ctx, prompt_len, instructions):
+        ctx.add_span("instructions", prompt_len, pinned=True)
+        ctx.add_span("turn", response_len)
+        return True
+    ctx.add_span("turn", prompt_len + response_len)
+    return False
+
+
+def fit_context(ctx: SessionContext, incoming: int, reserve=None) -> str | None:
+    """
+    Make room in the session's context for `incoming` more tokens.
+
+    With CONTEXT_POLICY "sliding", the oldest unpinned spans are dropped, and
+    enough extra to free CONTEXT_EVICT_HEADROOM of the budget is dropped too, so
+    evictions stay rare. The KV for the tokens before the first dropped span is
+    still cached by prefix, so only the suffix after it is prefilled again.
+    With "error", nothing is dropped. Returns an error message if the tokens
+    still don't fit, leaving the context unchanged.
+    """
+    budget = context_budget(reserve)
+    used = ctx.ids.shape[-1]
+    need = used + incoming - budget
+    if need <= 0:
+        return None
+
+    error = (
+        f"Context window full: {used} tokens in context + {incoming} new "
+        f"exceeds the budget of {budget}."
+    )
+    if config.CONTEXT_POLICY != "sliding":
+        return error
+
+    target = need + int(budget * config.CONTEXT_EVICT_HEADROOM)
+    keep, pieces, dropped = [], [], 0
+    for start, end, span in ctx.span_offsets():
+        if dropped < target and not span.pinned:
+            dropped += span.length
+        else:
+            keep.append(span)
+            pieces.append(ctx.ids[:, start:end])
+    if dropped < need:
+        return error + " Pinned spans alone don't leave enough room."
+
+    ctx.ids = torch.cat(pieces, dim=-1) if pieces else ctx.ids[:, :0]
+    ctx.spans = keep
+    print(f"✂️ Evicted {dropped} context tokens to fit {incoming} new tokens")
+    return None
+
+
+def context_usage(ctx: SessionContext) -> dict:
+    return {
+        "policy": config.CONTEXT_POLICY,
+        "window": ModelState.active_model.max_seq_len,
+        "budget": context_budget(),
+        "used": ctx.ids.shape[-1],
+        "spans": [
+            {"kind": span.kind, "start": start, "end": end, "pinned": span.pinned}
+            for start, end, span in ctx.span_offsets()
+        ],
+    }
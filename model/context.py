@@ -0,0 +1,88 @@
+import asyncio
+from pathlib import Path
+
+import torch
+
+# Per-session conversation state: session_id -> SessionContext
+SESSION_CONTEXTS = {}
+
+
+class Span:
+    """A run of context tokens from one source: a chat turn or an injected file."""
+
+    __slots__ = ("kind", "length", "pinned", "key")
+
+    def __init__(self, kind: str, length: int, pinned=False, key=None):
+        self.kind = kind
+        self.length = length
+        self.pinned = pinned  # Pinned spans survive context eviction
+        self.key = key  # Content hash for injected files
+
+
+class SessionContext:
+    """
+    Conversation state owned by a single authenticated session.
+    The KV for `ids` lives in the generator's page cache and is reused by prefix,
+    so one session clearing its context never touches another session's.
+    """
+
+    def __init__(
+        self, session_id=None, session_dir=None, save_interactions=False, username=None
+    ):
+        self.session_id = session_id
+        self.username = username  # Owner, for fair queueing and rate limits
+        self.ids = torch.empty((1, 0), dtype=torch.long)
+        self.session_dir = session_dir
+        self.save_interactions = save_interactions
+        self.lock = asyncio.Lock()  # One in-flight request per session
+        self.request = None  # GenerationRequest currently streaming, if any
+        self.spans = []  # Spans covering `ids` in order
+
+    @property
+    def active(self):
+        return self.ids.shape[-1] > 0
+
+    def reset(self):
+        self.ids = torch.empty((1, 0), dtype=torch.long)
+        self.spans.clear()
+
+    def add_span(self, kind: str, length: int, pinned=False, key=None):
+        """Record that the last `length` tokens of `ids` came from one source."""
+        if length > 0:
+            self.spans.append(Span(kind, length, pinned, key))
+
+    def span_offsets(self):
+        """(start, end, span) for every span, in context order."""
+        start = 0
+        for span in self.spans:
+            yield start, start + span.length, span
+            start += span.length
+
+    def find_span(self, key):
+        """(start, end) of the span injected from content `key`, if still in context."""
+        for start, end, span in self.span_offsets():
+            if span.key == key:
+                return start, end
+        return None
+
+
+def get_context(session_id: str) -> SessionContext:
+    """Return the context for a session, creating an empty one on first use."""
+    ctx = SESSION_CONTEXTS.get(session_id)
+    if ctx is None:
+        ctx = SESSION_CONTEXTS[session_id] = SessionContext(session_id)
+    return ctx
+
+
+def dirs_in_use() -> set:
+    """Resolved session directories that live sessions are currently writing to."""
+    return {
+        Path(ctx.session_dir).resolve()
+        for ctx in list(SESSION_CONTEXTS.values())
+        if ctx.session_dir
+    }
+
+
+def dir_in_use(path) -> bool:
+    """True if any live session is currently writing to the given session directory."""
+    return Path(path).resolve() in dirs_in_use()
@@ -0,0 +1,119 @@
+import time
+
+import config
+
+
+class IncrementalDetokenizer:
+    """
+    Turns a growing list of token ids into text deltas.
+
+    Each step re-decodes only the few tokens since the last emitted text, with
+    the tokens before them as context (prefix_offset..read_offset) so leading
+    spaces and multi-byte merges come out right. Text ending in an incomplete
+    UTF-8 sequence is held back until a later token completes it.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.ids = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def _decode(self, ids) -> str:
+        return self.tokenizer.decode_(ids, False) if ids else ""
+
+    def add(self, ids: list) -> str:
+        """Append new token ids and return any newly stable text."""
+        self.ids.extend(ids)
+        prefix = self._decode(self.ids[self.prefix_offset : self.read_offset])
+        full = self._decode(self.ids[self.prefix_offset :])
+        if len(full) <= len(prefix) or full.endswith("\ufffd"):
+            return ""
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(self.ids)
+        return full[len(prefix) :]
+
+    def finish(self) -> str:
+        """Return whatever text is still held back, complete or not."""
+        prefix = self._decode(self.ids[self.prefix_offset : self.read_offset])
+        full = self._decode(self.ids[self.prefix_offset :])
+        self.prefix_offset = self.read_offset = len(self.ids)
+        return full[len(prefix) :]
+
+
+class AdaptiveFlusher:
+    """
+    Coalesces streamed text into SSE chunks by time and size instead of token count.
+    The first text is sent immediately; after that, pending text is flushed once
+    STREAM_FLUSH_MS has passed since the last flush or STREAM_FLUSH_BYTES have built up.
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.pending_bytes = 0
+        self.last_flush = None
+
+    def add(self, text: str) -> str | None:
+        """Queue text; return the chunk to send if a flush is due."""
+        if text:
+            self.pending.append(text)
+            self.pending_bytes += len(text.encode("utf-8"))
+        if not self.pending:
+            return None
+        now = time.perf_counter()
+        if (
+            self.last_flush is None
+            or (now - self.last_flush) * 1000 >= config.STREAM_FLUSH_MS
+            or self.pending_bytes >= config.STREAM_FLUSH_BYTES
+        ):
+            self.last_flush = now
+            return self.flush()
+        return None
+
+    def flush(self) -> str | None:
+        if not self.pending:
+            return None
+        text = "".join(self.pending)
+        self.pending.clear()
+        self.pending_bytes = 0
+        return text
+
+
+class StopStrings:
+    """
+    Cuts streamed text at the first stop string.
+
+    Only the tail is searched: text that could be the start of a stop string is
+    held back until the next piece shows whether it completes one, so a match
+    split across tokens is still found and never partly sent.
+    """
+
+    def __init__(self, stops):
+        self.stops = [s for s in stops if s]
+        self.held = ""
+        self.hit = None
+
+    def add(self, text: str) -> str:
+        """Return the text that is safe to send; after a match, always ""."""
+        if self.hit is not None or not self.stops:
+            return "" if self.hit is not None else text
+        text = self.held + text
+        matches = [(text.find(s), s) for s in self.stops if s in text]
+        if matches:
+            index, self.hit = min(matches)
+            self.held = ""
+            return text[:index]
+
+        keep = 0
+        for s in self.stops:
+            for k in range(min(len(s) - 1, len(text)), keep, -1):
+                if text.endswith(s[:k]):
+                    keep = k
+                    break
+        self.held = text[len(text) - keep :]
+        return text[: len(text) - keep]
+
+    def finish(self) -> str:
+        """Held-back text once the stream ends without completing a stop string."""
+        held, self.held = self.held, ""
+        return held if self.hit is None else ""
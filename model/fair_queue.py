@@ -0,0 +1,243 @@
+import math
+import time
+from collections import deque
+
+import config
+
+# Priority classes, served strictly in this order
+PRIORITIES = ("interactive", "ingest", "batch")
+
+
+def _quantum(username) -> float:
+    return config.QUEUE_QUANTUM_TOKENS * config.QUEUE_USER_WEIGHTS.get(username, 1)
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`. A large request may overdraw it."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        # `now` may predate a bucket created during the same pop
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = max(self.updated, now)
+
+    def wait(self, cost, now) -> float:
+        """Seconds until a request of `cost` tokens may start."""
+        self.refill(now)
+        return max(0.0, (min(cost, self.burst) - self.tokens) / self.rate)
+
+
+class _Class:
+    """Waiting requests of one priority, served by deficit round robin across users."""
+
+    def __init__(self):
+        self.queues = {}  # username -> deque of requests
+        self.ring = deque()  # Usernames with waiting requests, in service order
+        self.deficit = {}
+        self.size = 0
+
+    def push(self, request):
+        user = request.username
+        if user not in self.queues:
+            self.queues[user] = deque()
+            self.ring.append(user)
+            self.deficit[user] = 0
+        self.queues[user].append(request)
+        self.size += 1
+
+    def remove(self, request) -> bool:
+        waiting = self.queues.get(request.username)
+        if not waiting or request not in waiting:
+            return False
+        waiting.remove(request)
+        self.size -= 1
+        if not waiting:
+            self._drop(request.username)
+        return True
+
+    def _drop(self, user):
+        del self.queues[user]
+        del self.deficit[user]
+        self.ring.remove(user)
+
+    def pop(self, ready):
+        """
+        Next request by deficit round robin, among users whose head request passes
+        `ready`. Rather than looping through empty rounds, every eligible user is
+        credited the quanta of the rounds it takes someone to afford their head.
+        """
+        best = None
+        for i, user in enumerate(self.ring):
+            head = self.queues[user][0]
+            if not ready(head):
+                continue
+            rounds = max(
+                0, math.ceil((head.cost - self.deficit[user]) / _quantum(user))
+            )
+            if best is None or rounds < best[0]:
+                best = (rounds, i, user)
+                if rounds == 0:
+                    break
+        if best is None:
+            return None
+
+        rounds, i, user = best
+        if rounds:
+            for other in self.ring:
+                if ready(self.queues[other][0]):
+                    self.deficit[other] += rounds * _quantum(other)
+        self.ring.rotate(-i)  # Users passed over move to the back
+        waiting = self.queues[user]
+        request = waiting.popleft()
+        self.size -= 1
+        self.deficit[user] -= request.cost
+        if not waiting:
+            self._drop(user)
+        elif self.deficit[user] < waiting[0].cost:
+            self.ring.rotate(-1)
+        return request
+
+    def positions(self):
+        """
+        (request, place among this class) for every waiting request, assuming
+        equal costs: the k-th request of a user waits for the first k of every
+        user's, and the (k+1)-th of users ahead of it in the ring.
+        """
+        ring = list(self.ring)
+        for i, user in enumerate(ring):
+            for k, request in enumerate(self.queues[user]):
+                others = sum(
+                    min(len(self.queues[u]), k + (j < i))
+                    for j, u in enumerate(ring)
+                    if u != user
+                )
+                yield request, k + others + 1
+
+
+class FairQueue:
+    """
+    Requests waiting for a slot in the decode batch.
+
+    Priority classes are strict: interactive answers start before /read and
+    session prefill, which start before batch items. Within a class users take
+    turns by deficit round robin, weighted by each request's estimated tokens
+    (prompt plus answer limit), so a user with many or long requests cannot
+    crowd out the rest. Users may also be held to a token-bucket rate; a
+    rate-limited user's requests wait while others' run. Owned by the scheduler
+    thread.
+    """
+
+    def __init__(self):
+        self.classes = {priority: _Class() for priority in PRIORITIES}
+        self.buckets = {}  # username -> TokenBucket
+        self.changed = False
+
+    def __len__(self) -> int:
+        return sum(c.size for c in self.classes.values())
+
+    def __iter__(self):
+        for c in self.classes.values():
+            for waiting in c.queues.values():
+                yield from waiting
+
+    def _bucket(self, username) -> TokenBucket | None:
+        """The user's token bucket, or None if they are not rate limited."""
+        if username is None:
+            return None
+        bucket = self.buckets.get(username)
+        if bucket is None:
+            rate, burst = config.USER_RATE_LIMITS.get(
+                username, (config.USER_TOKENS_PER_SECOND, config.USER_TOKEN_BURST)
+            )
+            if not rate:
+                return None
+            bucket = self.buckets[username] = TokenBucket(rate, burst)
+        return bucket
+
+    def push(self, request):
+        self.classes[request.priority].push(request)
+        self.changed = True
+
+    def remove(self, request) -> bool:
+        removed = self.classes[request.priority].remove(request)
+        self.changed |= removed
+        return removed
+
+    def pop(self):
+        """The next request to start, or None if nothing may start yet."""
+        now = time.monotonic()
+
+        def ready(request):
+            bucket = self._bucket(request.username)
+            return bucket is None or bucket.wait(request.cost, now) == 0
+
+        for priority in PRIORITIES:
+            request = self.classes[priority].pop(ready)
+            if request is not None:
+                bucket = self._bucket(request.username)
+                if bucket is not None:
+                    bucket.tokens -= request.cost
+                self.changed = True
+                return request
+        return None
+
+    def drain(self) -> list:
+        """Remove and return every waiting request."""
+        waiting = list(self)
+        self.classes = {priority: _Class() for priority in PRIORITIES}
+        self.changed = True
+        return waiting
+
+    def settle(self, request):
+        """Refund a finished request's charged but ungenerated answer tokens."""
+        bucket = self._bucket(request.username)
+        unused = request.max_new_tokens - len(request.generated)
+        if bucket is not None and unused > 0:
+            bucket.tokens = min(bucket.burst, bucket.tokens + unused)
+
+    def positions(self):
+        """(request, 1-based place in line) for every waiting request, in order."""
+        ahead = 0
+        for priority in PRIORITIES:
+            c = self.classes[priority]
+            for request, place in sorted(c.positions(), key=lambda item: item[1]):
+                yield request, ahead + place
+            ahead += c.size
+
+    def estimate(self, request, slot_wait) -> float | None:
+        """
+        Seconds until `request` starts: `slot_wait` for a batch slot (None if
+        unknown), or longer if the user's rate limit holds it back.
+        """
+        bucket = self._bucket(request.username)
+        limited = bucket.wait(request.cost, time.monotonic()) if bucket else 0.0
+        if slot_wait is None:
+            return round(limited, 1) if limited else None
+        return round(max(slot_wait, limited), 1)
+
+    def status(self, username, slot_waits) -> dict:
+        """
+        Queue depth per priority, and where the user's own requests stand.
+        `slot_waits` maps waiting requests to their estimated seconds until a slot.
+        """
+        mine = [
+            {
+                "priority": request.priority,
+                "position": position,
+                "estimated_wait": self.estimate(request, slot_waits.get(request)),
+                "estimated_tokens": request.cost,
+            }
+            for request, position in self.positions()
+            if request.username == username
+        ]
+        return {
+            "waiting": len(self),
+            "by_priority": {p: c.size for p, c in self.classes.items()},
+            "requests": sorted(mine, key=lambda r: r["position"]),
+        }
@@ -1,45 +1,240 @@
+import asyncio
 import json
-import os
 import time
 from pathlib import Path
 
 import config
-import exllamav2
 import torch
-from exllamav2 import ExLlamaV2Cache_Q8, ExLlamaV2Cache_TP
-from safetensors.torch import save_file
+from metrics import INTER_TOKEN_LATENCY, TIME_TO_FIRST_TOKEN
+from safetensors.torch import load_file
 
-from model.init import ModelState
+from model.admission import ADMISSION
+from model.budget import context_budget, fit_context, prompt_limit, record_turn
+from model.context import SessionContext
+from model.detokenizer import AdaptiveFlusher, IncrementalDetokenizer, StopStrings
+from model.init import ModelState, active_model_name
+from model.kvpool import KV_POOL
+from model.scheduler import SCHEDULER, GenerationRequest
+from model.session_log import SESSION_LOG, read_log
+from model.snapshot import restore_snapshot
+from schema import ChatRequest
 
-buffer = []
-ModelState.session_id = 0
 
+async def start_stream(ctx: SessionContext):
+    """Empty the session's context, stopping an answer still streaming into it."""
+    request = ctx.request
+    if request is not None:
+        await asyncio.wrap_future(SCHEDULER.cancel(request, "cleared"))
+    async with ctx.lock:  # The cancelled answer writes its context back first
+        ctx.reset()
+        await asyncio.wrap_future(SCHEDULER.call(KV_POOL.release, ctx.session_id))
 
-def start_stream():
-    ModelState.cache.reset()  # TODO: investigate why this causes model to talk to itself.
-    ModelState.session_ids = torch.empty((1, 0), dtype=torch.long)
-    ModelState.generator.begin_stream_ex(ModelState.session_ids, ModelState.settings)
-    ModelState.session_active = True
 
+def stop_conditions(token_ids=(), strings=()) -> list:
+    """EOS ids plus a request's own stop token ids and strings, without repeats."""
+    eos_ids = {
+        int(ModelState.tokenizer.eos_token_id or config.EOS_TOKEN_ID),
+        config.EOS_TOKEN_ID,
+        config.EOS_TOKEN_ID_BACKUP,
+    }
+    return list(eos_ids | set(token_ids)) + list(dict.fromkeys(strings))
 
-def encode_file(path: Path):
-    text = path.read_text(encoding="utf-8")
 
-    all_ids = ModelState.tokenizer.encode(text, add_bos=False, add_eos=False)
-    if all_ids.ndim == 1:
-        all_ids = all_ids.unsqueeze(0)
+def response_limit(max_tokens=None) -> int:
+    """Tokens a request may generate: its max_tokens, capped by the model's limit."""
+    limit = ModelState.settings.length
+    return min(max_tokens, limit) if max_tokens else limit
 
-    chunk_size = 16 * 1024
-    injected_tokens = 0
 
-    for i in range(0, all_ids.shape[1], chunk_size):
-        chunk = all_ids[:, i : i + chunk_size]
-        ModelState.model.forward(
-            input_ids=chunk, cache=ModelState.cache, preprocess_only=True
+def sampler_settings(request: ChatRequest):
+    """
+    Sampler settings for one request. Without overrides the shared settings are
+    used as-is; otherwise a copy is changed, so other sequences are unaffected.
+    Greedy mode (or temperature 0) always picks the most likely token.
+    """
+    overrides = {
+        name: getattr(request, name)
+        for name in ("temperature", "top_k", "top_p", "min_p")
+        if getattr(request, name) is not None
+    }
+    if not overrides and not request.greedy:
+        return ModelState.settings
+    settings = ModelState.settings.clone()
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    if request.greedy or settings.temperature == 0:
+        settings.temperature = 1.0
+        settings.top_k = 1
+        settings.top_p = 0.0
+        settings.min_p = 0.0
+    return settings
+
+
+def tokens_for_text(token_ids: list, text: str) -> list:
+    """
+    The generated tokens that spell `text`, a prefix of their decoded output such
+    as an answer cut at a stop string. Tokens past the cut are dropped; a token
+    the cut splits is replaced by the encoding of its kept part.
+    """
+    tokenizer = ModelState.tokenizer
+    k = len(token_ids)
+    prefix = tokenizer.decode_(token_ids, False)
+    while k and len(prefix) > len(text):
+        k -= 1
+        prefix = tokenizer.decode_(token_ids[:k], False)
+    if not text.startswith(prefix):
+        k, prefix = 0, ""  # Decodes differently in pieces: re-encode it all
+    rest = text[len(prefix) :]
+    if not rest:
+        return token_ids[:k]
+    return token_ids[:k] + tokenizer.encode(rest).flatten().tolist()
+
+
+async def prefill(ctx: SessionContext, new_tokens=None):
+    """
+    Run the session's tokens through the scheduler so their KV pages are cached.
+    The single sampled token is discarded; only the prefix pages are kept.
+    Queued as ingestion, costed at `new_tokens` (default: the whole context).
+    """
+    if not ctx.active:
+        return
+    request = SCHEDULER.submit(
+        GenerationRequest(
+            ctx.ids,
+            max_new_tokens=1,
+            session_id=ctx.session_id,
+            username=ctx.username,
+            priority="ingest",
+            cost=None if new_tokens is None else new_tokens + 1,
         )
-        injected_tokens += chunk.shape[1]
+    )
+    try:
+        while True:
+            result = await request.get()
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            if result.get("eos"):
+                return
+    except asyncio.CancelledError:
+        SCHEDULER.cancel(request)
+        raise
+
+
+def read_legacy_interactions(session_path: Path) -> list:
+    """
+    Read per-turn interaction files written before the append-only session log.
+    Each file must contain prompt_ids, response_ids, start_offset, end_offset.
+    """
+    files = sorted(
+        session_path.glob("*.safetensors"),
+        key=lambda f: (
+            int(f.stem.split("_")[-1]) if "_" in f.stem else f.stat().st_mtime
+        ),
+    )
 
-    return injected_tokens
+    interactions = []
+    for fpath in files:
+        data = load_file(fpath)
+        if "prompt_ids" not in data or "response_ids" not in data:
+            continue  # Not an interaction file
+
+        prompt_ids = data["prompt_ids"]
+        if prompt_ids.ndim == 1:
+            prompt_ids = prompt_ids.unsqueeze(0)
+        response_ids = data["response_ids"]
+        if response_ids.ndim == 1:
+            response_ids = response_ids.unsqueeze(0)
+        interactions.append((prompt_ids.long(), response_ids.long(), False))
+    return interactions
+
+
+def read_history(session_path: Path):
+    """Token history of a saved session as (interactions, [1, n] ids)."""
+    SESSION_LOG.flush()
+    interactions = read_log(session_path) or read_legacy_interactions(session_path)
+
+    # Rebuild token stream (prompt + response)
+    history = [
+        ids for prompt, response, _ in interactions for ids in (prompt, response)
+    ]
+    ids = (
+        torch.cat(history, dim=-1) if history else torch.empty((1, 0), dtype=torch.long)
+    )
+    return interactions, ids
+
+
+async def load_session_into_cache(ctx: SessionContext, session_dir: str):
+    """
+    Rebuild a session's token history from its interaction log and prefill it.
+    A valid KV snapshot next to the directory is paged in instead of recomputed.
+    """
+
+    session_path = Path(session_dir)
+    if not session_path.exists():
+        raise FileNotFoundError(f"Session directory not found: {session_dir}")
+
+    interactions, ids = await asyncio.to_thread(read_history, session_path)
+
+    # Prefer the raw KV snapshot; only what it doesn't cover is recomputed
+    restored = 0
+    snapshot = await restore_snapshot(session_path, ids)
+    if snapshot is not None:
+        snapshot_ids, restored = snapshot
+        if snapshot_ids.shape[-1] > ids.shape[-1]:
+            ids = snapshot_ids
+
+    async with ctx.lock:
+        ctx.reset()
+        ctx.ids = ids
+        for prompt_ids, response_ids, instructions in interactions:
+            record_turn(ctx, prompt_ids.shape[-1], response_ids.shape[-1], instructions)
+        ctx.add_span("turn", ids.shape[-1] - sum(s.length for s in ctx.spans))
+        fit_context(ctx, 0)
+        ids = ctx.ids
+        await asyncio.wrap_future(SCHEDULER.call(KV_POOL.touch, ctx.session_id, ids))
+        page_size = ModelState.generator.page_size
+        if restored < ids.shape[-1] // page_size * page_size:
+            await prefill(ctx, ids.shape[-1] - restored)
+
+    print(
+        f"✅ Loaded {len(interactions)} interactions into KV cache. Current seq_len: {ctx.ids.shape[-1]}"
+    )
+
+
+async def abort_generation(ctx: SessionContext) -> bool:
+    """Stop the session's in-flight generation; the partial answer is kept."""
+    request = ctx.request
+    if request is None:
+        return False
+    return await asyncio.wrap_future(SCHEDULER.cancel(request, "aborted"))
+
+
+def generation_stats(result: dict, token_count: int, decode_seconds: float) -> dict:
+    """
+    Per-request numbers reported with [DONE], including draft acceptance. The rate
+    covers decoding only, from the generator's time_generate as for
+    DECODE_THROUGHPUT; a cancelled job has none, so `decode_seconds` (first to last
+    token streamed) stands in. Queueing and prefill are in time to first token.
+    """
+    decoded = result.get("new_tokens", token_count) - 1
+    duration = result.get("time_generate") or decode_seconds
+    stats = {
+        "new_tokens": token_count,
+        "tokens_per_second": (
+            round(decoded / duration, 2) if decoded > 0 and duration > 0 else 0.0
+        ),
+        "cached_tokens": result.get("cached_tokens", 0),
+        "eos_reason": result.get("eos_reason"),
+    }
+    if "accepted_draft_tokens" in result:
+        accepted = result["accepted_draft_tokens"]
+        rejected = result["rejected_draft_tokens"]
+        stats["accepted_draft_tokens"] = accepted
+        stats["rejected_draft_tokens"] = rejected
+        stats["acceptance_rate"] = (
+            round(accepted / (accepted + rejected), 3) if accepted + rejected else 0.0
+        )
+    return stats
 
 
 def normalize_decoded(output):
@@ -50,61 +245,179 @@ def normalize_decoded(output):
     return "".join(output) if isinstance(output, list) else output
 
 
-def continue_prompt(prompt: str):
+def encode_prompt(ctx: SessionContext, prompt: str) -> torch.Tensor:
+    return ModelState.tokenizer.encode(prompt, add_bos=not ctx.active, add_eos=True)
+
+
+def _encoded_for(ctx: SessionContext, input_ids: torch.Tensor) -> bool:
+    """Whether encode_prompt's BOS choice for `input_ids` still matches the context."""
+    bos = ModelState.tokenizer.bos_token_id
+    has_bos = input_ids.shape[-1] > 0 and input_ids[0, 0].item() == bos
+    return has_bos != ctx.active
+
+
+def admission_check(ctx: SessionContext, input_ids, max_new_tokens) -> tuple | None:
+    """ADMISSION's verdict on adding this prompt and answer to the session's context."""
+    context_tokens = ctx.ids.shape[-1]
+    if config.CONTEXT_POLICY == "sliding":
+        # Older turns are evicted to fit, so at most the budget's remainder stays
+        room = context_budget(max_new_tokens) - input_ids.shape[-1]
+        context_tokens = min(context_tokens, max(0, room))
+    return ADMISSION.check(
+        ModelState.generator.max_total_tokens,
+        context_tokens,
+        input_ids.shape[-1],
+        max_new_tokens,
+    )
+
+
+async def continue_prompt(ctx: SessionContext, chat: ChatRequest, input_ids=None):
+    """
+    Stream the answer to `chat.prompt` with the request's own length limit, stop
+    conditions and sampling. Pass `input_ids` if already encoded and admitted;
+    both are redone under the session lock in case the context changed since.
+    `chat.ngram` asks for prompt-lookup drafting for this answer (default:
+    config.NGRAM_DRAFT); it only runs while every answer in the batch asks for it.
+    Drafts are copied from the session's context, including injected files, so
+    edits of code already in the context decode several tokens per step.
+    """
+    async with ctx.lock:
+        async for event in _continue_prompt(ctx, chat, input_ids):
+            yield event
+
+
+async def _continue_prompt(ctx: SessionContext, chat: ChatRequest, input_ids):
     # Send Job
+    detokenizer = IncrementalDetokenizer(ModelState.tokenizer)
+    flusher = AdaptiveFlusher()
+    stopper = StopStrings(chat.stop)
     all_token_ids = []
-    before_len = ModelState.cache.current_seq_len
-    input_ids = ModelState.tokenizer.encode(
-        prompt, add_bos=not ModelState.session_active, add_eos=True
-    )
+    answer = []  # Text passed by the stop-string filter, i.e. what the client gets
+    max_new_tokens = response_limit(chat.max_tokens)
+    if input_ids is not None:
+        # Another request may have changed the context while this one waited
+        if not _encoded_for(ctx, input_ids):
+            input_ids = await asyncio.to_thread(encode_prompt, ctx, chat.prompt)
+        refused = admission_check(ctx, input_ids, max_new_tokens)
+        if refused:
+            error, retry_after = refused
+            yield f"data:{json.dumps({'error': error, 'retry_after': retry_after})}\n\n"
+            return
+    else:
+        input_ids = await asyncio.to_thread(encode_prompt, ctx, chat.prompt)
+    if input_ids.shape[-1] > prompt_limit():
+        error = (
+            f"Prompt is {input_ids.shape[-1]} tokens; the limit is {prompt_limit()}."
+        )
+        yield f"data:{json.dumps({'error': error})}\n\n"
+        return
+    error = fit_context(ctx, input_ids.shape[-1], reserve=max_new_tokens)
+    if error:
+        yield f"data:{json.dumps({'error': error})}\n\n"
+        return
+    before_len = ctx.ids.shape[-1]
+    full_ids = torch.cat([ctx.ids, input_ids], dim=-1)
     token_count = 0
     start_time = time.perf_counter()
-    ModelState.generator._gen_feed_tokens(input_ids, ModelState.settings)
-    while True:
-        result = ModelState.generator.stream_ex()
-        chunk_ids = result.get("chunk_token_ids", None)
-        token_count += chunk_ids.numel()
-
-        eos = result.get("eos", False)
-        if chunk_ids is not None and chunk_ids.numel() > 0:
-            new_ids = chunk_ids[0].tolist()
-            all_token_ids.extend(new_ids)
-
-            # ⛔ Stop if EOS is in output
-            if (
-                (ModelState.tokenizer.eos_token_id in new_ids)
-                or (config.EOS_TOKEN_ID in new_ids)
-                or (config.EOS_TOKEN_ID_BACKUP in new_ids)
-            ):
-                print("✅ Detected EOS token in output — stopping early.")
-                eos = True
-
-            for token in new_ids:
-                buffer.append(token)
-                if len(buffer) >= config.CHUNK_SIZE:
-                    decoded = ModelState.tokenizer.decode(
-                        torch.tensor(buffer).unsqueeze(0)
-                    )
-                    yield f"data:{json.dumps({'text': decoded})}\n\n"
-                    buffer.clear()
-        if eos:
-            break
-    if buffer:
-        final_decoded = ModelState.tokenizer.decode(torch.tensor(buffer).unsqueeze(0))
-        buffer.clear()
-        yield f"data:{json.dumps({'text': final_decoded})}\n\n"
-    duration = time.perf_counter() - start_time
-    yield f"data:{json.dumps({'text': '[DONE]'})}\n\n"
-    print(f"⏱️ {token_count} tokens @ {token_count/duration:.2f} tokens/s.")
-
-    if ModelState.save_interactions:
-        # Save interaction snapshot
-        f = f"{int(time.time())}.safetensors"
-        after_len = ModelState.cache.current_seq_len
-        data = {
-            "prompt_ids": input_ids.cpu(),
-            "response_ids": torch.tensor(all_token_ids).cpu(),
-            "start_offset": torch.tensor([before_len]),
-            "end_offset": torch.tensor([after_len]),
-        }
-        save_file(data, os.path.join(ModelState.session_dir, f))
+    first_token_time = last_token_time = None
+    model = active_model_name()
+    request = SCHEDULER.submit(
+        GenerationRequest(
+            full_ids,
+            max_new_tokens,
+            stop_conditions=stop_conditions(chat.stop_token_ids, chat.stop),
+            session_id=ctx.session_id,
+            ngram=chat.ngram,
+            settings=sampler_settings(chat),
+            username=ctx.username,
+            cost=input_ids.shape[-1] + max_new_tokens,
+        )
+    )
+    ctx.request = request
+    finished = False
+    try:
+        while True:
+            result = await request.get()
+            if "error" in result:
+                finished = True
+                yield f"data:{json.dumps({'error': result['error']})}\n\n"
+                return
+            if "queue" in result:
+                yield f"data:{json.dumps({'queue': result['queue']})}\n\n"
+                continue
+
+            chunk_ids = result.get("token_ids", None)
+            if chunk_ids is not None and chunk_ids.numel() > 0:
+                new_ids = chunk_ids.flatten().tolist()
+                now = time.perf_counter()
+                if last_token_time is None:
+                    first_token_time = now
+                    TIME_TO_FIRST_TOKEN.observe(now - start_time, model)
+                else:
+                    gap = (now - last_token_time) / len(new_ids)
+                    for _ in new_ids:
+                        INTER_TOKEN_LATENCY.observe(gap, model)
+                last_token_time = now
+                token_count += len(new_ids)
+                all_token_ids.extend(new_ids)
+
+                stopped = stopper.hit is not None
+                answer.append(stopper.add(detokenizer.add(new_ids)))
+                text = flusher.add(answer[-1])
+                if text:
+                    yield f"data:{json.dumps({'text': text})}\n\n"
+                if stopper.hit is not None and not stopped and not result.get("eos"):
+                    # Free the slot now; the eos result follows
+                    SCHEDULER.cancel(request, "stop_string")
+            if result.get("eos"):
+                finished = True
+                break
+    finally:
+        ctx.request = None
+        if not finished:
+            # Client went away mid-answer: stop decoding, leave the context as it was
+            SCHEDULER.cancel(request, "disconnected")
+            print(
+                f"🔌 Client disconnected after {token_count} tokens, generation cancelled."
+            )
+
+    if result.get("eos_reason") == "aborted":
+        print(f"🛑 Generation aborted after {token_count} tokens.")
+    elif result.get("eos_reason") == "model_swap":
+        print(f"🛑 Generation cut off by model swap after {token_count} tokens.")
+    tail = stopper.add(detokenizer.finish()) + stopper.finish()
+    answer.append(tail)
+    final_text = (flusher.flush() or "") + tail
+    if final_text:
+        yield f"data:{json.dumps({'text': final_text})}\n\n"
+    if stopper.hit is not None:
+        # Tokens decoded past the stop string never reach the context or the log
+        all_token_ids = tokens_for_text(all_token_ids, "".join(answer))
+        token_count = len(all_token_ids)
+    decode_seconds = last_token_time - first_token_time if first_token_time else 0.0
+    stats = generation_stats(result, token_count, decode_seconds)
+    yield f"data:{json.dumps({'text': '[DONE]', 'stats': stats})}\n\n"
+    print(f"⏱️ {token_count} tokens @ {stats['tokens_per_second']:.2f} tokens/s.")
+    if "acceptance_rate" in stats:
+        print(
+            f"🎯 Draft acceptance {stats['acceptance_rate']:.0%} "
+            f"({stats['accepted_draft_tokens']} accepted, "
+            f"{stats['rejected_draft_tokens']} rejected)"
+        )
+
+    response_ids = torch.tensor(all_token_ids, dtype=torch.long).unsqueeze(0)
+    ctx.ids = torch.cat([full_ids, response_ids], dim=-1)
+    pinned = record_turn(
+        ctx, input_ids.shape[-1], response_ids.shape[-1], chat.instructions
+    )
+
+    if ctx.save_interactions:
+        # Queue the turn for the session log; written off the request path
+        SESSION_LOG.append(
+            ctx.session_dir,
+            input_ids,
+            response_ids,
+            before_len,
+            ctx.ids.shape[-1],
+            pinned,
+        )
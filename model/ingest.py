@@ -0,0 +1,188 @@
+import asyncio
+import codecs
+import time
+from pathlib import Path
+
+import config
+import numpy as np
+import torch
+from file_store import file_digest
+from metrics import INGEST_SECONDS
+
+from model.context import SessionContext
+from model.budget import fit_context
+from model.generation import prefill
+from model.init import ModelState, active_model_name
+
+
+class FileChunks:
+    """
+    Reads a text file INGEST_CHUNK_BYTES at a time and tokenizes it piece by piece.
+    Pieces end at a line break where possible so chunk boundaries don't split a token.
+    """
+
+    def __init__(self, path: Path):
+        self.file = open(path, "rb")
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.carry = ""
+        self.bytes_read = 0
+
+    def next_ids(self) -> torch.Tensor | None:
+        """Token ids of the next piece of the file, or None at end of file."""
+        text = ""
+        while not text:
+            data = self.file.read(config.INGEST_CHUNK_BYTES)
+            self.bytes_read += len(data)
+            text = self.carry + self.decoder.decode(data, final=not data)
+            self.carry = ""
+            if not data:
+                break
+            cut = text.rfind("\n") + 1
+            if cut:
+                text, self.carry = text[:cut], text[cut:]
+        if not text:
+            return None
+
+        ids = ModelState.tokenizer.encode(text, add_bos=False, add_eos=False)
+        return ids.unsqueeze(0) if ids.ndim == 1 else ids
+
+    def close(self):
+        self.file.close()
+
+
+class CachedChunks:
+    """Token ids from the pre-tokenization cache, handed out as a single chunk."""
+
+    def __init__(self, ids: torch.Tensor, size: int):
+        self.ids = ids
+        self.size = size
+        self.bytes_read = 0
+
+    def next_ids(self) -> torch.Tensor | None:
+        ids, self.ids = self.ids, None
+        if ids is not None:
+            self.bytes_read = self.size
+        return ids
+
+    def close(self):
+        pass
+
+
+def token_cache_path(digest: str) -> Path:
+    """uint32 token ids of a file's content under the active tokenizer."""
+    return Path(config.BLOB_DIR) / "tokens" / ModelState.tokenizer_id / f"{digest}.u32"
+
+
+def load_cached_tokens(digest: str) -> torch.Tensor | None:
+    path = token_cache_path(digest)
+    if not path.exists():
+        return None
+    if path.stat().st_size == 0:
+        return torch.empty((1, 0), dtype=torch.long)
+    ids = np.memmap(path, dtype="<u4", mode="r")
+    return torch.from_numpy(ids.astype(np.int64)).unsqueeze(0)
+
+
+def save_cached_tokens(digest: str, ids: torch.Tensor):
+    path = token_cache_path(digest)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    ids.flatten().numpy().astype("<u4").tofile(tmp_path)
+    tmp_path.replace(path)
+
+
+async def ingest_file(ctx: SessionContext, path: Path, force=False):
+    """
+    Stream a file into the session's context, prefilling it chunk by chunk.
+
+    Token ids are cached on disk by content hash and tokenizer, so a file is only
+    tokenized once. Content the session already injected is skipped unless `force`.
+    Otherwise the next chunk is read and tokenized while the current one prefills.
+    Each chunk is fitted into the context budget before it reaches the cache,
+    evicting older turns as fit_context allows; the part of the file already
+    injected is pinned meanwhile. If the file doesn't fit, or ingestion is
+    interrupted, the context is rolled back.
+    Yields progress dicts, ending with {"done": True, "tokens": n} or {"error": ...}.
+    """
+    start = time.perf_counter()
+    total_bytes = path.stat().st_size
+    digest = await asyncio.to_thread(file_digest, path)
+
+    async with ctx.lock:
+        span = ctx.find_span(digest)
+        if span is not None and not force:
+            yield {"done": True, "tokens": 0, "duplicate": True, "span": list(span)}
+            return
+
+        cached = await asyncio.to_thread(load_cached_tokens, digest)
+        if cached is not None:
+            # Size known up front: older turns may be evicted to make room
+            error = fit_context(ctx, cached.shape[-1])
+            if error:
+                yield {"error": error, "status": 413}
+                return
+        chunks = (
+            FileChunks(path) if cached is None else CachedChunks(cached, total_bytes)
+        )
+        pending = None
+        pieces = []
+        before, before_spans = ctx.ids, list(ctx.spans)
+        span = None  # The file's span, growing chunk by chunk
+        injected = 0
+        done = False
+        try:
+            pending = asyncio.ensure_future(asyncio.to_thread(chunks.next_ids))
+            while True:
+                ids = await pending
+                pending = None
+                if ids is None:
+                    break
+                error = fit_context(ctx, ids.shape[-1])
+                if error:
+                    yield {
+                        "error": f"File does not fit after {chunks.bytes_read} of "
+                        f"{total_bytes} bytes. {error}",
+                        "status": 413,
+                    }
+                    return
+
+                pieces.append(ids)
+                ctx.ids = torch.cat([ctx.ids, ids], dim=-1)
+                injected += ids.shape[-1]
+                if span is None:
+                    ctx.add_span("file", ids.shape[-1], pinned=True, key=digest)
+                    span = ctx.spans[-1]
+                else:
+                    span.length += ids.shape[-1]
+                pending = asyncio.ensure_future(asyncio.to_thread(chunks.next_ids))
+                try:
+                    await prefill(ctx, ids.shape[-1])
+                except RuntimeError as e:
+                    yield {"error": str(e), "status": 500}
+                    return
+                yield {
+                    "progress": {
+                        "bytes": chunks.bytes_read,
+                        "total_bytes": total_bytes,
+                        "tokens": injected,
+                    }
+                }
+
+            if cached is None:
+                ids = torch.cat(pieces, dim=-1) if pieces else before[:, :0]
+                try:
+                    await asyncio.to_thread(save_cached_tokens, digest, ids)
+                except OSError as e:
+                    print(f"⚠️ Could not cache tokens for {path.name}: {e}")
+            if span is not None:
+                span.pinned = config.CONTEXT_PIN_FILES
+            done = True
+            INGEST_SECONDS.observe(time.perf_counter() - start, active_model_name())
+            yield {"done": True, "tokens": injected}
+        finally:
+            if not done:
+                ctx.ids, ctx.spans = before, before_spans
+            if pending is not None and not pending.done():
+                pending.add_done_callback(lambda _: chunks.close())
+            else:
+                chunks.close()
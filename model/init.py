@@ -1,110 +1,145 @@
+import gc
+import hashlib
 import json
-import os
 from pathlib import Path
 
 import config
-import exllamav2
 import torch
-from exllamav2.model_init import init as model_init
-from safetensors.torch import load_file
 
 import model.SupportedModel as sm
 
+try:
+    import exllamav2
+    from exllamav2.generator import ExLlamaV2DynamicGenerator, ExLlamaV2DynamicJob
+except ImportError:  # Only the stub backend can run without it
+    exllamav2 = None
+
 
 class ModelState:
     """
     Container for global model state shared across API handlers.
-    Includes model components, cache, and session management.
+    Includes model components, cache, and the shared batching generator.
+    Per-session conversation state lives in model.context.
     """
 
     model = None
+    active_model = None
     config = None
     tokenizer = None
     generator = None
+    job_class = None  # Job type the generator accepts
     settings = None
     cache = None
+    draft_model = None
+    draft_cache = None
+    cache_layout = None
+    tokenizer_id = None
     model_ready = False
-    session_active = False
-    session_ids = None
-    session_dir = None
-    save_interactions = False
 
 
-def load_session_into_cache(session_dir: str):
-    """
-    Reconstruct full KV cache from interaction snapshots in a session directory.
-    Each file must contain prompt_ids, response_ids, start_offset, end_offset.
-    """
+def active_model_name() -> str:
+    """Name of the selected model, used as a metrics label."""
+    return ModelState.active_model.name if ModelState.active_model else "none"
 
-    session_path = Path(session_dir)
-    if not session_path.exists():
-        raise FileNotFoundError(f"Session directory not found: {session_dir}")
 
-    files = sorted(
-        session_path.glob("*.safetensors"),
-        key=lambda f: (
-            int(f.stem.split("_")[-1]) if "_" in f.stem else f.stat().st_mtime
-        ),
-    )
+TOKENIZER_FILES = ("tokenizer.json", "tokenizer.model", "tokenizer_config.json")
 
-    for fpath in files:
-        data = load_file(fpath)
-        if "prompt_ids" not in data or "response_ids" not in data:
-            continue  # Not an interaction file
-
-        prompt_ids = data["prompt_ids"]
-        response_ids = data["response_ids"]
-
-        prompt_ids = data["prompt_ids"]
-        if prompt_ids.ndim == 1:
-            prompt_ids = prompt_ids.unsqueeze(0)
-        response_ids = data["response_ids"]
-        if response_ids.ndim == 1:
-            response_ids = response_ids.unsqueeze(0)
-        # Rebuild token stream (prompt + response)
-        full_ids = torch.cat([prompt_ids, response_ids], dim=-1)
-        if full_ids.ndim == 1:
-            full_ids = full_ids.unsqueeze(0)  # [1, seq_len]
-        # Pre-fill cache with prompt + response to reach final state
-        ModelState.model.forward(
-            input_ids=prompt_ids, cache=ModelState.cache, preprocess_only=True
-        )
 
-    print(
-        f"✅ Loaded {len(files)} interactions into KV cache. Current seq_len: {ModelState.cache.current_seq_len}"
-    )
+def tokenizer_fingerprint(model_dir: str) -> str:
+    """Stable identity of a model's tokenizer, from its vocabulary files."""
+    hasher = hashlib.sha256()
+    for name in TOKENIZER_FILES:
+        path = Path(model_dir) / name
+        if path.exists():
+            hasher.update(name.encode())
+            hasher.update(path.read_bytes())
+    return hasher.hexdigest()[:16]
 
 
-def load_model():
+def cache_class(name: str):
+    """ExLlamaV2 cache class for a CACHE_QUANTIZATION name ("FP16", "Q4", "Q6", "Q8")."""
+    if name == "FP16":
+        return exllamav2.ExLlamaV2Cache
+    return getattr(exllamav2, f"ExLlamaV2Cache_{name}")
+
+
+def cached_json(kind: str, key: str, build):
     """
-    Initialize and load the ExLlamaV2 model, tokenizer, cache, and generator.
+    Load plain JSON data for a load-time artifact from STARTUP_CACHE_DIR, or build
+    and store it. `key` must change whenever the inputs it was built from change.
     """
-    print("🔁 Loading model...")
+    path = Path(config.STARTUP_CACHE_DIR) / f"{kind}-{key}.json"
+    if path.exists():
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️ Rebuilding {kind}, cached copy unreadable: {e}")
+
+    data = build()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        tmp_path.replace(path)
+    except Exception as e:
+        print(f"⚠️ Could not cache {kind}: {e}")
+    return data
+
 
-    # Load model and tokenizer
+def files_key(model_dir: str, names) -> str:
+    """Changes with the exllamav2 version or the size/mtime of any named file."""
+    hasher = hashlib.sha256(exllamav2.__version__.encode())
+    for name in names:
+        path = Path(model_dir) / name
+        if path.exists():
+            stat = path.stat()
+            hasher.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return hasher.hexdigest()[:16]
+
+
+def load_config():
+    """Stage 1: resolve the active model and its ExLlamaV2 config."""
+    if config.BACKEND == "stub":
+        return stub_backend().load_config()
+    if exllamav2 is None:
+        raise RuntimeError("exllamav2 is not installed; set KARLLM_BACKEND=stub")
     activeModel = sm.get_active_model()
+    ModelState.active_model = activeModel
     ModelState.config = exllamav2.ExLlamaV2Config(model_dir=activeModel.path)
     ModelState.config.max_seq_len = activeModel.max_seq_len
-    ModelState.config.max_batch_size = 4
+    ModelState.config.max_batch_size = config.MAX_BATCH_SIZE
     ModelState.config.max_output_len = activeModel.response_limit
     ModelState.config.max_input_len = activeModel.prompt_limit
 
-    ModelState.model = exllamav2.ExLlamaV2(ModelState.config)
 
-    # Initialize KV cache
-    if config.TENSOR_PARALLEL:
-        ModelState.model.load_tp(
-            progress=True,
-            expect_cache_tokens=activeModel.max_seq_len,
-            expect_cache_base=config.CACHE_QUANTIZATION,
-        )
-        ModelState.cache = exllamav2.ExLlamaV2Cache_TP(
-            model=ModelState.model, base=config.CACHE_QUANTIZATION
-        )
-    else:
-        ModelState.model = exllamav2.ExLlamaV2(ModelState.config)
-        ModelState.cache = config.CACHE_QUANTIZATION(ModelState.model)
-        ModelState.model.load_autosplit(ModelState.cache, progress=True)
+def load_vocab(tokenizer, key: str):
+    """
+    Fill the tokenizer's piece tables, which the generator needs and which are slow
+    to decode for large vocabularies, from the cached JSON copy when unchanged.
+    """
+    vocab = cached_json(
+        "vocab",
+        key,
+        lambda: {
+            "pieces": tokenizer.get_id_to_piece_list(False),
+            "special_pieces": tokenizer.get_id_to_piece_list(True),
+        },
+    )
+    tokenizer.id_to_piece = vocab["pieces"]
+    tokenizer.id_to_piece_with_special = vocab["special_pieces"]
+    tokenizer.get_piece_to_id_dict()
+
+
+def load_tokenizer():
+    """Stage 2a: tokenizer, with vocab tables reused from disk when unchanged."""
+    if config.BACKEND == "stub":
+        return stub_backend().load_tokenizer()
+    path = ModelState.active_model.path
+    ModelState.tokenizer_id = tokenizer_fingerprint(path)
+    ModelState.tokenizer = exllamav2.ExLlamaV2Tokenizer(ModelState.config)
+    load_vocab(ModelState.tokenizer, files_key(path, TOKENIZER_FILES))
 
     # Configure sampling
     ModelState.settings = exllamav2.generator.ExLlamaV2Sampler().Settings()
@@ -112,22 +147,139 @@ def load_model():
     ModelState.settings.top_k = config.TOP_K
     ModelState.settings.top_p = config.TOP_P
     ModelState.settings.token_repetition_penalty = config.TOKEN_REPETITION_PENALTY
-    ModelState.settings.length = config.RESPONSE_LIMIT
-
-    ModelState.tokenizer = exllamav2.ExLlamaV2Tokenizer(ModelState.config)
+    ModelState.settings.length = ModelState.active_model.response_limit
     ModelState.settings.eos_token_id = int(
         ModelState.tokenizer.eos_token_id or config.EOS_TOKEN_ID
     )
 
-    # Streaming generator
-    ModelState.generator = exllamav2.generator.ExLlamaV2StreamingGenerator(
+
+def load_weights():
+    """Stage 2b: model weights, split across GPUs."""
+    if config.BACKEND == "stub":
+        return stub_backend().load_weights()
+    activeModel = ModelState.active_model
+    cache_base = cache_class(config.CACHE_QUANTIZATION)
+    ModelState.model = exllamav2.ExLlamaV2(ModelState.config)
+    if config.TENSOR_PARALLEL:
+        ModelState.model.load_tp(
+            progress=True,
+            expect_cache_tokens=activeModel.max_seq_len,
+            expect_cache_base=cache_base,
+        )
+    else:
+        # Autosplit places layers around a lazily allocated cache
+        ModelState.cache = cache_base(ModelState.model, lazy=True)
+        ModelState.model.load_autosplit(ModelState.cache, progress=True)
+
+
+def load_cache():
+    """Stage 3: KV cache and the dynamic generator over it."""
+    if config.BACKEND == "stub":
+        return stub_backend().load_cache()
+    cache_base = cache_class(config.CACHE_QUANTIZATION)
+    if config.TENSOR_PARALLEL:
+        ModelState.cache = exllamav2.ExLlamaV2Cache_TP(
+            model=ModelState.model, base=cache_base
+        )
+    ModelState.cache_layout = f"{type(ModelState.cache).__name__}/{cache_base.__name__}"
+    load_draft(cache_base)
+
+    # Dynamic generator: paged cache shared by every session's jobs
+    ModelState.generator = ExLlamaV2DynamicGenerator(
         model=ModelState.model,
         cache=ModelState.cache,
         tokenizer=ModelState.tokenizer,
+        max_batch_size=config.MAX_BATCH_SIZE,
+        draft_model=ModelState.draft_model,
+        draft_cache=ModelState.draft_cache,
+        num_draft_tokens=ModelState.active_model.num_draft_tokens,
     )
-    # ModelState.generator.warmup()
+    ModelState.job_class = ExLlamaV2DynamicJob
+
 
-    ModelState.session_ids = torch.empty((1, 0), dtype=torch.long)
+def load_draft(cache_base):
+    """
+    Load the active model's draft model, if it declares one, for speculative
+    decoding. Its cache mirrors the target cache's pages. A missing or broken draft,
+    or one with a different vocabulary, only disables speculation.
+    """
+    draft_path = ModelState.active_model.draft_path
+    if not draft_path or not config.SPECULATIVE_DECODING:
+        return
+    if not Path(draft_path).is_dir():
+        print(f"⚠️ Draft model {draft_path} not found, speculative decoding disabled")
+        return
 
+    try:
+        draft_config = exllamav2.ExLlamaV2Config(model_dir=draft_path)
+        if draft_config.vocab_size != ModelState.config.vocab_size:
+            print(
+                f"⚠️ Draft model {draft_path} has a {draft_config.vocab_size}-token "
+                f"vocabulary, the model {ModelState.config.vocab_size}; "
+                "speculative decoding disabled"
+            )
+            return
+        draft_config.max_seq_len = ModelState.cache.max_seq_len
+        draft_config.max_batch_size = config.MAX_BATCH_SIZE
+        draft_model = exllamav2.ExLlamaV2(draft_config)
+        draft_cache = cache_base(
+            draft_model,
+            max_seq_len=ModelState.cache.max_seq_len,
+            batch_size=ModelState.cache.batch_size,
+            lazy=True,
+        )
+        draft_model.load_autosplit(draft_cache, progress=True)
+    except Exception as e:
+        print(f"⚠️ Draft model {draft_path} failed to load, speculation disabled: {e}")
+        return
+
+    ModelState.draft_model = draft_model
+    ModelState.draft_cache = draft_cache
+    ModelState.cache_layout += f"+draft:{Path(draft_path).name}"
+    print(f"✅ Draft model {Path(draft_path).name} loaded for speculative decoding")
+
+
+def warmup():
+    """Stage 4: run a short generation so kernel autotuning isn't paid by a user."""
+    if config.WARMUP:
+        ModelState.generator.warmup()
+
+
+def stub_backend():
+    """CPU stand-in for the model, for benchmarking the serving layer (model.stub)."""
+    import model.stub
+
+    return model.stub
+
+
+def load_model():
+    """
+    Initialize and load the ExLlamaV2 model, tokenizer, cache, and generator.
+    Runs the startup stages in order; startup.py runs them concurrently.
+    """
+    print("🔁 Loading model...")
+    load_config()
+    load_tokenizer()
+    load_weights()
+    load_cache()
+    warmup()
     print("✅ Model fully loaded.")
     ModelState.model_ready = True
+
+
+def unload_model():
+    """Free the model, cache and generator so another model can be loaded."""
+    ModelState.model_ready = False
+    ModelState.generator = None
+    ModelState.job_class = None
+    ModelState.cache = None
+    ModelState.tokenizer = None
+    for model in (ModelState.model, ModelState.draft_model):
+        if model is not None:
+            model.unload()
+    ModelState.model = None
+    ModelState.draft_model = None
+    ModelState.draft_cache = None
+    gc.collect()
+    torch.cuda.empty_cache()
+    print("🧹 Model unloaded.")
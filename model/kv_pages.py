@@ -0,0 +1,99 @@
+import hashlib
+
+import torch
+
+
+def page_hash(page_ids: torch.Tensor, prev_hash):
+    """
+    Chained hash of one full page of tokens.
+    Must match ExLlamaV2DynamicGenerator's page hashing so restored pages are
+    found by the generator's own prefix lookup.
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    if prev_hash is not None:
+        hasher.update(prev_hash)
+    hasher.update(page_ids.reshape(1, -1).long().numpy().tobytes())
+    return hasher.digest()
+
+
+def split_pages(ids: torch.Tensor, page_size: int) -> list:
+    """Every full page of a token sequence as a [1, page_size] tensor."""
+    ids = ids.reshape(1, -1).long()
+    return [
+        ids[:, i * page_size : (i + 1) * page_size]
+        for i in range(ids.shape[-1] // page_size)
+    ]
+
+
+def page_hashes(ids: torch.Tensor, page_size: int) -> list:
+    hashes = []
+    prev_hash = None
+    for page_ids in split_pages(ids, page_size):
+        prev_hash = page_hash(page_ids, prev_hash)
+        hashes.append(prev_hash)
+    return hashes
+
+
+def kv_tensors(generator) -> list:
+    """
+    Every KV tensor behind the generator's pages, sequence on dim 1, in the order
+    its defragmenter uses. Covers TP caches, the scale tensors of Q4/Q6/Q8 caches
+    and the draft model's cache, whose pages mirror the target's.
+    """
+    tensors = list(generator.cache.all_tensors())
+    if generator.draft_cache is not None:
+        tensors += generator.draft_cache.all_tensors()
+    return tensors
+
+
+def find_page(generator, phash):
+    return generator.referenced_pages.get(phash) or generator.unreferenced_pages.get(
+        phash
+    )
+
+
+def read_page(generator, page, pin=True) -> list:
+    """Copy one cache page to host memory, asynchronously if pinned."""
+    start = page.page_index * generator.page_size
+    end = start + generator.page_size
+    blocks = []
+    for t in kv_tensors(generator):
+        src = t[:, start:end]
+        pin = pin and src.is_cuda
+        dst = torch.empty(src.shape, dtype=src.dtype, device="cpu", pin_memory=pin)
+        dst.copy_(src, non_blocking=pin)
+        blocks.append(dst)
+    return blocks
+
+
+def write_page(generator, phash, prev_hash, page_ids, blocks, keep) -> bool:
+    """
+    Restore a host page into the least recently used free cache page and register it
+    under `phash`, so the next job with this prefix treats it as cached.
+    Pages whose hash is in `keep` are never overwritten.
+    """
+    victims = [p for h, p in generator.unreferenced_pages.items() if h not in keep]
+    if not victims:
+        return False
+    page = min(victims, key=lambda p: p.access_serial)
+
+    start = page.page_index * generator.page_size
+    end = start + generator.page_size
+    for dst, src in zip(kv_tensors(generator), blocks):
+        dst[:, start:end].copy_(src, non_blocking=True)
+
+    del generator.unreferenced_pages[page.phash]
+    page.phash = phash
+    page.prev_hash = prev_hash
+    page.sequence[:, :] = page_ids
+    page.kv_position = generator.page_size
+    page.kv_position_revert = generator.page_size
+    page.can_revert = False
+    page.access_serial = generator.access_serial
+    generator.access_serial += 1
+    generator.unreferenced_pages[phash] = page
+    return True
+
+
+def blocks_nbytes(blocks) -> int:
+    return sum(b.numel() * b.element_size() for b in blocks)
@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import OrderedDict
+
+import config
+import torch
+
+from model.prefix_cache import PREFIX_CACHE
+
+
+class SessionPages:
+    """The radix-tree path of fixed-size KV pages one session currently holds."""
+
+    def __init__(self):
+        self.path = []
+        self.last_used = time.monotonic()
+        self.swapped = False
+
+
+class KVPool:
+    """
+    Per-session page ownership with LRU swap-out to pinned host memory.
+
+    The generator keeps pages on the GPU and recycles unreferenced ones on demand.
+    Sessions idle longer than KV_SWAP_IDLE_SECONDS have their pages copied to host
+    so that, if the GPU copy is recycled, their next job pages them back in
+    instead of re-running prefill. Host pages live in the shared PREFIX_CACHE,
+    so a prefix common to several sessions is stored once.
+
+    Methods that touch the cache must run on the scheduler thread.
+    """
+
+    def __init__(self):
+        self.sessions = OrderedDict()  # session_id -> SessionPages, LRU first
+        self.lock = threading.Lock()
+
+    def touch(self, session_id, ids: torch.Tensor):
+        """Record the sequence a session's pages now hold after a job completes."""
+        path = PREFIX_CACHE.insert(ids)
+        if session_id is None:
+            return
+        with self.lock:
+            entry = self.sessions.pop(session_id, None) or SessionPages()
+            PREFIX_CACHE.acquire(path)
+            PREFIX_CACHE.release(entry.path)
+            entry.path = path
+            entry.last_used = time.monotonic()
+            entry.swapped = False
+            self.sessions[session_id] = entry
+
+    def release(self, session_id):
+        """Unpin a session's pages, e.g. after /clear."""
+        with self.lock:
+            entry = self.sessions.pop(session_id, None)
+            if entry is not None:
+                PREFIX_CACHE.release(entry.path)
+
+    def clear(self):
+        """Unpin every session, e.g. before the model holding their pages is unloaded."""
+        with self.lock:
+            for entry in self.sessions.values():
+                PREFIX_CACHE.release(entry.path)
+            self.sessions.clear()
+
+    def sweep(self):
+        """Swap out the least recently used idle session, if any is due."""
+        now = time.monotonic()
+        with self.lock:
+            for entry in self.sessions.values():
+                if entry.swapped or now - entry.last_used < config.KV_SWAP_IDLE_SECONDS:
+                    continue
+                PREFIX_CACHE.offload(entry.path)
+                entry.swapped = True
+                self._trim()
+                return
+
+    def swap_in(self, session_id, ids: torch.Tensor) -> int:
+        """Page back the longest host-resident prefix of `ids` the GPU no longer holds."""
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is not None:
+                self.sessions.move_to_end(session_id)
+                entry.last_used = time.monotonic()
+        return PREFIX_CACHE.restore(ids)
+
+    def _trim(self):
+        # Unpin least recently used sessions until their pages can be evicted
+        while not PREFIX_CACHE.evict() and self.sessions:
+            _, entry = self.sessions.popitem(last=False)
+            PREFIX_CACHE.release(entry.path)
+
+
+KV_POOL = KVPool()
@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+import config
+
+from model.context import SESSION_CONTEXTS
+from model.init import ModelState, load_model, unload_model
+from model.kvpool import KV_POOL
+from model.prefix_cache import PREFIX_CACHE
+from model.scheduler import SCHEDULER
+
+
+def _release_model():
+    # Runs on the scheduler thread: no job may touch the cache while it is freed
+    KV_POOL.clear()
+    if ModelState.active_model is not None:
+        PREFIX_CACHE.drop(ModelState.active_model.name)
+    unload_model()
+
+
+class ModelManager:
+    """
+    Swaps the served model in-process.
+
+    New generations are refused while a swap runs. In-flight answers get
+    MODEL_SWAP_DRAIN_SECONDS to finish and are then cut off, keeping what was
+    already streamed. The old model and cache are freed, and the new model loads
+    on a worker thread. If it fails to load, the previous model is reloaded and
+    the state returns to "ready", with `error` saying what failed; the state is
+    "failed" only when no model could be loaded.
+    Sessions and auth state are untouched; conversation contexts are only reset
+    when the tokenizer changes.
+    """
+
+    def __init__(self):
+        self.state = "ready"
+        self.target = None
+        self.error = None
+        self.started = None
+        self.task = None
+
+    @property
+    def busy(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def status(self) -> dict:
+        active = ModelState.active_model
+        return {
+            "state": self.state,
+            "active_model": active.name if active else None,
+            "target_model": self.target,
+            "model_ready": ModelState.model_ready,
+            "elapsed": round(time.time() - self.started, 1) if self.started else None,
+            "error": self.error,
+        }
+
+    def start_swap(self, model) -> bool:
+        """Begin swapping to `model` in the background; False if a swap is running."""
+        if self.busy:
+            return False
+        self.task = asyncio.create_task(self._swap(model))
+        return True
+
+    async def _swap(self, model):
+        self.target = model.name
+        self.error = None
+        self.started = time.time()
+        previous = ModelState.active_model
+        tokenizer_id = ModelState.tokenizer_id
+        print(f"🔁 Swapping model to {model.name}...")
+
+        SCHEDULER.paused = True
+        try:
+            self.state = "draining"
+            await self._drain()
+            self.state = "unloading"
+            await asyncio.wrap_future(SCHEDULER.call(_release_model))
+            self.state = "loading"
+            model.set_model()
+            await asyncio.to_thread(load_model)
+            self.state = "ready"
+        except Exception as e:
+            self.error = f"Swap to {model.name} failed: {e}"
+            print(f"❌ Model swap to {model.name} failed: {e}")
+            self.state = "failed"
+            if previous is not None:
+                self.state = "reverting"
+                try:
+                    previous.set_model()
+                    await asyncio.to_thread(unload_model)
+                    await asyncio.to_thread(load_model)
+                    self.state = "ready"  # Serving the previous model again
+                except Exception as e:
+                    print(f"❌ Reloading {previous.name} failed: {e}")
+                    self.state = "failed"
+        finally:
+            if ModelState.tokenizer_id != tokenizer_id:
+                # Token ids from the old vocabulary mean nothing to the new model
+                for ctx in SESSION_CONTEXTS.values():
+                    ctx.reset()
+            SCHEDULER.paused = False
+            self.target = None
+
+    async def _drain(self):
+        deadline = time.monotonic() + config.MODEL_SWAP_DRAIN_SECONDS
+        cancelled = False
+        while True:
+            active = await asyncio.wrap_future(SCHEDULER.call(list, SCHEDULER.active))
+            if not active:
+                return
+            if not cancelled and time.monotonic() >= deadline:
+                print(f"⏳ Cutting off {len(active)} generations for model swap")
+                for request in active:
+                    SCHEDULER.cancel(request, "model_swap")
+                cancelled = True
+            await asyncio.sleep(0.1)
+
+
+MODEL_MANAGER = ModelManager()
@@ -0,0 +1,243 @@
+import threading
+import time
+
+import config
+import torch
+
+from model.init import ModelState
+from model.kv_pages import (
+    blocks_nbytes,
+    find_page,
+    page_hash,
+    read_page,
+    split_pages,
+    write_page,
+)
+
+
+class RadixNode:
+    """One full page of tokens; the path from the root spells out the prefix."""
+
+    __slots__ = (
+        "key",
+        "phash",
+        "page_ids",
+        "parent",
+        "children",
+        "blocks",
+        "refs",
+        "last_access",
+    )
+
+    def __init__(self, key=None, phash=None, page_ids=None, parent=None):
+        self.key = key
+        self.phash = phash
+        self.page_ids = page_ids
+        self.parent = parent
+        self.children = {}
+        self.blocks = None  # Pinned host copy of this page's KV, if offloaded
+        self.refs = 0
+        self.last_access = time.monotonic()
+
+
+class PrefixCache:
+    """
+    Radix tree over token-id pages, one tree per model.
+
+    Each node maps a page-aligned prefix to its KV page: on the GPU through the
+    generator's page table (looked up by chained hash) and, once offloaded, as a
+    pinned host copy. Identical prefixes from different sessions or conversations
+    (system prompts, files injected with /read) share one path. Sessions pin the
+    path they hold with refcounts; unpinned host pages are evicted LRU, leaves
+    first, when host memory exceeds KV_HOST_POOL_BYTES.
+    """
+
+    def __init__(self):
+        self.trees = {}  # model name -> root RadixNode
+        self.lock = threading.RLock()
+        self.host_bytes = 0
+        self.lookups = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.restored_pages = 0
+        self.offloaded_pages = 0
+        self.evictions = 0
+
+    def _root(self):
+        name = ModelState.active_model.name if ModelState.active_model else None
+        root = self.trees.get(name)
+        if root is None:
+            root = self.trees[name] = RadixNode()
+        return root
+
+    def _nodes(self):
+        for root in self.trees.values():
+            yield from _subtree(root)
+
+    def _walk(self, ids, create: bool) -> list:
+        now = time.monotonic()
+        path = []
+        node = self._root()
+        for page_ids in split_pages(ids, ModelState.generator.page_size):
+            key = page_ids.to(torch.int32).numpy().tobytes()
+            child = node.children.get(key)
+            if child is None:
+                if not create:
+                    break
+                child = RadixNode(key, page_hash(page_ids, node.phash), page_ids, node)
+                node.children[key] = child
+            child.last_access = now
+            path.append(child)
+            node = child
+        return path
+
+    def insert(self, ids) -> list:
+        """Add every full page of `ids` to the tree and return the node path."""
+        with self.lock:
+            return self._walk(ids, create=True)
+
+    def match(self, ids) -> list:
+        """Longest page-aligned prefix of `ids` already in the tree."""
+        with self.lock:
+            return self._walk(ids, create=False)
+
+    def acquire(self, path: list):
+        with self.lock:
+            for node in path:
+                node.refs += 1
+
+    def release(self, path: list):
+        with self.lock:
+            for node in path:
+                node.refs -= 1
+            if path:
+                self._prune(path[-1])
+
+    def _prune(self, node):
+        while (
+            node.parent is not None
+            and node.refs == 0
+            and node.blocks is None
+            and not node.children
+        ):
+            del node.parent.children[node.key]
+            node = node.parent
+
+    def restore(self, ids) -> int:
+        """
+        Make the longest cached prefix of `ids` GPU-resident, paging host copies
+        back in where the generator has recycled them. Must run on the scheduler
+        thread. Returns the number of prefix tokens the next job can skip.
+        """
+        generator = ModelState.generator
+        with self.lock:
+            path = self._walk(ids, create=False)
+            keep = {node.phash for node in path}
+            cached = 0
+            for node in path:
+                if find_page(generator, node.phash) is None:
+                    if node.blocks is None or not write_page(
+                        generator,
+                        node.phash,
+                        node.parent.phash,
+                        node.page_ids,
+                        node.blocks,
+                        keep,
+                    ):
+                        break
+                    self.restored_pages += 1
+                cached += 1
+            self.lookups += 1
+            if cached:
+                self.hits += 1
+            return cached * generator.page_size
+
+    def offload(self, path: list):
+        """Copy any GPU pages on `path` without a host copy to pinned memory."""
+        generator = ModelState.generator
+        with self.lock:
+            for node in path:
+                if node.blocks is not None:
+                    continue
+                page = find_page(generator, node.phash)
+                if page is None:
+                    break  # Rest of the chain is unreachable without this page
+                node.blocks = read_page(generator, page)
+                self.host_bytes += blocks_nbytes(node.blocks)
+                self.offloaded_pages += 1
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+
+    def evict(self) -> bool:
+        """
+        Drop unpinned host pages, least recently used leaves first, until within
+        KV_HOST_POOL_BYTES. Returns False if pinned pages alone exceed the budget.
+        """
+        with self.lock:
+            while self.host_bytes > config.KV_HOST_POOL_BYTES:
+                candidates = sorted(
+                    (
+                        n
+                        for n in self._nodes()
+                        if n.blocks is not None
+                        and n.refs == 0
+                        and all(c.blocks is None for c in n.children.values())
+                    ),
+                    key=lambda n: n.last_access,
+                )
+                if not candidates:
+                    return False
+                for node in candidates:
+                    if self.host_bytes <= config.KV_HOST_POOL_BYTES:
+                        break
+                    self.host_bytes -= blocks_nbytes(node.blocks)
+                    node.blocks = None
+                    self.evictions += 1
+                    self._prune(node)
+            return True
+
+    def drop(self, name):
+        """Forget a model's tree and free its host pages, e.g. after unloading it."""
+        with self.lock:
+            root = self.trees.pop(name, None)
+            if root is not None:
+                for node in _subtree(root):
+                    if node.blocks is not None:
+                        self.host_bytes -= blocks_nbytes(node.blocks)
+                        node.blocks = None
+
+    def record(self, result: dict):
+        """Account a finished job's prompt and cache-hit token counts."""
+        with self.lock:
+            self.prompt_tokens += result.get("prompt_tokens", 0)
+            self.cached_tokens += result.get("cached_tokens", 0)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "prompt_tokens": self.prompt_tokens,
+                "saved_prefill_tokens": self.cached_tokens,
+                "restored_pages": self.restored_pages,
+                "offloaded_pages": self.offloaded_pages,
+                "evictions": self.evictions,
+                "host_bytes": self.host_bytes,
+                "nodes": {
+                    str(name): sum(1 for _ in _subtree(root))
+                    for name, root in self.trees.items()
+                },
+            }
+
+
+def _subtree(root):
+    stack = list(root.children.values())
+    while stack:
+        node = stack.pop()
+        stack.extend(node.children.values())
+        yield node
+
+
+PREFIX_CACHE = PrefixCache()
@@ -0,0 +1,327 @@
+import asyncio
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import config
+import torch
+from metrics import DECODE_THROUGHPUT, PREFILL_THROUGHPUT
+
+from model.admission import ADMISSION
+from model.fair_queue import FairQueue
+from model.init import ModelState, active_model_name
+from model.kvpool import KV_POOL
+from model.prefix_cache import PREFIX_CACHE
+
+
+class GenerationRequest:
+    """
+    One sequence in the shared decode batch.
+
+    Results are published from the scheduler thread onto a bounded asyncio queue
+    owned by the requesting event loop, so consumers await them without blocking
+    the loop. The scheduler never waits on a slow consumer: once the queue is
+    full, further token results are coalesced into a backlog that drains as the
+    consumer catches up.
+
+    `username` and `priority` place the request in the fair queue; `cost` is its
+    estimated tokens, by default the whole input plus the answer limit.
+    """
+
+    def __init__(
+        self,
+        input_ids,
+        max_new_tokens,
+        stop_conditions=None,
+        session_id=None,
+        ngram=None,
+        settings=None,
+        username=None,
+        priority="interactive",
+        cost=None,
+    ):
+        self.input_ids = input_ids
+        self.max_new_tokens = max_new_tokens
+        self.stop_conditions = stop_conditions or []
+        self.session_id = session_id
+        self.ngram = config.NGRAM_DRAFT if ngram is None else ngram
+        self.settings = settings  # Sampler settings; None for the shared ones
+        self.username = username
+        self.priority = priority
+        self.cost = input_ids.shape[-1] + max_new_tokens if cost is None else cost
+        self.position = None  # Last place in line sent to the consumer
+        self.loop = asyncio.get_running_loop()
+        self.results = asyncio.Queue(maxsize=config.STREAM_QUEUE_SIZE)
+        self.backlog = deque()
+        self.generated = []
+        self.job = None
+        self.cancelled = False
+
+    def publish(self, result: dict):
+        """Hand a result to the consumer's event loop. Called on the scheduler thread."""
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, result)
+        except RuntimeError:
+            pass  # Event loop already closed
+
+    def _deliver(self, result: dict):
+        if not self.backlog and not self.results.full():
+            self.results.put_nowait(result)
+        elif self.backlog and _mergeable(self.backlog[-1], result):
+            self.backlog[-1] = _merge(self.backlog[-1], result)
+        else:
+            self.backlog.append(result)
+
+    async def get(self) -> dict:
+        result = await self.results.get()
+        while self.backlog and not self.results.full():
+            self.results.put_nowait(self.backlog.popleft())
+        return result
+
+
+def _mergeable(a: dict, b: dict) -> bool:
+    return (
+        a.get("stage") == b.get("stage") == "streaming"
+        and not a.get("eos")
+        and not b.get("eos")
+        and "token_ids" in a
+        and "token_ids" in b
+    )
+
+
+def _merge(a: dict, b: dict) -> dict:
+    merged = dict(a)
+    merged["token_ids"] = torch.cat([a["token_ids"], b["token_ids"]], dim=-1)
+    merged["text"] = a.get("text", "") + b.get("text", "")
+    return merged
+
+
+class Scheduler:
+    """
+    Continuous-batching loop around the dynamic generator; the only thread that
+    runs model code.
+
+    Requests from every session are admitted into the running batch between
+    iterations, so sequences join and retire token-by-token instead of waiting
+    for the previous stream to finish. Requests wait in a fair queue until the
+    batch has a free slot; while they wait, consumers are sent their place in
+    line whenever it changes. All generator calls happen on this thread.
+    """
+
+    def __init__(self):
+        self.inbox = queue.Queue()
+        self.queue = FairQueue()
+        self.active = set()
+        self.paused = False  # Refuse new generations, e.g. during a model swap
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._run, name="scheduler", daemon=True
+            )
+            self.thread.start()
+
+    def submit(self, request: GenerationRequest) -> GenerationRequest:
+        self.inbox.put(request)
+        return request
+
+    def call(self, fn, *args) -> Future:
+        """
+        Run fn(*args) on the scheduler thread between iterations.
+        Async callers should await asyncio.wrap_future() on the result.
+        """
+        future = Future()
+        self.inbox.put((fn, args, future))
+        return future
+
+    def cancel(self, request: GenerationRequest, reason="cancelled") -> Future:
+        """
+        Stop a request before the next iteration. Its consumer receives a final
+        eos result with `eos_reason` set to `reason`; the future resolves to False
+        if the request had already finished.
+        """
+        request.cancelled = True
+        return self.call(self._cancel, request, reason)
+
+    def _cancel(self, request: GenerationRequest, reason) -> bool:
+        if self.queue.remove(request):
+            request.publish({"stage": "streaming", "eos": True, "eos_reason": reason})
+            return True
+        if request not in self.active:
+            return False
+        ModelState.generator.cancel(request.job)
+        self.active.discard(request)
+        self.queue.settle(request)
+        # Full pages written so far stay hashed in the cache for the next turn
+        KV_POOL.touch(request.session_id, self._sequence(request))
+        request.publish({"stage": "streaming", "eos": True, "eos_reason": reason})
+        return True
+
+    def _admit(self, request):
+        if isinstance(request, tuple):
+            fn, args, future = request
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return
+        if self.paused:
+            request.publish(
+                {"eos": True, "error": "Model is being swapped, try again shortly"}
+            )
+            return
+        if request.cancelled:
+            request.publish(
+                {"stage": "streaming", "eos": True, "eos_reason": "cancelled"}
+            )
+            return
+        self.queue.push(request)
+
+    def _schedule(self):
+        """Start queued requests, in fair-queue order, while the batch has room."""
+        if self.paused:
+            for request in self.queue.drain():
+                request.publish(
+                    {"eos": True, "error": "Model is being swapped, try again shortly"}
+                )
+        while len(self.active) < config.MAX_BATCH_SIZE:
+            request = self.queue.pop()
+            if request is None:
+                break
+            self._start(request)
+        if self.queue.changed:
+            self.queue.changed = False
+            self._publish_positions()
+
+    def _slot_waits(self) -> dict:
+        waiting = [request for request, _ in self.queue.positions()]
+        return ADMISSION.slot_waits(self.active, waiting)
+
+    def status(self, username) -> dict:
+        """The fair queue's status for `username`. Scheduler thread."""
+        return self.queue.status(username, self._slot_waits())
+
+    def _publish_positions(self):
+        waits = self._slot_waits()
+        for request, position in self.queue.positions():
+            if position != request.position:
+                request.position = position
+                estimate = self.queue.estimate(request, waits.get(request))
+                request.publish(
+                    {
+                        "stage": "queued",
+                        "queue": {"position": position, "estimated_wait": estimate},
+                    }
+                )
+
+    def _start(self, request: GenerationRequest):
+        """Hand a request to the generator; a failure ends only this request."""
+        try:
+            KV_POOL.swap_in(request.session_id, request.input_ids)
+            request.job = ModelState.job_class(
+                input_ids=request.input_ids,
+                max_new_tokens=request.max_new_tokens,
+                stop_conditions=request.stop_conditions,
+                gen_settings=request.settings or ModelState.settings,
+                identifier=request,
+            )
+            ModelState.generator.enqueue(request.job)
+        except Exception as e:
+            print(f"❌ Could not start generation: {e}")
+            self.queue.settle(request)
+            request.publish({"eos": True, "error": str(e)})
+            return
+        self.active.add(request)
+
+    def _run(self):
+        while True:
+            # Block for work only when idle, waking periodically to swap out pages,
+            # or soon if queued requests are waiting out a rate limit
+            KV_POOL.sweep()
+            try:
+                self._admit(
+                    self.inbox.get(
+                        block=not self.active, timeout=0.05 if self.queue else 1.0
+                    )
+                )
+                while True:
+                    self._admit(self.inbox.get_nowait())
+            except queue.Empty:
+                pass
+            self._schedule()
+            ADMISSION.update(self.active, self.queue)
+            if not self.active:
+                continue
+
+            self._select_draft_mode()
+            try:
+                results = ModelState.generator.iterate()
+            except Exception as e:
+                print(f"❌ Generator iteration failed: {e}")
+                ModelState.generator.clear_queue()
+                for request in self.active:
+                    request.publish({"eos": True, "error": str(e)})
+                self.active.clear()
+                continue
+
+            for result in results:
+                request = result["identifier"]
+                token_ids = result.get("token_ids")
+                if token_ids is not None:
+                    request.generated.extend(token_ids.flatten().tolist())
+                request.publish(result)
+                if result.get("eos"):
+                    self._add_draft_stats(result)
+                    self._observe(result)
+                    self.active.discard(request)
+                    self.queue.settle(request)
+                    PREFIX_CACHE.record(result)
+                    KV_POOL.touch(request.session_id, self._sequence(request))
+            ADMISSION.update(self.active, self.queue)
+
+    def _select_draft_mode(self):
+        """
+        Turn prompt-lookup drafting on for this iteration if every request in
+        the batch asked for it. The generator drafts for the whole batch or not
+        at all, so one opted-out request decodes the batch one token at a time.
+        Models with a draft model always use it instead.
+        """
+        generator = ModelState.generator
+        if generator.draft_model:
+            return
+        ngram = all(request.ngram for request in self.active)
+        generator.use_ngram_draft = ngram
+        generator.num_draft_tokens = config.NGRAM_DRAFT_TOKENS if ngram else 0
+        generator.max_ngram = config.NGRAM_MAX
+
+    def _add_draft_stats(self, result: dict):
+        """
+        Report a job's draft counts even if drafting was off for the batch when it
+        finished; they count tokens drafted in earlier iterations.
+        """
+        job = result["identifier"].job
+        if "accepted_draft_tokens" not in result and (
+            job.accepted_draft_tokens or job.rejected_draft_tokens
+        ):
+            result["accepted_draft_tokens"] = job.accepted_draft_tokens
+            result["rejected_draft_tokens"] = job.rejected_draft_tokens
+
+    def _observe(self, result: dict):
+        """Record a finished job's prefill and decode throughput."""
+        ADMISSION.observe(result)
+        model = active_model_name()
+        prefilled = result.get("prompt_tokens", 0) - result.get("cached_tokens", 0)
+        if prefilled > 0 and result.get("time_prefill", 0) > 0:
+            PREFILL_THROUGHPUT.observe(prefilled / result["time_prefill"], model)
+        decoded = result.get("new_tokens", 0) - 1
+        if decoded > 0 and result.get("time_generate", 0) > 0:
+            DECODE_THROUGHPUT.observe(decoded / result["time_generate"], model)
+
+    def _sequence(self, request: GenerationRequest):
+        generated = torch.tensor(request.generated, dtype=torch.long).unsqueeze(0)
+        return torch.cat([request.input_ids.reshape(1, -1).long(), generated], dim=-1)
+
+
+SCHEDULER = Scheduler()
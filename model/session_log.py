@@ -0,0 +1,252 @@
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import config
+import numpy as np
+import torch
+
+try:
+    import zstandard
+except ImportError:  # Compression is optional
+    zstandard = None
+
+LOG_FILE = "interactions.log"
+INDEX_FILE = "interactions.idx"
+
+# magic, flags, start_offset, end_offset, n_prompt, n_response, payload_len, crc32
+RECORD = struct.Struct("<4sBIIIIII")
+RECORD_MAGIC = b"KLR1"
+FLAG_ZSTD = 0x01
+FLAG_INSTRUCTIONS = 0x02  # The prompt was sent as pinned instructions
+OFFSET = struct.Struct("<Q")
+
+
+def encode_record(
+    prompt_ids, response_ids, start_offset, end_offset, instructions=False
+) -> bytes:
+    """One interaction as a self-delimiting record of uint32 token ids."""
+    prompt = np.asarray(prompt_ids.flatten().tolist(), dtype="<u4")
+    response = np.asarray(response_ids.flatten().tolist(), dtype="<u4")
+    payload = prompt.tobytes() + response.tobytes()
+    flags = FLAG_INSTRUCTIONS if instructions else 0
+    if config.SESSION_LOG_COMPRESSION == "zstd" and zstandard is not None:
+        payload = zstandard.ZstdCompressor().compress(payload)
+        flags |= FLAG_ZSTD
+    header = RECORD.pack(
+        RECORD_MAGIC,
+        flags,
+        start_offset,
+        end_offset,
+        len(prompt),
+        len(response),
+        len(payload),
+        zlib.crc32(payload),
+    )
+    return header + payload
+
+
+def _scan(data: bytes):
+    """Yield (offset, header, payload) for each intact record, stopping at a torn tail."""
+    pos = 0
+    while pos + RECORD.size <= len(data):
+        header = RECORD.unpack_from(data, pos)
+        magic, length, crc = header[0], header[6], header[7]
+        payload = data[pos + RECORD.size : pos + RECORD.size + length]
+        if magic != RECORD_MAGIC or len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        yield pos, header, payload
+        pos += RECORD.size + length
+
+
+def read_log(session_dir) -> list:
+    """
+    Read every complete interaction in a session log with one sequential read.
+    Returns a list of (prompt_ids, response_ids, instructions): int64 tensors and
+    whether the prompt was pinned. A torn or corrupt tail left by a crash is ignored.
+    """
+    path = Path(session_dir) / LOG_FILE
+    if not path.exists():
+        return []
+
+    interactions = []
+    for _, header, payload in _scan(path.read_bytes()):
+        flags, n_prompt, n_response = header[1], header[4], header[5]
+        if flags & FLAG_ZSTD:
+            if zstandard is None:
+                raise RuntimeError(f"zstandard is required to read {path}")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        ids = torch.from_numpy(np.frombuffer(payload, dtype="<u4").astype(np.int64))
+        prompt_ids = ids[:n_prompt].unsqueeze(0)
+        response_ids = ids[n_prompt : n_prompt + n_response].unsqueeze(0)
+        interactions.append((prompt_ids, response_ids, bool(flags & FLAG_INSTRUCTIONS)))
+    return interactions
+
+
+def recover_log(session_dir):
+    """Cut a torn tail off the log and its index so new records stay reachable."""
+    log_path = Path(session_dir) / LOG_FILE
+    if not log_path.exists():
+        return
+    data = log_path.read_bytes()
+    end = 0
+    for pos, header, _ in _scan(data):
+        end = pos + RECORD.size + header[6]
+    if end < len(data):
+        print(f"⚠️ Truncating torn session log {log_path} at byte {end}")
+        os.truncate(log_path, end)
+        offsets = [o for o in record_offsets(session_dir) if o < end]
+        (Path(session_dir) / INDEX_FILE).write_bytes(
+            b"".join(OFFSET.pack(o) for o in offsets)
+        )
+
+
+def record_offsets(session_dir) -> list:
+    """Byte offset of each record in the log, from the offset index."""
+    path = Path(session_dir) / INDEX_FILE
+    if not path.exists():
+        return []
+    data = path.read_bytes()
+    return [
+        o for (o,) in OFFSET.iter_unpack(data[: len(data) // OFFSET.size * OFFSET.size])
+    ]
+
+
+class SessionLogWriter:
+    """
+    Background writer for append-only session logs.
+
+    Turns are queued from the request path and appended off-thread. Durability
+    follows SESSION_LOG_FSYNC: "always" fsyncs every record, "interval" fsyncs
+    dirty logs every SESSION_LOG_FSYNC_INTERVAL seconds, "never" leaves it to the OS.
+    After each record, `on_append` callbacks get the session directory, the
+    conversation's length in tokens and the bytes now on disk.
+    """
+
+    MAX_OPEN = 64
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.files = OrderedDict()  # session_dir -> (log file, index file)
+        self.dirty = set()
+        self.last_sync = time.monotonic()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.on_append = []  # Callbacks taking (session_dir, tokens, bytes)
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="session-log", daemon=True
+                )
+                self.thread.start()
+
+    def append(
+        self,
+        session_dir,
+        prompt_ids,
+        response_ids,
+        start_offset,
+        end_offset,
+        instructions=False,
+    ):
+        self.start()
+        record = encode_record(
+            prompt_ids, response_ids, start_offset, end_offset, instructions
+        )
+        self.queue.put((str(session_dir), record))
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        if self.thread is not None:
+            self.queue.join()
+
+    def close(self, session_dir):
+        """Flush and release the handles for a session log, e.g. before deleting it."""
+        if self.thread is None:
+            return  # Nothing appended in this process, so no handles are open
+        self.flush()
+        self.queue.put((str(session_dir), None))
+        self.queue.join()
+
+    def is_open(self, session_dir) -> bool:
+        """True if the writer holds handles for this session log."""
+        target = Path(session_dir)
+        return any(Path(d) == target for d in list(self.files))
+
+    def _open(self, session_dir):
+        handles = self.files.pop(session_dir, None)
+        if handles is None:
+            recover_log(session_dir)
+            handles = (
+                open(Path(session_dir) / LOG_FILE, "ab"),
+                open(Path(session_dir) / INDEX_FILE, "ab"),
+            )
+            while len(self.files) >= self.MAX_OPEN:
+                self._release(*self.files.popitem(last=False))
+        self.files[session_dir] = handles
+        return handles
+
+    def _release(self, session_dir, handles):
+        for f in handles:
+            if session_dir in self.dirty:
+                os.fsync(f.fileno())
+            f.close()
+        self.dirty.discard(session_dir)
+
+    def _sync(self):
+        for session_dir in self.dirty:
+            for f in self.files[session_dir]:
+                os.fsync(f.fileno())
+        self.dirty.clear()
+        self.last_sync = time.monotonic()
+
+    def _run(self):
+        while True:
+            try:
+                session_dir, record = self.queue.get(
+                    timeout=config.SESSION_LOG_FSYNC_INTERVAL
+                )
+            except queue.Empty:
+                if self.dirty:
+                    self._sync()
+                continue
+
+            try:
+                if record is None:
+                    handles = self.files.pop(session_dir, None)
+                    if handles is not None:
+                        self._release(session_dir, handles)
+                    continue
+
+                # Record first, then its offset, so the index never points past the log
+                log, index = self._open(session_dir)
+                log.seek(0, os.SEEK_END)
+                offset = log.tell()
+                log.write(record)
+                log.flush()
+                index.write(OFFSET.pack(offset))
+                index.flush()
+                if config.SESSION_LOG_FSYNC != "never":
+                    self.dirty.add(session_dir)
+                    if config.SESSION_LOG_FSYNC == "always" or (
+                        time.monotonic() - self.last_sync
+                        >= config.SESSION_LOG_FSYNC_INTERVAL
+                    ):
+                        self._sync()
+                tokens = RECORD.unpack_from(record)[3]  # end_offset
+                for callback in self.on_append:
+                    callback(session_dir, tokens, log.tell() + index.tell())
+            except Exception as e:
+                print(f"❌ Failed to write session log for {session_dir}: {e}")
+            finally:
+                self.queue.task_done()
+
+
+SESSION_LOG = SessionLogWriter()
@@ -0,0 +1,272 @@
+import asyncio
+import json
+import struct
+from pathlib import Path
+
+import config
+import torch
+from safetensors import safe_open
+
+from model.init import ModelState
+from model.kv_pages import (
+    find_page,
+    kv_tensors,
+    page_hashes,
+    read_page,
+    split_pages,
+    write_page,
+)
+from model.prefix_cache import PREFIX_CACHE
+from model.scheduler import SCHEDULER
+
+SNAPSHOT_FORMAT = "karllm-kv/2"  # kv.j stored page-major: [pages, *page block shape]
+DTYPES = {
+    torch.float16: "F16",
+    torch.bfloat16: "BF16",
+    torch.float32: "F32",
+    torch.uint8: "U8",
+    torch.int8: "I8",
+    torch.int16: "I16",
+    torch.int32: "I32",
+    torch.int64: "I64",
+}
+
+
+def snapshot_path(session_dir) -> Path:
+    """KV snapshot file kept next to its session directory."""
+    session_dir = Path(session_dir)
+    return session_dir.parent / f"{session_dir.name}.kv.safetensors"
+
+
+def snapshot_metadata(pages) -> dict:
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "model": ModelState.active_model.name,
+        "quant": str(ModelState.active_model.quant),
+        "cache": ModelState.cache_layout,
+        "tokenizer": ModelState.tokenizer_id,
+        "page_size": str(ModelState.generator.page_size),
+        "pages": str(pages),
+    }
+
+
+def _available_pages(ids, hashes) -> int:
+    """How many leading full pages of `ids` are cached, on GPU or host. No copies."""
+    generator = ModelState.generator
+    nodes = PREFIX_CACHE.match(ids)
+    for i, phash in enumerate(hashes):
+        if find_page(generator, phash) is None and not (
+            i < len(nodes) and nodes[i].blocks is not None
+        ):
+            return i
+    return len(hashes)
+
+
+def _collect_pages(ids, hashes, start, end) -> list:
+    """Host copies of cached pages start..end of `ids`, stopping at the first gap."""
+    generator = ModelState.generator
+    nodes = PREFIX_CACHE.match(ids)
+    pages = []
+    for i in range(start, end):
+        page = find_page(generator, hashes[i])
+        if page is not None:
+            pages.append(read_page(generator, page, pin=False))
+        elif i < len(nodes) and nodes[i].blocks is not None:
+            pages.append(nodes[i].blocks)
+        else:
+            break
+    return pages
+
+
+def _write_pages(batch, keep) -> int:
+    """Write (phash, prev_hash, page_ids, blocks) pages into the cache, in order."""
+    generator = ModelState.generator
+    written = 0
+    for phash, prev_hash, page_ids, blocks in batch:
+        if find_page(generator, phash) is None and not write_page(
+            generator, phash, prev_hash, page_ids, blocks, keep
+        ):
+            break
+        written += 1
+    return written
+
+
+class SnapshotWriter:
+    """
+    A safetensors snapshot written a chunk of pages at a time, so neither the
+    scheduler nor host memory ever holds the whole context. Room for `capacity`
+    pages is laid out up front; the header goes in last with the number of pages
+    actually written, space-padded to the size reserved for it.
+    """
+
+    def __init__(self, path, ids, capacity, page_blocks, metadata):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_suffix(".tmp")
+        self.metadata = metadata
+        self.written = 0
+        self.layout = {}  # name -> (dtype, shape, offset, bytes per page)
+        offset = 0
+        for j, block in enumerate(page_blocks):
+            page_bytes = block.numel() * block.element_size()
+            shape = [capacity, *block.shape]
+            self.layout[f"kv.{j}"] = (DTYPES[block.dtype], shape, offset, page_bytes)
+            offset += capacity * page_bytes
+        self.ids = ids.reshape(1, -1).long().contiguous()
+        self.layout["ids"] = ("I64", list(self.ids.shape), offset, 8 * self.ids.numel())
+        offset += 8 * self.ids.numel()
+        # Fewer pages never lengthens the header, so this size always fits
+        self.header_size = -(-len(self._header(capacity)) // 8) * 8
+        self.data_start = 8 + self.header_size
+        self.file = open(self.tmp_path, "wb")
+        self.file.truncate(self.data_start + offset)
+        self._write(self.layout["ids"][2], self.ids)
+
+    def _header(self, pages) -> bytes:
+        header = {"__metadata__": {**self.metadata, "pages": str(pages)}}
+        for name, (dtype, shape, offset, page_bytes) in self.layout.items():
+            size = page_bytes * (shape[0] if name != "ids" else 1)
+            header[name] = {
+                "dtype": dtype,
+                "shape": shape,
+                "data_offsets": [offset, offset + size],
+            }
+        return json.dumps(header, separators=(",", ":")).encode()
+
+    def _write(self, offset, tensor):
+        self.file.seek(self.data_start + offset)
+        self.file.write(tensor.contiguous().view(torch.uint8).numpy().tobytes())
+
+    def write(self, pages):
+        """Append host page copies (lists of blocks, one per KV tensor)."""
+        for j in range(len(pages[0])):
+            _, _, offset, page_bytes = self.layout[f"kv.{j}"]
+            data = torch.stack([blocks[j] for blocks in pages])
+            self._write(offset + self.written * page_bytes, data)
+        self.written += len(pages)
+
+    def finish(self):
+        header = self._header(self.written).ljust(self.header_size)
+        self.file.seek(0)
+        self.file.write(struct.pack("<Q", self.header_size) + header)
+        self.file.close()
+        self.tmp_path.replace(self.path)
+
+    def abort(self):
+        self.file.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+async def save_snapshot(session_dir, ids) -> int:
+    """
+    Dump the KV pages holding `ids` to a safetensors file next to the session
+    directory, a few pages per scheduler call so decode for other sessions keeps
+    running between chunks. Returns the number of tokens whose KV was saved.
+    """
+    page_size = ModelState.generator.page_size
+    hashes = await asyncio.to_thread(page_hashes, ids, page_size)
+    capacity = await asyncio.wrap_future(SCHEDULER.call(_available_pages, ids, hashes))
+    writer = None
+    try:
+        for start in range(0, capacity, config.KV_SNAPSHOT_CHUNK_PAGES):
+            end = min(start + config.KV_SNAPSHOT_CHUNK_PAGES, capacity)
+            pages = await asyncio.wrap_future(
+                SCHEDULER.call(_collect_pages, ids, hashes, start, end)
+            )
+            if pages and writer is None:
+                writer = await asyncio.to_thread(
+                    SnapshotWriter,
+                    snapshot_path(session_dir),
+                    ids,
+                    capacity,
+                    pages[0],
+                    snapshot_metadata(0),
+                )
+            if pages:
+                await asyncio.to_thread(writer.write, pages)
+            if len(pages) < end - start:
+                break  # Evicted since counting; keep the pages before the gap
+        if writer is None:
+            return 0
+        await asyncio.to_thread(writer.finish)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    return writer.written * page_size
+
+
+def _validate(f) -> str | None:
+    meta = f.metadata() or {}
+    expected = snapshot_metadata(meta.get("pages"))
+    for key in ("format", "model", "quant", "cache", "tokenizer", "page_size"):
+        if meta.get(key) != expected[key]:
+            return f"{key} mismatch ({meta.get(key)} != {expected[key]})"
+
+    tensors = kv_tensors(ModelState.generator)
+    names = set(f.keys())
+    if names != {f"kv.{j}" for j in range(len(tensors))} | {"ids"}:
+        return "cache layout mismatch"
+    page_size = ModelState.generator.page_size
+    for j, t in enumerate(tensors):
+        shape = f.get_slice(f"kv.{j}").get_shape()
+        if list(shape[1:]) != [t.shape[0], page_size, *t.shape[2:]]:
+            return f"cache shape mismatch on kv.{j}"
+    return None
+
+
+async def restore_snapshot(session_dir, history):
+    """
+    Page a session's KV snapshot straight into the cache instead of recomputing it.
+    `history` (ids rebuilt from interaction files) must agree with the snapshot on
+    their common prefix. Returns (snapshot ids, restored tokens), or None if there
+    is no usable snapshot.
+    """
+    path = snapshot_path(session_dir)
+    if not path.exists():
+        return None
+
+    page_size = ModelState.generator.page_size
+    with safe_open(str(path), framework="pt", device="cpu") as f:
+        reason = _validate(f)
+        if reason:
+            print(f"⚠️ Ignoring stale KV snapshot {path}: {reason}")
+            return None
+
+        ids = f.get_tensor("ids")
+        common = min(ids.shape[-1], history.shape[-1])
+        if not torch.equal(ids[:, :common], history[:, :common]):
+            print(f"⚠️ Ignoring stale KV snapshot {path}: history diverges")
+            return None
+
+        pages = int(f.metadata()["pages"])
+        hashes = page_hashes(ids, page_size)[:pages]
+        page_ids = split_pages(ids, page_size)
+        keep = set(hashes)
+        slices = [
+            f.get_slice(f"kv.{j}") for j in range(len(kv_tensors(ModelState.generator)))
+        ]
+
+        # Read through the memory map a few pages at a time so decode for other
+        # sessions keeps running between chunks
+        restored = 0
+        for start in range(0, pages, config.KV_SNAPSHOT_CHUNK_PAGES):
+            end = min(start + config.KV_SNAPSHOT_CHUNK_PAGES, pages)
+            data = await asyncio.to_thread(lambda: [s[start:end] for s in slices])
+            batch = [
+                (
+                    hashes[i],
+                    hashes[i - 1] if i else None,
+                    page_ids[i],
+                    [d[i - start] for d in data],
+                )
+                for i in range(start, end)
+            ]
+            written = await asyncio.wrap_future(
+                SCHEDULER.call(_write_pages, batch, keep)
+            )
+            restored += written
+            if written < len(batch):
+                break
+
+    print(f"✅ Restored {restored} KV pages from {path}")
+    return ids, restored * page_size
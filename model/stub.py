@@ -0,0 +1,339 @@
+"""
+CPU stand-in for the model, tokenizer and dynamic generator, selected with
+KARLLM_BACKEND=stub. It answers with deterministic filler text after sleeping
+for configurable prefill and decode times. Its page table mirrors the real
+generator's, so prefix caching, KV swapping and snapshots all run against it.
+Use it to measure the serving layer, e.g. with benchmark.py, on a machine
+without a GPU.
+"""
+
+import copy
+import math
+import os
+import random
+import re
+import time
+
+import config
+import torch
+
+from model.init import ModelState
+from model.kv_pages import page_hash, split_pages
+from model.SupportedModel import SupportedModel
+
+STUB_WORDS = (
+    "the quick brown fox jumps over a lazy dog while "
+    "def return import class self value list index for in if else"
+).split()
+LENGTH_HINT = re.compile(r"\[stub:(\d+)\]")
+
+
+class StubTokenizer:
+    """One token per UTF-8 byte, after three special tokens."""
+
+    bos_token_id = 1
+    eos_token_id = 2
+    special = 3
+
+    def encode(self, text, add_bos=False, add_eos=False, **kwargs) -> torch.Tensor:
+        ids = [b + self.special for b in text.encode("utf-8")]
+        if add_bos:
+            ids.insert(0, self.bos_token_id)
+        if add_eos:
+            ids.append(self.eos_token_id)
+        return torch.tensor([ids], dtype=torch.long)
+
+    def decode_(self, ids, decode_special_tokens=False) -> str:
+        data = bytes(i - self.special for i in ids if i >= self.special)
+        return data.decode("utf-8", errors="replace")
+
+    def decode(self, ids, decode_special_tokens=False) -> str:
+        return self.decode_(torch.as_tensor(ids).flatten().tolist())
+
+
+class StubSettings:
+    """Sampler settings; the stub only reads `length`."""
+
+    def __init__(self):
+        self.temperature = config.TEMPERATURE
+        self.top_k = config.TOP_K
+        self.top_p = config.TOP_P
+        self.min_p = 0.0
+        self.token_repetition_penalty = config.TOKEN_REPETITION_PENALTY
+        self.length = ModelState.active_model.response_limit
+        self.eos_token_id = StubTokenizer.eos_token_id
+
+    def clone(self):
+        return copy.copy(self)
+
+
+class StubModel:
+    def unload(self):
+        pass
+
+
+class StubCache:
+    """One small CPU tensor, so page copies and snapshots have something to move."""
+
+    def __init__(self, max_seq_len):
+        self.max_seq_len = max_seq_len
+        self.batch_size = 1
+        self.kv = torch.zeros((1, max_seq_len, 1), dtype=torch.float16)
+
+    def all_tensors(self) -> list:
+        return [self.kv]
+
+
+class StubPage:
+    def __init__(self, page_index, page_size):
+        self.page_index = page_index
+        self.phash = os.urandom(16)
+        self.prev_hash = None
+        self.sequence = torch.zeros((1, page_size), dtype=torch.long)
+        self.kv_position = 0
+        self.kv_position_revert = 0
+        self.can_revert = False
+        self.access_serial = page_index
+        self.ref_count = 0
+
+
+class StubJob:
+    """
+    A job whose answer is fixed up front: filler words seeded by the prompt,
+    [stub:N] tokens long if the prompt asks for that, else STUB_RESPONSE_TOKENS.
+    """
+
+    def __init__(
+        self,
+        input_ids,
+        max_new_tokens,
+        stop_conditions=None,
+        identifier=None,
+        **kwargs,
+    ):
+        self.input_ids = input_ids.reshape(1, -1).long()
+        self.max_new_tokens = max_new_tokens
+        self.identifier = identifier
+        self.pages = []
+        self.cached_tokens = 0
+        self.generated = []
+        self.accepted_draft_tokens = 0
+        self.rejected_draft_tokens = 0
+        self.time_enqueue = time.time()
+        self.time_first_prefill = None
+        self.time_first_token = None
+
+        ids = self.input_ids.flatten().tolist()
+        prompt = ModelState.tokenizer.decode_(ids[-4096:])
+        hints = LENGTH_HINT.findall(prompt)
+        length = int(hints[-1]) if hints else config.STUB_RESPONSE_TOKENS
+        rng = random.Random(hash(tuple(ids[-256:])))
+        text = ""
+        while len(text.encode("utf-8")) < length:
+            text += rng.choice(STUB_WORDS) + " "
+        self.answer = ModelState.tokenizer.encode(text).flatten().tolist()[:length]
+        self.length = min(length, max_new_tokens)
+
+    def sequence(self) -> torch.Tensor:
+        generated = torch.tensor([self.generated], dtype=torch.long)
+        return torch.cat([self.input_ids, generated], dim=-1)
+
+
+class StubGenerator:
+    """
+    Batched decode loop with the dynamic generator's page table and result dicts.
+    Each iteration prefills newly started jobs, then decodes one token for every
+    active job, sleeping as long as a real model would take.
+    """
+
+    def __init__(self, cache, tokenizer, max_batch_size):
+        self.cache = cache
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.draft_model = None
+        self.draft_cache = None
+        self.use_ngram_draft = False
+        self.num_draft_tokens = 0
+        self.max_ngram = 4
+        self.page_size = 256
+        self.max_total_tokens = cache.max_seq_len
+        self.max_pages = max(cache.max_seq_len // self.page_size, 1)
+        self.all_pages = [StubPage(i, self.page_size) for i in range(self.max_pages)]
+        self.referenced_pages = {}
+        self.unreferenced_pages = {p.phash: p for p in self.all_pages}
+        self.access_serial = self.max_pages
+        self.pending_jobs = []
+        self.active_jobs = []
+
+    def enqueue(self, job: StubJob):
+        self.pending_jobs.append(job)
+
+    def cancel(self, job: StubJob):
+        if job in self.pending_jobs:
+            self.pending_jobs.remove(job)
+        if job in self.active_jobs:
+            self.active_jobs.remove(job)
+            self._release(job)
+
+    def clear_queue(self):
+        for job in list(self.pending_jobs) + list(self.active_jobs):
+            self.cancel(job)
+
+    def warmup(self):
+        pass
+
+    def iterate(self) -> list:
+        results = []
+        started = []
+        while self.pending_jobs and len(self.active_jobs) < self.max_batch_size:
+            if not self._allocate(self.pending_jobs[0]):
+                break
+            job = self.pending_jobs.pop(0)
+            self.active_jobs.append(job)
+            started.append(job)
+
+        now = time.time()
+        for job in started:
+            job.time_first_prefill = now
+        prefill = sum(j.input_ids.shape[-1] - j.cached_tokens for j in started)
+        time.sleep(prefill * config.STUB_PREFILL_SECONDS_PER_TOKEN)
+        if not self.active_jobs:
+            return results
+
+        time.sleep(
+            config.STUB_DECODE_SECONDS_PER_STEP
+            + len(self.active_jobs) * config.STUB_DECODE_SECONDS_PER_SEQUENCE
+        )
+        now = time.time()
+        for job in list(self.active_jobs):
+            if job.time_first_token is None:
+                job.time_first_token = now
+            result = {
+                "job": job,
+                "stage": "streaming",
+                "eos": False,
+                "identifier": job.identifier,
+            }
+            if len(job.generated) < job.length:
+                token = job.answer[len(job.generated)]
+                job.generated.append(token)
+                result["token_ids"] = torch.tensor([[token]], dtype=torch.long)
+                result["text"] = self.tokenizer.decode_([token])
+            if len(job.generated) >= job.length:
+                result.update(self._finish(job, now))
+            results.append(result)
+        return results
+
+    def _finish(self, job: StubJob, now) -> dict:
+        self.active_jobs.remove(job)
+        self._release(job)
+        full = job.length >= job.max_new_tokens
+        return {
+            "eos": True,
+            "eos_reason": "max_new_tokens" if full else "stop_token",
+            "new_tokens": len(job.generated),
+            "prompt_tokens": job.input_ids.shape[-1],
+            "cached_tokens": job.cached_tokens,
+            "time_enqueued": job.time_first_prefill - job.time_enqueue,
+            "time_prefill": job.time_first_token - job.time_first_prefill,
+            "time_generate": now - job.time_first_token,
+        }
+
+    def _take_page(self, exclude) -> StubPage | None:
+        free = [p for h, p in self.unreferenced_pages.items() if h not in exclude]
+        return min(free, key=lambda p: p.access_serial) if free else None
+
+    def _allocate(self, job: StubJob) -> bool:
+        """Reference the job's cached prefix pages and claim free pages for the rest."""
+        needed = math.ceil((job.input_ids.shape[-1] + job.length) / self.page_size)
+        hashes = []
+        prev_hash = None
+        for page_ids in split_pages(job.input_ids, self.page_size):
+            prev_hash = page_hash(page_ids, prev_hash)
+            page = self.referenced_pages.get(prev_hash) or self.unreferenced_pages.get(
+                prev_hash
+            )
+            if page is None:
+                break
+            hashes.append(prev_hash)
+        if needed - len(hashes) > len(self.unreferenced_pages) - sum(
+            h in self.unreferenced_pages for h in hashes
+        ):
+            return False
+
+        for phash in hashes:
+            page = self.referenced_pages.get(phash) or self.unreferenced_pages.pop(
+                phash
+            )
+            page.ref_count += 1
+            self.referenced_pages[phash] = page
+            job.pages.append(page)
+        job.cached_tokens = len(hashes) * self.page_size
+        while len(job.pages) < needed:
+            page = self._take_page(hashes)
+            del self.unreferenced_pages[page.phash]
+            page.phash = os.urandom(16)
+            page.ref_count = 1
+            self.referenced_pages[page.phash] = page
+            job.pages.append(page)
+        return True
+
+    def _release(self, job: StubJob):
+        """Hash the job's full pages by content so later jobs find them, then unpin."""
+        prev_hash = None
+        full = split_pages(job.sequence(), self.page_size)
+        for i, page in enumerate(job.pages):
+            page.ref_count -= 1
+            if i < len(full):
+                phash = page_hash(full[i], prev_hash)
+                owner = self.referenced_pages.get(phash) or self.unreferenced_pages.get(
+                    phash
+                )
+                if owner is None:
+                    self._rehash(page, phash, prev_hash, full[i])
+                prev_hash = phash
+            if page.ref_count == 0:
+                del self.referenced_pages[page.phash]
+                page.access_serial = self.access_serial
+                self.access_serial += 1
+                self.unreferenced_pages[page.phash] = page
+        job.pages = []
+
+    def _rehash(self, page: StubPage, phash, prev_hash, page_ids):
+        del self.referenced_pages[page.phash]
+        page.phash = phash
+        page.prev_hash = prev_hash
+        page.sequence[:, :] = page_ids
+        page.kv_position = self.page_size
+        self.referenced_pages[phash] = page
+
+
+def load_config():
+    ModelState.active_model = SupportedModel(
+        "stub",
+        "",
+        16,
+        config.STUB_MAX_SEQ_LEN,
+        config.PROMPT_LIMIT,
+        config.RESPONSE_LIMIT,
+    )
+    ModelState.config = None
+
+
+def load_tokenizer():
+    ModelState.tokenizer_id = "stub-bytes"
+    ModelState.tokenizer = StubTokenizer()
+    ModelState.settings = StubSettings()
+
+
+def load_weights():
+    ModelState.model = StubModel()
+
+
+def load_cache():
+    ModelState.cache = StubCache(ModelState.active_model.max_seq_len)
+    ModelState.cache_layout = "StubCache"
+    ModelState.generator = StubGenerator(
+        ModelState.cache, ModelState.tokenizer, config.MAX_BATCH_SIZE
+    )
+    ModelState.job_class = StubJob
@@ -0,0 +1,58 @@
+import asyncio
+import shutil
+
+import config
+from auth import require_session
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi.responses import FileResponse, JSONResponse
+from model.batch import BATCHES
+
+router = APIRouter(prefix="/batch")
+
+
+@router.post("")
+async def submit_batch(session=Depends(require_session), file: UploadFile = File(...)):
+    """Queue a JSONL file of prompts; one ChatRequest object per line."""
+    batch_id, directory = BATCHES.new_batch(session["username"])
+    size = 0
+    with open(directory / "input.jsonl", "wb") as f:
+        while data := await file.read(config.UPLOAD_CHUNK_BYTES):
+            size += len(data)
+            if size > config.UPLOAD_MAX_BYTES:
+                shutil.rmtree(directory)
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Upload exceeds {config.UPLOAD_MAX_BYTES} bytes",
+                )
+            await asyncio.to_thread(f.write, data)
+    BATCHES.start(directory)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": f"Batch {batch_id} queued. Poll /batch/{batch_id} for progress.",
+            "batch_id": batch_id,
+        },
+    )
+
+
+@router.get("/{batch_id}")
+async def batch_status(batch_id: str, session=Depends(require_session)):
+    state = BATCHES.status(batch_directory(session, batch_id))
+    if state is None:
+        raise HTTPException(status_code=404, detail=f"No batch '{batch_id}'.")
+    return JSONResponse(content={"batch_id": batch_id, **state})
+
+
+@router.get("/{batch_id}/results")
+async def batch_results(batch_id: str, session=Depends(require_session)):
+    """Results so far as JSONL, one line per finished item."""
+    output = batch_directory(session, batch_id) / "output.jsonl"
+    if not output.exists():
+        raise HTTPException(status_code=404, detail=f"No results for '{batch_id}'.")
+    return FileResponse(output, media_type="application/jsonl")
+
+
+def batch_directory(session, batch_id: str):
+    if not batch_id.isalnum():
+        raise HTTPException(status_code=400, detail="Invalid batch id.")
+    return BATCHES.batch_dir(session["username"], batch_id)
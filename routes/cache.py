@@ -0,0 +1,12 @@
+from auth import require_session
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from model.prefix_cache import PREFIX_CACHE
+
+router = APIRouter(prefix="/cache")
+
+
+@router.get("/stats")
+async def cache_stats(session=Depends(require_session)):
+    return JSONResponse(content=PREFIX_CACHE.stats())
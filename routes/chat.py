@@ -1,51 +1,139 @@
-from pathlib import Path
+import asyncio
+import json
 
+import config
 from auth import require_session
 from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile
 from fastapi.responses import StreamingResponse
-from model.generation import continue_prompt, encode_file
+from file_store import UploadTooLarge, link_file, owns_blob, store_upload, user_file
+from model.context import get_context
+from model.generation import (
+    abort_generation,
+    admission_check,
+    continue_prompt,
+    encode_prompt,
+    response_limit,
+)
+from model.ingest import ingest_file
+from model.scheduler import SCHEDULER
+from routes.model import require_model
 from schema import ChatRequest
 
 router = APIRouter()
 
 
-@router.post("/stream")
+@router.post("/stream", dependencies=[Depends(require_model)])
 async def stream_chat(request: ChatRequest, session=Depends(require_session)):
+    ctx = get_context(session["session_id"])
+    input_ids = await asyncio.to_thread(encode_prompt, ctx, request.prompt)
+    refused = admission_check(ctx, input_ids, response_limit(request.max_tokens))
+    if refused:
+        detail, retry_after = refused
+        print(f"🚦 Refused /stream for {session['username']}: {detail}")
+        if retry_after is None:
+            raise HTTPException(status_code=413, detail=detail)
+        raise HTTPException(
+            status_code=429, detail=detail, headers={"Retry-After": str(retry_after)}
+        )
     return StreamingResponse(
-        continue_prompt(request.prompt), media_type="text/event-stream"
+        continue_prompt(ctx, request, input_ids),
+        media_type="text/event-stream",
     )
 
 
+@router.get("/queue")
+async def queue_status(session=Depends(require_session)):
+    """Queue depth, and the place in line and estimated wait of the user's requests."""
+    return await asyncio.wrap_future(
+        SCHEDULER.call(SCHEDULER.status, session["username"])
+    )
+
+
+@router.post("/abort")
+async def abort(session=Depends(require_session)):
+    if await abort_generation(get_context(session["session_id"])):
+        return {"message": "Generation aborted."}
+    return {"message": "No generation in progress."}
+
+
 @router.post("/upload")
 async def upload_file(
     session=Depends(require_session),
     file: UploadFile = File(...),
     newfilename: str = Form(None),
 ):
-    username = session["username"]
-    user_dir = Path(f"/home/ksolomon/git/karllm/karllm-server/users/{username}/files")
-    user_dir.mkdir(parents=True, exist_ok=True)
-
     target_name = newfilename or file.filename
-    target_path = user_dir / target_name
 
-    with open(target_path, "wb") as f:
-        f.write(await file.read())
+    async def chunks():
+        while data := await file.read(config.UPLOAD_CHUNK_BYTES):
+            yield data
 
-    return {"message": f"File uploaded as {target_name}"}
+    stored = await save_upload(session["username"], target_name, chunks(), file.size)
+    return {"message": f"File uploaded as {target_name}", **stored}
 
 
-@router.post("/read")
-async def read_file(data: dict, session=Depends(require_session)):
-    filename = data.get("filename")
+@router.put("/upload/{name}")
+async def upload_raw(name: str, request: Request, session=Depends(require_session)):
+    """
+    Upload a file as the raw request body, streamed straight to disk. A client that
+    sends X-Content-SHA256 with Expect: 100-continue skips the body entirely when
+    one of its own files already holds that content.
+    """
     username = session["username"]
+    digest = request.headers.get("X-Content-SHA256")
+    if digest and owns_blob(username, digest):
+        try:
+            link_file(username, name, digest)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {
+            "message": f"File uploaded as {name}",
+            "sha256": digest.lower(),
+            "deduplicated": True,
+        }
 
-    file_path = Path(
-        f"/home/ksolomon/git/karllm/karllm-server/users/{username}/files/{filename}"
+    stored = await save_upload(
+        username, name, request.stream(), request.headers.get("Content-Length")
     )
+    return {"message": f"File uploaded as {name}", **stored}
+
+
+async def save_upload(username, name, chunks, size_hint):
+    try:
+        return await store_upload(username, name, chunks, size_hint)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+@router.post("/read", dependencies=[Depends(require_model)])
+async def read_file(data: dict, session=Depends(require_session)):
+    try:
+        file_path = user_file(session["username"], data.get("filename"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found.")
 
-    injected_tokens = encode_file(file_path)
+    events = ingest_file(
+        get_context(session["session_id"]), file_path, force=data.get("force", False)
+    )
+    if data.get("stream"):
+        return StreamingResponse(sse_events(events), media_type="text/event-stream")
+
+    async for event in events:
+        if "error" in event:
+            raise HTTPException(status_code=event["status"], detail=event["error"])
+    if event.get("duplicate"):
+        start, end = event["span"]
+        return {
+            "message": f"File already in context (tokens {start}-{end}); nothing injected."
+        }
+    return {"message": f"Injected {event['tokens']} tokens into context window."}
+
 
-    return {"message": f"Injected {injected_tokens} tokens into context window."}
+async def sse_events(events):
+    async for event in events:
+        yield f"data:{json.dumps(event)}\n\n"
+    yield f"data:{json.dumps({'text': '[DONE]'})}\n\n"
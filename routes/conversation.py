@@ -1,39 +1,43 @@
-import shutil
-from pathlib import Path
+import asyncio
 
+import config
 from auth import require_session
-from fastapi import APIRouter, Depends
+from conversation_index import CONVERSATIONS, check_name, sessions_dir
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import JSONResponse
-from model.generation import start_stream
-from model.init import ModelState, load_session_into_cache
+from model.context import dir_in_use, dirs_in_use, get_context
+from model.generation import load_session_into_cache
+from model.session_log import SESSION_LOG
+from model.snapshot import save_snapshot, snapshot_path
+from routes.model import require_model
 
 router = APIRouter(prefix="/convo")
 
 
+def conversation_dir(username: str, name: str):
+    try:
+        check_name(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return sessions_dir(username) / name
+
+
 @router.post("/eraseHistory")
 async def erase_conversation_history(session=Depends(require_session)):
-    """Erase all *old* conversation session folders for this user (preserve current session)."""
+    """
+    Erase all *old* numbered conversations for this user (preserve current sessions).
+    They disappear from listings at once; their folders are deleted in the background.
+    """
     username = session["username"]
-    sessions_dir = Path("users") / username / "sessions"
-
-    current_session_dir = getattr(ModelState, "session_dir", None)
-    deleted = 0
-
-    if not sessions_dir.exists():
-        return JSONResponse(
-            status_code=404,
-            content={"message": f"No session directory found for user '{username}'."},
-        )
-
-    for subdir in sessions_dir.iterdir():
-        if subdir.is_dir() and subdir.name.isdigit():
-            if (
-                current_session_dir
-                and subdir.resolve() == Path(current_session_dir).resolve()
-            ):
-                continue  # Skip the currently active session directory
-            shutil.rmtree(subdir)
-            deleted += 1
+    index = await asyncio.to_thread(CONVERSATIONS.index, username)
+    directory = index.directory.resolve()
+    in_use = dirs_in_use()
+    names = [
+        name
+        for name in await asyncio.to_thread(index.names)
+        if name.isdigit() and directory / name not in in_use
+    ]
+    deleted = await asyncio.to_thread(CONVERSATIONS.delete, username, names)
 
     return JSONResponse(
         content={
@@ -43,35 +47,35 @@ async def erase_conversation_history(session=Depends(require_session)):
 
 
 @router.get("/list")
-async def list_conversations(session=Depends(require_session)):
-    """List all saved conversation directories for the current user."""
+async def list_conversations(
+    limit: int | None = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    order: str = Query("name", pattern="^(name|recent)$"),
+    session=Depends(require_session),
+):
+    """
+    List the current user's saved conversations from their index: by id and name,
+    or most recently used first, a page at a time.
+    """
     username = session["username"]
-    sessions_dir = Path("users") / username / "sessions"
-
-    if not sessions_dir.exists():
-        return JSONResponse(
-            status_code=404,
-            content={"message": f"No sessions found for user '{username}'."},
-        )
-
-    session_folders = [
-        d.name
-        for d in sorted(sessions_dir.iterdir())
-        if d.is_dir() and (d.name.isdigit() or d.name)
-    ]
+    index = await asyncio.to_thread(CONVERSATIONS.index, username)
+    details, total = await asyncio.to_thread(index.list, limit, offset, order)
 
     return JSONResponse(
         content={
             "username": username,
-            "conversations": session_folders,
+            "conversations": [c["name"] for c in details],
+            "details": details,
+            "total": total,
+            "offset": offset,
         }
     )
 
 
-@router.post("/switch/{name}")
+@router.post("/switch/{name}", dependencies=[Depends(require_model)])
 async def load_conversation(name: str, session=Depends(require_session)):
     username = session["username"]
-    target_dir = Path("users") / username / "sessions" / name
+    target_dir = conversation_dir(username, name)
 
     if not target_dir.exists() or not target_dir.is_dir():
         return JSONResponse(
@@ -81,20 +85,43 @@ async def load_conversation(name: str, session=Depends(require_session)):
             },
         )
 
-    start_stream()
-    ModelState.session_dir = target_dir
-    load_session_into_cache(target_dir)
+    ctx = get_context(session["session_id"])
+    if config.KV_SNAPSHOT_ON_SWITCH and ctx.session_dir and ctx.active:
+        await save_snapshot(ctx.session_dir, ctx.ids)
+    ctx.session_dir = target_dir
+    await load_session_into_cache(ctx, target_dir)
+    index = await asyncio.to_thread(CONVERSATIONS.index, username)
+    await asyncio.to_thread(index.touch, name)
 
     return JSONResponse(
         content={"message": f"Session '{name}' loaded for user '{username}'."}
     )
 
 
+@router.post("/snapshot", dependencies=[Depends(require_model)])
+async def snapshot_conversation(session=Depends(require_session)):
+    """Dump the current conversation's KV cache so /convo/switch can restore it directly."""
+    username = session["username"]
+    ctx = get_context(session["session_id"])
+    if ctx.session_dir is None or not ctx.active:
+        return JSONResponse(
+            status_code=404,
+            content={"message": f"No active conversation for user '{username}'."},
+        )
+
+    saved_tokens = await save_snapshot(ctx.session_dir, ctx.ids)
+    return JSONResponse(
+        content={
+            "message": f"Saved KV snapshot of {saved_tokens} tokens for user '{username}'."
+        }
+    )
+
+
 @router.post("/delete/{name}")
 async def delete_conversation(name: str, session=Depends(require_session)):
-    """Delete a specific session directory (if not the current one)."""
+    """Delete a specific session directory (if not the current one) in the background."""
     username = session["username"]
-    target_dir = Path("users") / username / "sessions" / name
+    target_dir = conversation_dir(username, name)
 
     if not target_dir.exists() or not target_dir.is_dir():
         return JSONResponse(
@@ -104,17 +131,13 @@ async def delete_conversation(name: str, session=Depends(require_session)):
             },
         )
 
-    current_session_dir = getattr(ModelState, "session_dir", None)
-    if (
-        current_session_dir
-        and target_dir.resolve() == Path(current_session_dir).resolve()
-    ):
+    if dir_in_use(target_dir):
         return JSONResponse(
             status_code=403,
             content={"message": f"Cannot delete active session '{name}'."},
         )
 
-    shutil.rmtree(target_dir)
+    await asyncio.to_thread(CONVERSATIONS.delete, username, [name])
     return JSONResponse(
         content={"message": f"Session '{name}' deleted for user '{username}'."}
     )
@@ -124,9 +147,9 @@ async def delete_conversation(name: str, session=Depends(require_session)):
 async def rename_conversation(old: str, new: str, session=Depends(require_session)):
     """Rename an existing conversation session."""
     username = session["username"]
-    sessions_dir = Path("users") / username / "sessions"
-    old_path = sessions_dir / old
-    new_path = sessions_dir / new
+    old_path = conversation_dir(username, old)
+    new_path = conversation_dir(username, new)
+    index = await asyncio.to_thread(CONVERSATIONS.index, username)
 
     # Validate existence
     if not old_path.exists() or not old_path.is_dir():
@@ -138,24 +161,24 @@ async def rename_conversation(old: str, new: str, session=Depends(require_sessio
         )
 
     # Prevent renaming current session
-    current_session_dir = getattr(ModelState, "session_dir", None)
-    if (
-        current_session_dir
-        and old_path.resolve() == Path(current_session_dir).resolve()
-    ):
+    if dir_in_use(old_path):
         return JSONResponse(
             status_code=403,
             content={"message": f"Cannot rename the currently active session '{old}'."},
         )
 
-    # Prevent overwriting another session
-    if new_path.exists():
+    # Prevent overwriting another session, or one still being deleted
+    if new_path.exists() or await asyncio.to_thread(index.exists, new):
         return JSONResponse(
             status_code=409,
             content={"message": f"Session name '{new}' already exists."},
         )
 
+    await asyncio.to_thread(SESSION_LOG.close, old_path)
     old_path.rename(new_path)
+    if snapshot_path(old_path).exists():
+        snapshot_path(old_path).rename(snapshot_path(new_path))
+    await asyncio.to_thread(index.rename, old, new)
     return JSONResponse(
         content={
             "message": f"Session '{old}' renamed to '{new}' for user '{username}'."
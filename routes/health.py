@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from startup import STARTUP
+
+router = APIRouter(prefix="/health")
+
+
+@router.get("/live")
+async def live():
+    return JSONResponse(content={"status": "alive"})
+
+
+@router.get("/ready")
+async def ready():
+    report = STARTUP.report()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
@@ -23,14 +23,64 @@ HELP_METADATA = [
     {
         "path": "/stream",
         "method": "POST",
-        "description": "Stream model response for a given prompt",
-        "body": {"prompt": "str: Input text prompt"},
+        "description": "Stream model response for a given prompt; while queued, "
+        "events carry {queue: {position, estimated_wait}}. 429 with Retry-After "
+        "when the estimated wait or free KV cache rules the request out",
+        "body": {
+            "prompt": "str: Input text prompt",
+            "ngram": "bool (optional): Draft tokens by matching the session's context (prompt lookup). Off by default. Drafting is batch-wide: it only runs while every answer being generated has asked for it",
+            "max_tokens": "int (optional): Answer length limit, capped by the model's",
+            "stop": "list[str] (optional): End the answer before any of these strings",
+            "stop_token_ids": "list[int] (optional): End the answer at any of these tokens",
+            "temperature, top_k, top_p, min_p": "(optional): Sampling overrides for this answer",
+            "greedy": "bool (optional): Always pick the most likely token",
+            "instructions": "bool (optional): Keep this prompt as instructions that context eviction never drops (up to the instruction limit)",
+        },
+    },
+    {
+        "path": "/queue",
+        "method": "GET",
+        "description": "Requests waiting for the model, with your requests' position and estimated wait",
+    },
+    {
+        "path": "/upload",
+        "method": "POST",
+        "description": "Upload a file (multipart); identical content is stored once",
+        "body": {
+            "file": "file: Content to upload",
+            "newfilename": "str (optional): Name to store the file under",
+        },
+    },
+    {
+        "path": "/upload/{name}",
+        "method": "PUT",
+        "description": "Upload a file as the raw body; X-Content-SHA256 skips content you already uploaded",
+    },
+    {
+        "path": "/read",
+        "method": "POST",
+        "description": "Inject an uploaded file into the conversation context",
+        "body": {
+            "filename": "str: Name of a file uploaded with /upload",
+            "stream": "bool (optional): Report progress as server-sent events",
+            "force": "bool (optional): Inject again even if already in context",
+        },
+    },
+    {
+        "path": "/abort",
+        "method": "POST",
+        "description": "Stop the response currently streaming for this session",
     },
     {
         "path": "/clear",
         "method": "POST",
         "description": "Clear current conversation context (but preserve session)",
     },
+    {
+        "path": "/context",
+        "method": "GET",
+        "description": "Token usage of the conversation context by span, and the budget",
+    },
     {
         "path": "/clearall",
         "method": "POST",
@@ -44,18 +94,28 @@ HELP_METADATA = [
     {
         "path": "/convo/eraseHistory",
         "method": "POST",
-        "description": "Delete all old session folders except the current one",
+        "description": "Delete all old session folders except the current one (in the background)",
     },
     {
         "path": "/convo/list",
         "method": "GET",
-        "description": "List saved session folders for the user",
+        "description": "List saved conversations with token counts, sizes and last use",
+        "query": {
+            "limit": "int (optional): Page size, at most 1000 (default: all)",
+            "offset": "int (optional): Conversations to skip",
+            "order": "str (optional): 'name' (default) or 'recent' for last used first",
+        },
     },
     {
         "path": "/convo/switch/{name}",
         "method": "POST",
         "description": "Switch to a different conversation session by name",
     },
+    {
+        "path": "/convo/snapshot",
+        "method": "POST",
+        "description": "Save the current conversation's KV cache for instant switching",
+    },
     {
         "path": "/convo/delete/{name}",
         "method": "POST",
@@ -79,7 +139,48 @@ HELP_METADATA = [
     {
         "path": "/model/set/{name}",
         "method": "POST",
-        "description": "Change running LLM to specified model.",
+        "description": "Swap the running LLM in-process; sessions are kept.",
+    },
+    {
+        "path": "/model/status",
+        "method": "GET",
+        "description": "Progress of a model swap and whether the model is ready.",
+    },
+    {
+        "path": "/cache/stats",
+        "method": "GET",
+        "description": "Prefix cache hit rate, saved prefill tokens and evictions.",
+    },
+    {
+        "path": "/health/live",
+        "method": "GET",
+        "description": "Liveness probe; answers as soon as the server is up",
+    },
+    {
+        "path": "/health/ready",
+        "method": "GET",
+        "description": "Readiness probe with per-stage startup timings (503 until ready)",
+    },
+    {
+        "path": "/batch",
+        "method": "POST",
+        "description": "Queue a JSONL file of prompts for offline batched generation",
+        "body": {"file": "JSONL: one /stream body per line, plus an optional id"},
+    },
+    {
+        "path": "/batch/{id}",
+        "method": "GET",
+        "description": "Progress and throughput of a batch",
+    },
+    {
+        "path": "/batch/{id}/results",
+        "method": "GET",
+        "description": "Finished batch items as JSONL, with token counts and timings",
+    },
+    {
+        "path": "/metrics",
+        "method": "GET",
+        "description": "Prometheus metrics: latency/throughput histograms, queue and KV gauges",
     },
     {
         "path": "/help",
@@ -0,0 +1,79 @@
+from auth import ACTIVE_SESSIONS
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from metrics import REGISTRY
+
+from model.admission import ADMISSION
+from model.init import ModelState, active_model_name
+from model.scheduler import SCHEDULER
+
+router = APIRouter()
+
+
+def _per_model(value):
+    return lambda: [((active_model_name(),), value())]
+
+
+def _queued() -> int:
+    generator = ModelState.generator
+    pending = len(generator.pending_jobs) if generator is not None else 0
+    return SCHEDULER.inbox.qsize() + len(SCHEDULER.queue) + pending
+
+
+def _kv_used() -> int:
+    # The dynamic generator pages its cache; referenced pages hold live sequences
+    generator = ModelState.generator
+    if generator is None:
+        return 0
+    return len(generator.referenced_pages) * generator.page_size
+
+
+def _kv_capacity() -> int:
+    generator = ModelState.generator
+    return generator.max_total_tokens if generator is not None else 0
+
+
+REGISTRY.gauge(
+    "karllm_active_sessions",
+    "Authenticated sessions that have not expired.",
+    _per_model(ACTIVE_SESSIONS.count),
+    labels=("model",),
+)
+REGISTRY.gauge(
+    "karllm_queue_depth",
+    "Requests waiting to join the decode batch.",
+    _per_model(_queued),
+    labels=("model",),
+)
+REGISTRY.gauge(
+    "karllm_active_sequences",
+    "Sequences in the running decode batch.",
+    _per_model(lambda: len(SCHEDULER.active)),
+    labels=("model",),
+)
+REGISTRY.gauge(
+    "karllm_kv_cache_tokens_used",
+    "Tokens held by KV cache pages in use by a sequence.",
+    _per_model(_kv_used),
+    labels=("model",),
+)
+REGISTRY.gauge(
+    "karllm_kv_cache_tokens_capacity",
+    "Tokens the KV cache can hold (max_seq_len).",
+    _per_model(_kv_capacity),
+    labels=("model",),
+)
+
+REGISTRY.gauge(
+    "karllm_estimated_wait_seconds",
+    "Estimated time for queued and running interactive work, used to shed load.",
+    _per_model(lambda: ADMISSION.estimated_wait() or 0.0),
+    labels=("model",),
+)
+
+
+@router.get("/metrics")
+async def metrics():
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
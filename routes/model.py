@@ -1,17 +1,12 @@
-import shutil
-import subprocess
-from pathlib import Path
-
 from auth import require_session
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import JSONResponse
 
-from model.generation import start_stream
-from model.init import ModelState, load_session_into_cache
+from model.init import ModelState
+from model.manager import MODEL_MANAGER
 from model.SupportedModel import (
     SUPPORTED_MODELS,
     SupportedModel,
-    get_active_model,
     get_model_by_name,
 )
 
@@ -35,21 +30,43 @@ async def load_model(name: str, session=Depends(require_session)):
             status_code=406,
             content={"message": f"Model '{name}' not supported."},
         )
-    model.set_model()
-    # TODO: Reload the server & add error handling
-    print("reloading model")
-    subprocess.run(["pkill", "-f", "python server.py"])
+    active = ModelState.active_model
+    if active is not None and active.name == name and ModelState.model_ready:
+        return JSONResponse(content={"message": f"Model '{name}' is already loaded."})
+    if not MODEL_MANAGER.start_swap(model):
+        return JSONResponse(
+            status_code=409,
+            content={"message": "A model swap is already in progress."},
+        )
     return JSONResponse(
-        content={"message": f"Model '{name}' loaded. Server will restart now..."}
+        status_code=202,
+        content={
+            "message": f"Swapping to model '{name}'. Poll /model/status for progress."
+        },
     )
 
 
+@router.get("/status")
+async def model_status(session=Depends(require_session)):
+    return JSONResponse(content=MODEL_MANAGER.status())
+
+
 @router.get("/get")
 async def get_model(session=Depends(require_session)):
-    model = get_active_model()
-    if model is None:
+    # The model in memory, not active_model.json, which a swap rewrites up front
+    if ModelState.active_model is None:
         return JSONResponse(
             status_code=407,
             content={"message": "Active Model is NONE"},
         )
-    return JSONResponse(content={"model": f"'{model.name}'"})
+    return JSONResponse(content={"model": f"'{ModelState.active_model.name}'"})
+
+
+def require_model():
+    """Reject model-backed requests with 503 while no model is loaded."""
+    if not ModelState.model_ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Model is loading, try again shortly.",
+            headers={"Retry-After": "5"},
+        )
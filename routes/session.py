@@ -1,13 +1,14 @@
-from datetime import datetime
-from pathlib import Path
+import asyncio
 
-import config
 from auth import ACTIVE_SESSIONS, require_session, verify_jwt_and_create_session
+from conversation_index import CONVERSATIONS
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
 
+from model.budget import context_usage
+from model.context import get_context
 from model.generation import start_stream
-from model.init import ModelState
+from routes.model import require_model
 
 router = APIRouter()
 
@@ -24,25 +25,18 @@ async def connect(request: Request, session=Depends(verify_jwt_and_create_sessio
     username = session["username"]
     body = await request.json()
     save_interactions = body.get("saveInteractions", False)
-    ModelState.save_interactions = save_interactions
     session_id = session["session_id"]
 
-    if session_id in ACTIVE_SESSIONS:
-        ACTIVE_SESSIONS[session_id]["saveInteractions"] = save_interactions
+    session_dir = await asyncio.to_thread(CONVERSATIONS.allocate, username)
+    ACTIVE_SESSIONS.update(
+        session_id, saveInteractions=save_interactions, session_dir=str(session_dir)
+    )
 
-    base_sessions_dir = Path(config.SESSION_DIR) / username / "sessions"
-    base_sessions_dir.mkdir(parents=True, exist_ok=True)
-    existing = [
-        int(d.name)
-        for d in base_sessions_dir.iterdir()
-        if d.is_dir() and d.name.isdigit()
-    ]
-    new_id = max(existing) + 1 if existing else 0
-    session_dir = base_sessions_dir / str(new_id)
-    session_dir.mkdir()
-
-    ModelState.session_dir = session_dir
-    start_stream()
+    ctx = get_context(session_id)
+    ctx.session_dir = session_dir
+    ctx.save_interactions = save_interactions
+    ctx.username = username
+    await start_stream(ctx)
 
     return {
         "message": f"Authenticated as {username}",
@@ -53,21 +47,22 @@ async def connect(request: Request, session=Depends(verify_jwt_and_create_sessio
 
 @router.post("/keepalive")
 async def keepalive(session=Depends(require_session)):
-    for sid, s in ACTIVE_SESSIONS.items():
-        if s is session:
-            ACTIVE_SESSIONS[sid]["last_seen"] = datetime.utcnow()
-            break
+    ACTIVE_SESSIONS.touch(session["session_id"])
     return {"message": "Keep-alive acknowledged."}
 
 
 @router.post("/clear")
 async def clear(session=Depends(require_session)):
-    # TODO:
-    start_stream()
+    await start_stream(get_context(session["session_id"]))
     return JSONResponse(content={"message": "Context cleared."})
 
 
 @router.post("/clearall")
 async def clear_all(session=Depends(require_session)):
-    start_stream()
+    await start_stream(get_context(session["session_id"]))
     return JSONResponse(content={"message": "All context cleared."})
+
+
+@router.get("/context", dependencies=[Depends(require_model)])
+async def context(session=Depends(require_session)):
+    return JSONResponse(content=context_usage(get_context(session["session_id"])))
@@ -1,12 +1,19 @@
 import uvicorn
 from fastapi import FastAPI
 
-import model
+from auth import ACTIVE_SESSIONS
+from model.batch import BATCHES
+from model.scheduler import SCHEDULER
+from routes.batch import router as batch_router
+from routes.cache import router as cache_router
 from routes.chat import router as chat_router
 from routes.conversation import router as convo_router
+from routes.health import router as health_router
 from routes.help import router as help_router
+from routes.metrics import router as metrics_router
 from routes.model import router as model_router
 from routes.session import router as session_router
+from startup import STARTUP
 
 app = FastAPI()
 app.include_router(chat_router)
@@ -14,11 +21,19 @@ app.include_router(session_router)
 app.include_router(convo_router)
 app.include_router(help_router)
 app.include_router(model_router)
+app.include_router(cache_router)
+app.include_router(health_router)
+app.include_router(metrics_router)
+app.include_router(batch_router)
 
 
 @app.on_event("startup")
 async def startup_event():
-    model.init.load_model()
+    # Serve health probes right away; the model loads in the background
+    STARTUP.start()
+    SCHEDULER.start()
+    ACTIVE_SESSIONS.start()
+    BATCHES.resume()
 
 
 if __name__ == "__main__":
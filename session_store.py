@@ -0,0 +1,200 @@
+import heapq
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import config
+
+
+class MemorySessionBackend:
+    """Sessions in a dict, with an expiry heap so sweeps only look at due entries."""
+
+    def __init__(self):
+        self.sessions = {}  # session_id -> (data, expires_at)
+        self.heap = []  # (expires_at, session_id); stale entries skipped on pop
+        self.lock = threading.Lock()
+
+    def put(self, session_id, data, expires_at):
+        with self.lock:
+            self.sessions[session_id] = (data, expires_at)
+            heapq.heappush(self.heap, (expires_at, session_id))
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def touch(self, session_id, expires_at) -> bool:
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return False
+            self.sessions[session_id] = (entry[0], expires_at)
+            heapq.heappush(self.heap, (expires_at, session_id))
+            if len(self.heap) > 2 * len(self.sessions) + 64:
+                self.heap = [(e, s) for s, (_, e) in self.sessions.items()]
+                heapq.heapify(self.heap)
+            return True
+
+    def delete(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def count(self, now) -> int:
+        return sum(
+            1 for _, expires_at in list(self.sessions.values()) if expires_at > now
+        )
+
+    def expire(self, now) -> list:
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                expires_at, session_id = heapq.heappop(self.heap)
+                entry = self.sessions.get(session_id)
+                if entry is not None and entry[1] == expires_at:
+                    del self.sessions[session_id]
+                    expired.append(session_id)
+        return expired
+
+
+class SqliteSessionBackend:
+    """
+    Sessions in a local SQLite file, so they survive restarts and can be shared by
+    several worker processes. WAL mode lets readers run alongside the writer.
+    """
+
+    def __init__(self, path):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(path), timeout=5.0, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS sessions_expiry ON sessions (expires_at)"
+            )
+
+    def put(self, session_id, data, expires_at):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (session_id, json.dumps(data), expires_at),
+            )
+
+    def get(self, session_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT data, expires_at FROM sessions WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def touch(self, session_id, expires_at) -> bool:
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "UPDATE sessions SET expires_at = ? WHERE session_id = ?",
+                (expires_at, session_id),
+            )
+        return cursor.rowcount > 0
+
+    def delete(self, session_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def count(self, now) -> int:
+        with self.lock:
+            return self.db.execute(
+                "SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (now,)
+            ).fetchone()[0]
+
+    def expire(self, now) -> list:
+        with self.lock, self.db:
+            expired = [
+                sid
+                for (sid,) in self.db.execute(
+                    "SELECT session_id FROM sessions WHERE expires_at <= ?", (now,)
+                )
+            ]
+            self.db.execute("DELETE FROM sessions WHERE expires_at <= ?", (now,))
+        return expired
+
+
+class SessionStore:
+    """
+    Authenticated sessions keyed by session token, expiring SESSION_TIMEOUT after
+    their last keepalive. A background thread sweeps expired sessions and runs the
+    `on_expire` callbacks for each, so stale sessions don't pile up unseen.
+    """
+
+    def __init__(self, backend, timeout_seconds):
+        self.backend = backend
+        self.timeout = timeout_seconds
+        self.on_expire = []  # Callbacks taking the expired session_id
+        self.thread = None
+
+    def create(self, session_id, **data) -> dict:
+        session = {"session_id": session_id, **data}
+        self.backend.put(session_id, session, time.time() + self.timeout)
+        return session
+
+    def get(self, session_id) -> dict | None:
+        """The live session for a token, or None if it is unknown or expired."""
+        entry = self.backend.get(session_id)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            self.delete(session_id)
+            return None
+        return entry[0]
+
+    def update(self, session_id, **fields):
+        entry = self.backend.get(session_id)
+        if entry is not None:
+            self.backend.put(session_id, {**entry[0], **fields}, entry[1])
+
+    def touch(self, session_id) -> bool:
+        """Push a session's expiry out by the full timeout."""
+        return self.backend.touch(session_id, time.time() + self.timeout)
+
+    def delete(self, session_id):
+        self.backend.delete(session_id)
+        self._expired([session_id])
+
+    def count(self) -> int:
+        """Number of unexpired sessions."""
+        return self.backend.count(time.time())
+
+    def sweep(self):
+        self._expired(self.backend.expire(time.time()))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._run, name="session-sweeper", daemon=True
+            )
+            self.thread.start()
+
+    def _expired(self, session_ids):
+        for session_id in session_ids:
+            for callback in self.on_expire:
+                callback(session_id)
+
+    def _run(self):
+        while True:
+            time.sleep(config.SESSION_SWEEP_SECONDS)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"❌ Session sweep failed: {e}")
+
+
+def open_session_store(timeout_seconds) -> SessionStore:
+    """Session store with the backend selected by config.SESSION_STORE."""
+    if config.SESSION_STORE == "sqlite":
+        backend = SqliteSessionBackend(config.SESSION_STORE_PATH)
+    else:
+        backend = MemorySessionBackend()
+    return SessionStore(backend, timeout_seconds)
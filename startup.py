@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+from auth import KEYRING
+from model.init import (
+    ModelState,
+    load_cache,
+    load_config,
+    load_tokenizer,
+    load_weights,
+    warmup,
+)
+
+STAGES = ("config", "keys", "tokenizer", "weights", "cache", "warmup")
+
+
+class Startup:
+    """
+    Server startup split into timed stages.
+
+    Stages run in worker threads so the event loop keeps answering health probes
+    while the model loads. Independent stages run concurrently:
+
+        config -> tokenizer + weights -> cache -> warmup
+        keys runs alongside all of them
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.task = None
+        self.stages = {
+            name: {"state": "pending", "seconds": None, "error": None}
+            for name in STAGES
+        }
+
+    @property
+    def ready(self) -> bool:
+        return all(stage["state"] == "done" for stage in self.stages.values())
+
+    def start(self):
+        """Run the startup stages in the background on the running event loop."""
+        self.started = time.time()
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        print("🔁 Starting up...")
+        results = await asyncio.gather(
+            self._stage("keys", KEYRING.load),
+            self._load_model(),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"❌ Startup failed: {result}")
+        if self.ready:
+            print(f"✅ Ready in {time.time() - self.started:.1f}s")
+
+    async def _load_model(self):
+        await self._stage("config", load_config)
+        await asyncio.gather(
+            self._stage("tokenizer", load_tokenizer),
+            self._stage("weights", load_weights),
+        )
+        await self._stage("cache", load_cache)
+        await self._stage("warmup", warmup)
+        ModelState.model_ready = True
+
+    async def _stage(self, name, fn):
+        stage = self.stages[name]
+        stage["state"] = "running"
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(fn)
+        except Exception as e:
+            stage["state"] = "failed"
+            stage["error"] = str(e)
+            raise
+        finally:
+            stage["seconds"] = round(time.perf_counter() - start, 3)
+        stage["state"] = "done"
+        print(f"⏱️ Startup stage '{name}' took {stage['seconds']:.2f}s")
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready and ModelState.model_ready,
+            "model_ready": ModelState.model_ready,
+            "uptime": round(time.time() - self.started, 1),
+            "stages": self.stages,
+        }
+
+
+STARTUP = Startup()
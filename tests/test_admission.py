@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import config
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from auth import require_session
+from model.admission import ADMISSION, Admission
+from model.context import SESSION_CONTEXTS, SessionContext
+from model.init import ModelState
+from model.stub import StubTokenizer
+from routes.chat import router
+from routes.model import require_model
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_MAX_WAIT_SECONDS", 30)
+    monkeypatch.setattr(config, "ADMISSION_KV_CHECK", True)
+    return Admission()
+
+
+def test_admits_when_idle_and_without_rates(admission):
+    assert admission.check(1000, 100, 10, 100) is None
+
+
+def test_refuses_when_the_estimated_wait_is_too_long(admission):
+    admission.prefill_rate = 1000.0
+    admission.decode_rate = 10.0
+    admission.work = (0, 10 * config.MAX_BATCH_SIZE * 40, 0)  # 40s of decode
+    reason, retry_after = admission.check(100000, 0, 10, 10)
+    assert "overloaded" in reason
+    assert retry_after == 10
+
+
+def test_refuses_a_request_larger_than_the_empty_cache(admission):
+    reason, retry_after = admission.check(1000, 900, 50, 100)
+    assert "KV cache" in reason
+    assert retry_after is None
+
+
+def test_refuses_while_the_cache_is_held(admission):
+    admission.work = (0, 0, 800)
+    reason, retry_after = admission.check(1000, 100, 50, 100)
+    assert "Not enough KV cache" in reason
+    assert retry_after >= 1
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_MAX_WAIT_SECONDS", 30)
+    monkeypatch.setattr(config, "CONTEXT_POLICY", "error")
+    monkeypatch.setattr(ModelState, "tokenizer", StubTokenizer())
+    monkeypatch.setattr(ModelState, "generator", SimpleNamespace(max_total_tokens=4096))
+    monkeypatch.setattr(ModelState, "settings", SimpleNamespace(length=256))
+    monkeypatch.setitem(SESSION_CONTEXTS, "s", SessionContext("s", username="u"))
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[require_model] = lambda: None
+    app.dependency_overrides[require_session] = lambda: {
+        "session_id": "s",
+        "username": "u",
+    }
+    return TestClient(app)
+
+
+def test_stream_returns_429_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(ADMISSION, "prefill_rate", 1000.0)
+    monkeypatch.setattr(ADMISSION, "decode_rate", 10.0)
+    monkeypatch.setattr(ADMISSION, "work", (0, 10 * config.MAX_BATCH_SIZE * 60, 0))
+    response = client.post("/stream", json={"prompt": "hi", "max_tokens": 16})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) == 30
+
+
+def test_stream_returns_413_for_a_request_the_cache_cannot_hold(client, monkeypatch):
+    monkeypatch.setattr(ADMISSION, "work", (0, 0, 0))
+    monkeypatch.setattr(ADMISSION, "prefill_rate", None)
+    response = client.post("/stream", json={"prompt": "x" * 4000, "max_tokens": 200})
+    assert response.status_code == 413
@@ -0,0 +1,64 @@
+import base64
+import json
+import time
+
+from authlib.jose import JsonWebKey, jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+from auth import KeyRing, peek_token, release_session
+from model.context import SESSION_CONTEXTS
+from model.kvpool import KV_POOL, SessionPages
+from model.scheduler import SCHEDULER
+
+
+def test_peek_token_rejects_non_object_segments():
+    # Both segments decode to JSON lists ("[]"), not objects
+    assert peek_token("W10.W10.x") == ({}, {})
+    assert peek_token("not-a-token") == ({}, {})
+
+
+def test_expired_session_releases_its_pages(monkeypatch):
+    monkeypatch.setattr(SCHEDULER, "call", lambda fn, *args: fn(*args))
+    KV_POOL.sessions["expired"] = SessionPages()
+    SESSION_CONTEXTS["expired"] = object()
+    release_session("expired")
+    assert "expired" not in KV_POOL.sessions
+    assert "expired" not in SESSION_CONTEXTS
+
+
+def _segment(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def _keyring(monkeypatch):
+    private = Ed25519PrivateKey.generate()
+    public_pem = private.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    keyring = KeyRing()
+    monkeypatch.setattr(keyring, "refresh", lambda: None)
+    keyring.keys = {"alice": JsonWebKey.import_key(public_pem, {"kty": "OKP"})}
+    keyring.kids = {"alice": "alice"}
+    private_pem = private.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    return keyring, private_pem
+
+
+def test_verify_accepts_an_eddsa_token(monkeypatch):
+    keyring, private_pem = _keyring(monkeypatch)
+    claims = {"sub": "alice", "exp": int(time.time()) + 60}
+    token = jwt.encode({"alg": "EdDSA", "kid": "alice"}, claims, private_pem)
+    assert keyring.verify(token.decode()) == "alice"
+
+
+def test_verify_rejects_other_algorithms(monkeypatch):
+    keyring, _ = _keyring(monkeypatch)
+    claims = _segment({"sub": "alice"})
+    for alg in ("HS256", "RS256", "none"):
+        token = f"{_segment({'alg': alg, 'kid': 'alice'})}.{claims}.c2ln"
+        assert keyring.verify(token) is None
+        assert keyring.candidates(token) == []
@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import config
+import torch
+
+from model.budget import fit_context, record_turn
+from model.context import SessionContext
+from model.init import ModelState
+
+
+def _model(monkeypatch, window, reserve=0):
+    monkeypatch.setattr(ModelState, "active_model", SimpleNamespace(max_seq_len=window))
+    monkeypatch.setattr(ModelState, "settings", SimpleNamespace(length=reserve))
+    monkeypatch.setattr(config, "CONTEXT_POLICY", "sliding")
+    monkeypatch.setattr(config, "CONTEXT_EVICT_HEADROOM", 0)
+
+
+def _turn(ctx, prompt, response, instructions=False):
+    ctx.ids = torch.cat([ctx.ids, torch.arange(prompt + response).unsqueeze(0)], -1)
+    return record_turn(ctx, prompt, response, instructions)
+
+
+def test_opening_prompt_is_not_pinned_unless_asked(monkeypatch):
+    monkeypatch.setattr(config, "CONTEXT_PIN_INSTRUCTIONS", False)
+    ctx = SessionContext()
+    assert not _turn(ctx, 10, 5)
+    assert [(s.kind, s.pinned) for s in ctx.spans] == [("turn", False)]
+    assert _turn(ctx, 10, 5, instructions=True)
+    assert [(s.kind, s.pinned) for s in ctx.spans][1:] == [
+        ("instructions", True),
+        ("turn", False),
+    ]
+
+
+def test_sliding_eviction_keeps_pinned_spans(monkeypatch):
+    _model(monkeypatch, window=100)
+    ctx = SessionContext()
+    _turn(ctx, 20, 10, instructions=True)
+    _turn(ctx, 20, 20)
+    _turn(ctx, 20, 20)
+    assert fit_context(ctx, 30) is None
+    # The oldest unpinned turns went; the instructions stayed at the front
+    assert ctx.ids.shape[-1] == 60
+    assert [(s.kind, s.length) for s in ctx.spans] == [
+        ("instructions", 20),
+        ("turn", 40),
+    ]
+
+
+def test_pinned_spans_alone_can_refuse(monkeypatch):
+    _model(monkeypatch, window=50)
+    ctx = SessionContext()
+    ctx.ids = torch.zeros((1, 40), dtype=torch.long)
+    ctx.add_span("file", 40, pinned=True)
+    assert "Pinned spans" in fit_context(ctx, 20)
+    assert ctx.ids.shape[-1] == 40
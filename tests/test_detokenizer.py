@@ -0,0 +1,53 @@
+from model.detokenizer import IncrementalDetokenizer, StopStrings
+from model.stub import StubTokenizer
+
+
+def _stream(text):
+    """Feed `text` one stub token (one UTF-8 byte) at a time."""
+    tokenizer = StubTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    ids = tokenizer.encode(text).flatten().tolist()
+    pieces = [detokenizer.add([token]) for token in ids]
+    return pieces, detokenizer
+
+
+def test_multibyte_characters_are_held_until_complete():
+    pieces, detokenizer = _stream("a€b")
+    # "€" is three bytes: nothing is sent until the last one arrives
+    assert pieces == ["a", "", "", "€", "b"]
+    assert detokenizer.finish() == ""
+
+
+def test_finish_flushes_an_incomplete_tail():
+    tokenizer = StubTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    ids = tokenizer.encode("€").flatten().tolist()
+    assert detokenizer.add(ids[:2]) == ""
+    assert detokenizer.finish() == "\ufffd"
+
+
+def _cut(stops, pieces):
+    stopper = StopStrings(stops)
+    sent = [stopper.add(piece) for piece in pieces]
+    return sent, stopper
+
+
+def test_stop_string_split_across_pieces_is_never_partly_sent():
+    sent, stopper = _cut(["</s>"], ["done<", "/", "s>", " more"])
+    assert sent == ["done", "", "", ""]
+    assert stopper.hit == "</s>"
+    assert stopper.finish() == ""
+
+
+def test_held_prefix_is_released_when_no_stop_follows():
+    sent, stopper = _cut(["END"], ["the E", "NORMOUS"])
+    assert sent == ["the ", "ENORMOUS"]
+    sent, stopper = _cut(["END"], ["the EN"])
+    assert sent == ["the "]
+    assert stopper.finish() == "EN"
+
+
+def test_earliest_stop_string_wins():
+    sent, stopper = _cut(["b", "abc"], ["xab", "c"])
+    assert sent == ["xa", ""]
+    assert stopper.hit == "b"
@@ -0,0 +1,103 @@
+import config
+import pytest
+
+from model.admission import Admission
+from model.fair_queue import FairQueue, TokenBucket
+
+
+class _Request:
+    def __init__(self, username, cost, priority, max_new_tokens):
+        self.username = username
+        self.cost = cost
+        self.priority = priority
+        self.max_new_tokens = max_new_tokens
+        self.generated = []
+
+
+def _request(user, cost=100, priority="interactive", max_new_tokens=50):
+    return _Request(user, cost, priority, max_new_tokens)
+
+
+@pytest.fixture(autouse=True)
+def _settings(monkeypatch):
+    monkeypatch.setattr(config, "QUEUE_QUANTUM_TOKENS", 100)
+    monkeypatch.setattr(config, "QUEUE_USER_WEIGHTS", {})
+    monkeypatch.setattr(config, "USER_RATE_LIMITS", {})
+    monkeypatch.setattr(config, "USER_TOKENS_PER_SECOND", 0)
+    monkeypatch.setattr(config, "MAX_BATCH_SIZE", 2)
+
+
+def _drain(queue):
+    order = []
+    while (request := queue.pop()) is not None:
+        order.append(request)
+    return order
+
+
+def test_users_take_turns_whatever_they_queued():
+    queue = FairQueue()
+    alice = [_request("alice") for _ in range(3)]
+    bob = [_request("bob") for _ in range(2)]
+    for request in alice + bob:
+        queue.push(request)
+    users = [request.username for request in _drain(queue)]
+    assert users == ["alice", "bob", "alice", "bob", "alice"]
+
+
+def test_deficit_round_robin_weighs_by_cost():
+    queue = FairQueue()
+    big = _request("alice", cost=300)
+    small = [_request("bob", cost=100) for _ in range(3)]
+    for request in [big, *small]:
+        queue.push(request)
+    # Alice's 300-token request waits until she has saved three quanta
+    users = [request.username for request in _drain(queue)]
+    assert users == ["bob", "bob", "alice", "bob"]
+
+
+def test_priority_classes_are_strict():
+    queue = FairQueue()
+    batch = _request("alice", priority="batch")
+    interactive = _request("bob")
+    queue.push(batch)
+    queue.push(interactive)
+    assert _drain(queue) == [interactive, batch]
+
+
+def test_positions_follow_start_order():
+    queue = FairQueue()
+    for request in [_request("alice"), _request("alice"), _request("bob")]:
+        queue.push(request)
+    positions = list(queue.positions())
+    assert [place for _, place in positions] == [1, 2, 3]
+    assert [r for r, _ in positions] == _drain(queue)
+
+
+def test_token_bucket_refills_up_to_burst():
+    bucket = TokenBucket(rate=10, burst=100)
+    bucket.tokens = 0
+    assert bucket.wait(50, bucket.updated + 2) == pytest.approx(3.0)
+    bucket.refill(bucket.updated + 60)
+    assert bucket.tokens == 100
+
+
+def test_rate_limited_user_waits_while_others_run(monkeypatch):
+    monkeypatch.setattr(config, "USER_RATE_LIMITS", {"alice": (10, 100)})
+    queue = FairQueue()
+    first, second = _request("alice"), _request("alice")
+    bob = _request("bob")
+    for request in (first, second, bob):
+        queue.push(request)
+    assert _drain(queue) == [first, bob]  # Alice's bucket is empty after one
+    assert queue.estimate(second, 0.0) > 0
+
+
+def test_slot_waits_count_remaining_decode_of_running_answers():
+    admission = Admission()
+    admission.prefill_rate, admission.decode_rate = 1000.0, 10.0
+    running = [_request("alice", max_new_tokens=50) for _ in range(2)]
+    running[0].generated = [0] * 30  # 2s of its answer left, the other 5s
+    waiting = [_request("bob", cost=150, max_new_tokens=50) for _ in range(2)]
+    waits = admission.slot_waits(running, waiting)
+    assert waits[waiting[0]] == pytest.approx(2.0)
+    assert waits[waiting[1]] == pytest.approx(5.0)
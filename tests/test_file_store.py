@@ -0,0 +1,34 @@
+import asyncio
+import hashlib
+
+import config
+from file_store import blob_path, file_digest, owns_blob, store_upload, user_file
+
+
+async def _chunks(data: bytes):
+    yield data
+
+
+def _store(username, name, data):
+    return asyncio.run(store_upload(username, name, _chunks(data)))
+
+
+def test_blobs_live_outside_the_user_folders(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SESSION_DIR", str(tmp_path / "users") + "/")
+    monkeypatch.setattr(config, "BLOB_DIR", str(tmp_path / "blobs") + "/")
+    stored = _store("alice", "a.txt", b"hello")
+    assert stored["sha256"] == hashlib.sha256(b"hello").hexdigest()
+    assert blob_path(stored["sha256"]).is_relative_to(tmp_path / "blobs")
+    assert file_digest(user_file("alice", "a.txt")) == stored["sha256"]
+
+
+def test_only_the_owner_may_skip_the_body(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SESSION_DIR", str(tmp_path / "users") + "/")
+    monkeypatch.setattr(config, "BLOB_DIR", str(tmp_path / "blobs") + "/")
+    digest = _store("alice", "secret.txt", b"alice's secret")["sha256"]
+    assert owns_blob("alice", digest)
+    assert owns_blob("alice", digest.upper())
+    assert not owns_blob("mallory", digest)
+    # Uploading the same content proves mallory has it; only then does it dedupe
+    assert _store("mallory", "mine.txt", b"alice's secret")["deduplicated"]
+    assert owns_blob("mallory", digest)
@@ -0,0 +1,50 @@
+import torch
+
+from model.context import SessionContext
+from model.generation import (
+    _encoded_for,
+    encode_prompt,
+    generation_stats,
+    tokens_for_text,
+)
+from model.init import ModelState
+from model.stub import StubTokenizer
+
+
+def test_tokens_for_text_drops_tokens_past_the_cut(monkeypatch):
+    tokenizer = StubTokenizer()
+    monkeypatch.setattr(ModelState, "tokenizer", tokenizer)
+    ids = tokenizer.encode("over the fox").flatten().tolist()
+    kept = tokens_for_text(ids, "over")
+    assert kept == ids[:4]
+    assert tokenizer.decode_(kept) == "over"
+
+
+def test_tokens_for_text_keeps_everything_without_a_cut(monkeypatch):
+    tokenizer = StubTokenizer()
+    monkeypatch.setattr(ModelState, "tokenizer", tokenizer)
+    ids = tokenizer.encode("over").flatten().tolist()
+    assert tokens_for_text(ids, "over") == ids
+    assert tokens_for_text(ids, "") == []
+
+
+def test_encoded_for_notices_a_context_change(monkeypatch):
+    monkeypatch.setattr(ModelState, "tokenizer", StubTokenizer())
+    ctx = SessionContext()
+    input_ids = encode_prompt(ctx, "hi")
+    assert _encoded_for(ctx, input_ids)
+    ctx.ids = torch.tensor([[5, 6]])  # Another request answered meanwhile
+    assert not _encoded_for(ctx, input_ids)
+    assert _encoded_for(ctx, encode_prompt(ctx, "hi"))
+
+
+def test_rate_counts_decode_time_only():
+    # 2s queued and prefilling before the first token must not lower the rate
+    result = {"new_tokens": 41, "time_generate": 2.0, "eos_reason": "stop_token"}
+    assert generation_stats(result, 41, 4.0)["tokens_per_second"] == 20.0
+
+
+def test_cancelled_job_rate_falls_back_to_streamed_time():
+    result = {"eos": True, "eos_reason": "stop_string"}
+    assert generation_stats(result, 11, 0.5)["tokens_per_second"] == 20.0
+    assert generation_stats(result, 1, 0.0)["tokens_per_second"] == 0.0
@@ -0,0 +1,23 @@
+import config
+
+from model.init import cached_json
+
+
+def test_cached_json_builds_once_then_reads_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "STARTUP_CACHE_DIR", str(tmp_path))
+    calls = []
+
+    def build():
+        calls.append(1)
+        return {"pieces": ["<s>", "▁a", "\ud800"]}
+
+    assert cached_json("vocab", "k", build) == cached_json("vocab", "k", build)
+    assert len(calls) == 1
+    assert not list(tmp_path.glob("*.pkl"))
+
+
+def test_cached_json_rebuilds_an_unreadable_copy(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "STARTUP_CACHE_DIR", str(tmp_path))
+    (tmp_path / "vocab-k.json").write_text("{truncated")
+    assert cached_json("vocab", "k", lambda: {"pieces": []}) == {"pieces": []}
+    assert cached_json("vocab", "k", lambda: None) == {"pieces": []}
@@ -0,0 +1,36 @@
+import threading
+
+import torch
+
+from model.session_log import SessionLogWriter, read_log
+
+
+def test_close_on_fresh_writer_returns(tmp_path):
+    writer = SessionLogWriter()
+    closer = threading.Thread(target=writer.close, args=(tmp_path,), daemon=True)
+    closer.start()
+    closer.join(timeout=5)
+    assert not closer.is_alive()
+    assert writer.thread is None
+
+
+def test_close_after_append_flushes(tmp_path):
+    writer = SessionLogWriter()
+    prompt = torch.tensor([[1, 2, 3]])
+    response = torch.tensor([[4, 5]])
+    writer.append(tmp_path, prompt, response, 0, 5)
+    writer.close(tmp_path)
+    [(prompt_ids, response_ids, instructions)] = read_log(tmp_path)
+    assert prompt_ids.tolist() == [[1, 2, 3]]
+    assert response_ids.tolist() == [[4, 5]]
+    assert not instructions
+
+
+def test_is_open_tracks_handles(tmp_path):
+    writer = SessionLogWriter()
+    assert not writer.is_open(tmp_path)
+    writer.append(tmp_path, torch.tensor([[1]]), torch.tensor([[2]]), 0, 2)
+    writer.flush()
+    assert writer.is_open(tmp_path)
+    writer.close(tmp_path)
+    assert not writer.is_open(tmp_path)
@@ -0,0 +1,48 @@
+import pytest
+
+from session_store import MemorySessionBackend, SessionStore, SqliteSessionBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SqliteSessionBackend(tmp_path / "sessions.db")
+    return MemorySessionBackend()
+
+
+def test_expire_returns_only_due_sessions(backend):
+    backend.put("a", {"session_id": "a"}, 10)
+    backend.put("b", {"session_id": "b"}, 20)
+    assert backend.expire(15) == ["a"]
+    assert backend.get("a") is None
+    assert backend.get("b") == ({"session_id": "b"}, 20)
+    assert backend.count(15) == 1
+
+
+def test_touch_postpones_expiry(backend):
+    backend.put("a", {"session_id": "a"}, 10)
+    assert backend.touch("a", 30)
+    # The stale expiry left behind by the touch must not remove the session
+    assert backend.expire(15) == []
+    assert backend.expire(30) == ["a"]
+    assert not backend.touch("a", 40)
+
+
+def test_expired_session_is_gone_and_reported():
+    store = SessionStore(MemorySessionBackend(), timeout_seconds=0)
+    expired = []
+    store.on_expire.append(expired.append)
+    store.create("a", username="u")
+    assert store.get("a") is None
+    assert expired == ["a"]
+    assert store.count() == 0
+
+
+def test_sweep_runs_callbacks_for_each_expired_session():
+    store = SessionStore(MemorySessionBackend(), timeout_seconds=-1)
+    expired = []
+    store.on_expire.append(expired.append)
+    store.create("a")
+    store.create("b")
+    store.sweep()
+    assert sorted(expired) == ["a", "b"]
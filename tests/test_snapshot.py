@@ -0,0 +1,37 @@
+import torch
+from safetensors import safe_open
+
+from model.snapshot import SnapshotWriter
+
+
+def _page(value, dtype=torch.float16):
+    return [torch.full((1, 4, 2), value, dtype=dtype), torch.full((1, 4), value)]
+
+
+def test_writer_streams_pages_and_records_the_count(tmp_path):
+    path = tmp_path / "0.kv.safetensors"
+    ids = torch.arange(12).reshape(1, -1)
+    writer = SnapshotWriter(path, ids, 3, _page(0), {"format": "test"})
+    writer.write([_page(1), _page(2)])
+    writer.write([_page(3)])
+    writer.finish()
+
+    with safe_open(str(path), framework="pt", device="cpu") as f:
+        assert f.metadata() == {"format": "test", "pages": "3"}
+        assert torch.equal(f.get_tensor("ids"), ids)
+        kv = f.get_slice("kv.0")
+        assert kv.get_shape() == [3, 1, 4, 2]
+        assert torch.equal(kv[1:3][0], _page(2)[0])
+        assert torch.equal(f.get_tensor("kv.1")[2], _page(3)[1])
+    assert not writer.tmp_path.exists()
+
+
+def test_writer_keeps_fewer_pages_than_planned(tmp_path):
+    path = tmp_path / "0.kv.safetensors"
+    writer = SnapshotWriter(path, torch.arange(12), 3, _page(0), {})
+    writer.write([_page(7)])  # The other two pages were evicted meanwhile
+    writer.finish()
+
+    with safe_open(str(path), framework="pt", device="cpu") as f:
+        assert f.metadata()["pages"] == "1"
+        assert torch.equal(f.get_slice("kv.0")[0:1][0], _page(7)[0])